@@ -0,0 +1,232 @@
+"""Publishing, tagging and deleting many of a user's photos at once.
+
+The photo edit and delete views change one photo per request, and their
+signal receivers keep the random photo pool, tag cloud, tag index,
+search documents, profile counters and fragment generations up to date
+photo by photo. Here a selection of photo ids is changed with set-based
+writes a chunk of ids at a time, bypassing those receivers, and what
+they maintain is refreshed once at the end, as the importer does.
+
+Selections of more than BULK_INLINE_LIMIT photos are run by a bulk job
+instead, which counts the photos it has done so clients can follow its
+progress. Images and renditions of deleted photos are removed from
+storage afterwards by a collect job.
+"""
+import json
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+from taggit.models import TaggedItem
+from user_profile.models import reconcile_counters, update_tag_count
+
+from .generations import bump
+from .membership import chunks
+from .models import (
+    Album, Job, Photo, PhotoMetadata, PhotoRendition, PhotoTag,
+    SearchDocument, Thumbnail, tag_key
+)
+from .sampler import invalidate_pool
+from .search import index_photos
+from .storage import collect
+from .tagcloud import invalidate_cloud
+from .tagindex import get_or_create_tags
+
+
+BULK_INLINE_LIMIT = 1000
+
+# Rows which refer to a photo, deleted before the photos themselves.
+PHOTO_ROWS = (
+    Job, PhotoMetadata, PhotoRendition, PhotoTag, SearchDocument, Thumbnail,
+)
+
+
+def inline_limit():
+    """Return the most photos an operation is run on during a request."""
+    return getattr(settings, 'BULK_INLINE_LIMIT', BULK_INLINE_LIMIT)
+
+
+def owned(user, photo_ids):
+    """Return the ids of the user's photos among photo_ids."""
+    return list(Photo.objects.filter(
+        user=user, id__in=photo_ids
+    ).values_list('id', flat=True))
+
+
+def publish_photos(user, photo_ids, published, progress=None):
+    """Set the published state of the user's photos among photo_ids.
+
+    Each chunk is one UPDATE of the photos whose state changes. Returns
+    the number changed."""
+    changed = done = 0
+    for chunk in chunks(photo_ids):
+        changed += Photo.objects.filter(user=user, id__in=chunk).exclude(
+            published=published
+        ).update(published=published, date_modified=timezone.now())
+        done += len(chunk)
+        if progress is not None:
+            progress(done)
+    if changed:
+        invalidate_pool()
+        bump(user.pk, 'photos', 'albums', 'tags')
+        reconcile_counters(user)
+    return changed
+
+
+def tag_photos(user, photo_ids, add=(), remove=(), progress=None):
+    """Add tags to and remove tags from the user's photos among photo_ids.
+
+    Tags are matched by name regardless of case. Each chunk is written to
+    taggit's table and the tag index with one insert and one delete
+    each, skipping photos which already have a tag being added. Returns
+    the number of photos tagged."""
+    content_type = ContentType.objects.get_for_model(Photo)
+    added = dict(
+        (tag_id, lower_name)
+        for lower_name, tag_id in get_or_create_tags(add).items()
+    )
+    removed = set(tag_key(name) for name in remove)
+    tagged = done = 0
+    for chunk in chunks(photo_ids):
+        with transaction.atomic():
+            ids = owned(user, chunk)
+            if added:
+                present = set(TaggedItem.objects.filter(
+                    content_type=content_type, object_id__in=ids,
+                    tag_id__in=list(added),
+                ).values_list('object_id', 'tag_id'))
+                new = [(photo_id, tag_id) for photo_id in ids
+                       for tag_id in added
+                       if (photo_id, tag_id) not in present]
+                TaggedItem.objects.bulk_create(
+                    TaggedItem(content_type=content_type, object_id=photo_id,
+                               tag_id=tag_id)
+                    for photo_id, tag_id in new
+                )
+                PhotoTag.objects.bulk_create(
+                    PhotoTag(user=user, photo_id=photo_id, tag_id=tag_id,
+                             key=tag_key(added[tag_id]))
+                    for photo_id, tag_id in new
+                )
+            if removed:
+                entries = PhotoTag.objects.filter(
+                    user=user, photo_id__in=ids, key__in=removed
+                )
+                tag_ids = set(entries.values_list('tag_id', flat=True))
+                TaggedItem.objects.filter(
+                    content_type=content_type, object_id__in=ids,
+                    tag_id__in=tag_ids,
+                ).delete()
+                entries.delete()
+            index_photos(ids)
+        tagged += len(ids)
+        done += len(chunk)
+        if progress is not None:
+            progress(done)
+    if tagged:
+        invalidate_cloud(user.pk)
+        bump(user.pk, 'tags')
+        update_tag_count(user.pk)
+    return tagged
+
+
+def delete_photos(user, photo_ids, progress=None):
+    """Delete the user's photos among photo_ids.
+
+    Each chunk is deleted in a transaction: albums using a photo as
+    their cover lose it, and the rows referring to the photos are
+    deleted before the photos, all without loading them. Their images
+    and renditions are left for a collect job to remove. Returns the
+    number deleted."""
+    content_type = ContentType.objects.get_for_model(Photo)
+    deleted = done = 0
+    for chunk in chunks(photo_ids):
+        with transaction.atomic():
+            photos = Photo.objects.filter(user=user, id__in=chunk)
+            rows = list(photos.values_list('id', 'photo'))
+            ids = [photo_id for photo_id, _ in rows]
+            if ids:
+                images = [name for _, name in rows if name]
+                renditions = list(PhotoRendition.objects.filter(
+                    photo_id__in=ids
+                ).values_list('image', flat=True))
+                Album.objects.filter(cover_id__in=ids).update(
+                    cover=None, date_modified=timezone.now()
+                )
+                Album.photos.through.objects.filter(photo_id__in=ids).delete()
+                TaggedItem.objects.filter(
+                    content_type=content_type, object_id__in=ids
+                ).delete()
+                # _raw_delete is how Django deletes rows it needn't
+                # collect or signal for; everything referring to the
+                # photos is gone by now.
+                for model in PHOTO_ROWS:
+                    referring = model.objects.filter(photo_id__in=ids)
+                    referring._raw_delete(referring.db)
+                photos = Photo.objects.filter(id__in=ids)
+                photos._raw_delete(photos.db)
+                Job.objects.create(kind='collect', user=user, data=json.dumps(
+                    dict(images=images, renditions=renditions)
+                ))
+        deleted += len(ids)
+        done += len(chunk)
+        if progress is not None:
+            progress(done)
+    if deleted:
+        invalidate_pool()
+        invalidate_cloud(user.pk)
+        bump(user.pk, 'photos', 'albums', 'tags')
+        reconcile_counters(user)
+    return deleted
+
+
+OPERATIONS = {
+    'publish': publish_photos,
+    'tag': tag_photos,
+    'delete': delete_photos,
+}
+
+
+def run_operation(user, operation, photo_ids, **options):
+    """Run an operation on photo_ids now, or queue a bulk job for it if
+    there are more than inline_limit().
+
+    Returns the number of photos changed and None, or None and the job."""
+    photo_ids = list(photo_ids)
+    if len(photo_ids) <= inline_limit():
+        return OPERATIONS[operation](user, photo_ids, **options), None
+    job = Job.objects.create(
+        kind='bulk', user=user, total=len(photo_ids), data=json.dumps(dict(
+            operation=operation, photos=photo_ids, options=options
+        )),
+    )
+    return None, job
+
+
+def bulk_job(job):
+    """Job handler running a bulk operation, counting its progress."""
+    data = json.loads(job.data)
+
+    def progress(done):
+        job.done = done
+        Job.objects.filter(id=job.id).update(
+            done=done, date_modified=timezone.now()
+        )
+
+    OPERATIONS[data['operation']](
+        job.user, data['photos'], progress=progress, **data['options']
+    )
+
+
+def collect_job(job):
+    """Job handler removing the images and renditions of deleted photos.
+
+    Images are only removed if no other photo refers to them, and are
+    left to another collect job while one is being saved again."""
+    data = json.loads(job.data)
+    for name in data['images']:
+        collect(name)
+    storage = PhotoRendition._meta.get_field('image').storage
+    for name in data['renditions']:
+        storage.delete(name)
@@ -0,0 +1,107 @@
+"""Conditional GET support for photo, album and library pages.
+
+Each page gets a state function which returns a few cheap aggregates
+(counts, latest modification times and the largest tag link id) of the
+objects the page shows. The state is hashed into an ETag together with
+the user and the full path, so a client revalidating an unchanged page
+gets a 304 Not Modified without the page being rendered.
+
+Tag links carry no timestamps, so no Last-Modified header is sent: a
+client revalidating with If-Modified-Since alone would miss tag changes.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from taggit.models import TaggedItem
+
+from .metadata import filtering
+from .models import Album, Photo, PhotoMetadata, PhotoRendition
+
+
+def conditional(state_func):
+    """Decorate a view to answer conditional GETs using state_func.
+
+    state_func is called with the view's arguments and returns a dict
+    of values which change whenever the view's response would."""
+    def decorator(view):
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            etag = make_etag(request, state_func(request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    response['ETag'] = quote_etag(etag)
+                    patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return inner
+    return decorator
+
+
+def make_etag(request, state):
+    """Hash the user, full path and state of a page into an ETag."""
+    key = repr((request.user.pk, request.get_full_path(), sorted(state.items())))
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def photos_state(photos, prefix='photos'):
+    """Return the count and latest modification of photos and their tags."""
+    state = photos.aggregate(**{
+        prefix: Count('id'),
+        prefix + '_modified': Max('date_modified'),
+    })
+    tags = TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Photo),
+        object_id__in=photos.values('id'),
+    ).aggregate(tags=Count('id'), last_tag=Max('id'))
+    state.update((prefix + '_' + key, value) for key, value in tags.items())
+    return state
+
+
+def metadata_state(request):
+    """Return the state of the user's photo metadata, if the request
+    filters photos by it."""
+    if not filtering(request):
+        return {}
+    return PhotoMetadata.objects.filter(user=request.user).aggregate(
+        metadata=Count('photo'), metadata_extracted=Max('date_extracted')
+    )
+
+
+def library_state(request, *args, **kwargs):
+    """Return the state of the user's library."""
+    state = photos_state(request.user.photos.all())
+    state.update(metadata_state(request))
+    state.update(request.user.albums.aggregate(
+        albums=Count('id'),
+        albums_modified=Max('date_modified'),
+    ))
+    return state
+
+
+def album_state(request, album_id):
+    """Return the state of an album and the photos in it."""
+    album = request.user.albums.filter(id=album_id)
+    state = album.aggregate(
+        album_modified=Max('date_modified'),
+        album_photos=Count('photos'),
+    )
+    state.update(Album.photos.through.objects.filter(
+        album__in=album
+    ).aggregate(last_album_photo=Max('id')))
+    state.update(photos_state(Photo.objects.filter(albums__in=album)))
+    return state
+
+
+def photo_state(request, photo_id):
+    """Return the state of a single photo and its renditions."""
+    photo = request.user.photos.filter(id=photo_id)
+    state = photos_state(photo)
+    state.update(PhotoRendition.objects.filter(photo__in=photo).aggregate(
+        renditions=Count('id'), last_rendition=Max('id')
+    ))
+    return state
@@ -0,0 +1,190 @@
+"""Near-duplicate photos, found by perceptual hashes of their images.
+
+A dhash job hashes each new or replaced image: the image is shrunk to
+9x8 grey pixels, and each of the 64 bits of its hash says whether a
+pixel is brighter than the one to its right. Exports of the same shot at
+other sizes, qualities or formats hash to the same or nearly the same
+bits, so photos whose hashes differ in at most MAX_DISTANCE bits are
+taken to be near-duplicates.
+
+Each hash is also split into BANDS bands of 16 bits. Two hashes
+differing in fewer bits than there are bands agree on at least one band,
+so only photos sharing a band are ever compared, rather than every pair
+in the library. The bands are stored in columns indexed by user, which
+make a multi-index hash table for looking up the near-duplicates of one
+photo; grouping a whole library reads its hashes once and matches the
+bands in memory, and the groups are cached until the user's photos
+change.
+"""
+from django.core.cache import cache
+from django.db.models import Q
+import numpy
+from PIL import Image
+
+from .generations import bump, fragment_timeout, get_generations
+from .models import Photo
+
+
+HASH_WIDTH = 8
+HASH_HEIGHT = 8
+
+# How many times the hashed size JPEGs are decoded at, at least, before
+# being shrunk. Decoding at the hashed size itself loses bits.
+DRAFT_SCALE = 8
+
+BANDS = 4
+BAND_BITS = 16
+BAND_FIELDS = tuple('dhash_band{}'.format(band) for band in range(BANDS))
+
+MAX_DISTANCE = BANDS - 1
+
+
+def dhash(image):
+    """Return the 64 bit difference hash of an opened image, signed to
+    fit a BigIntegerField.
+
+    JPEGs which haven't been loaded yet are decoded at a reduced scale."""
+    size = (HASH_WIDTH + 1, HASH_HEIGHT)
+    image.draft('L', (size[0] * DRAFT_SCALE, size[1] * DRAFT_SCALE))
+    small = image.convert('L').resize(size, Image.ANTIALIAS)
+    pixels = numpy.asarray(small, dtype=numpy.int16)
+    brighter = pixels[:, :-1] > pixels[:, 1:]
+    return int(numpy.packbits(brighter).view('>i8')[0])
+
+
+def hash_fields(value):
+    """Return the Photo fields holding a hash and its bands."""
+    fields = dict(dhash=value)
+    for band, name in enumerate(BAND_FIELDS):
+        fields[name] = (value >> (band * BAND_BITS)) & (2 ** BAND_BITS - 1)
+    return fields
+
+
+def distances(value, hashes):
+    """Return the number of bits in which each of hashes differs from value,
+    or from the matching one of an array of values."""
+    differences = numpy.bitwise_xor(
+        numpy.asarray(hashes, dtype=numpy.int64),
+        numpy.asarray(value, dtype=numpy.int64),
+    )
+    bits = numpy.unpackbits(differences.view(numpy.uint8))
+    return bits.reshape(len(differences), 64).sum(axis=1)
+
+
+def hash_photo(photo):
+    """Hash photo's image into its dhash fields.
+
+    The fields are written with an update, so the photo isn't saved and
+    its modification time doesn't change."""
+    with photo.photo.storage.open(photo.photo.name) as f:
+        fields = hash_fields(dhash(Image.open(f)))
+    Photo.objects.filter(id=photo.id).update(**fields)
+    if photo.user_id is not None:
+        bump(photo.user_id, 'photos')
+    return fields['dhash']
+
+
+def dhash_job(job):
+    """Job handler hashing the image of the job's photo."""
+    if job.photo is not None and job.photo.photo:
+        hash_photo(job.photo)
+
+
+def candidates(photo):
+    """Return the other photos of photo's owner sharing a band with it:
+    the (user, dhash_band) indexes."""
+    shared = Q()
+    for name, value in hash_fields(photo.dhash).items():
+        if name != 'dhash':
+            shared |= Q(**{'user_id': photo.user_id, name: value})
+    return Photo.objects.filter(shared).exclude(id=photo.id)
+
+
+def near_duplicates(photo):
+    """Return the other photos of photo's owner within MAX_DISTANCE bits
+    of it, closest first, each with its distance."""
+    if photo.dhash is None:
+        return []
+    found = list(candidates(photo))
+    if not found:
+        return []
+    apart = distances(photo.dhash, [other.dhash for other in found])
+    for other, distance in zip(found, apart):
+        other.distance = int(distance)
+    found = [other for other in found if other.distance <= MAX_DISTANCE]
+    found.sort(key=lambda other: (other.distance, other.id))
+    return found
+
+
+def close_pairs(hashes, bands):
+    """Return the pairs of rows which share a band and are within
+    MAX_DISTANCE bits of each other, as two arrays of row numbers.
+
+    Each band's values are sorted, so rows sharing a value are runs, and
+    rows offset apart in a run are compared all at once for each offset
+    up to the length of the longest run."""
+    firsts, seconds = [], []
+    for band in range(BANDS):
+        order = numpy.argsort(bands[:, band], kind='mergesort')
+        values = bands[order, band]
+        offset = 1
+        while offset < len(values):
+            same = values[offset:] == values[:-offset]
+            if not same.any():
+                break
+            first, second = order[:-offset][same], order[offset:][same]
+            close = distances(hashes[first], hashes[second]) <= MAX_DISTANCE
+            firsts.append(first[close])
+            seconds.append(second[close])
+            offset += 1
+    if not firsts:
+        return [], []
+    return numpy.concatenate(firsts), numpy.concatenate(seconds)
+
+
+def find_groups(user):
+    """Return the ids of user's near-duplicate photos, in groups.
+
+    Photos are grouped with every photo within MAX_DISTANCE bits of
+    them. The hashes are read in one pass, then only photos in the same
+    band are compared. Groups and the photos in them are in upload
+    order."""
+    rows = list(Photo.objects.filter(
+        user=user, dhash__isnull=False
+    ).order_by('date_uploaded', 'id').values_list(
+        'id', 'dhash', *BAND_FIELDS
+    ))
+    if not rows:
+        return []
+    table = numpy.array([row[1:] for row in rows], dtype=numpy.int64)
+    parents = list(range(len(rows)))
+
+    def root(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for first, second in zip(*close_pairs(table[:, 0], table[:, 1:])):
+        first, second = sorted((root(first), root(second)))
+        parents[second] = first
+    groups = {}
+    for index, row in enumerate(rows):
+        groups.setdefault(root(index), []).append(row[0])
+    return [group for _, group in sorted(groups.items()) if len(group) > 1]
+
+
+def groups_key(user_id, generation):
+    """Return the cache key of a user's near-duplicate groups."""
+    return 'image:duplicates:{}:{}'.format(user_id, generation)
+
+
+def duplicate_groups(user):
+    """Return the ids of user's near-duplicate photos, in groups, cached
+    until the user's photos change."""
+    key = groups_key(user.pk, get_generations(user.pk)['photos'])
+    groups = cache.get(key)
+    if groups is None:
+        groups = find_groups(user)
+        cache.set(key, groups, fragment_timeout())
+    return groups
@@ -0,0 +1,14 @@
+"""factory_boy factories for the image app's models.
+
+Used by the tests and by the benchmark commands, which need real images
+to seed their data with.
+"""
+from factory.django import DjangoModelFactory, ImageField
+
+from .models import Photo
+
+
+class PhotoFactory(DjangoModelFactory):
+    class Meta(object):
+        model = Photo
+    photo = ImageField()
@@ -0,0 +1,68 @@
+"""Per-user generation counters for keying cached page fragments.
+
+Each user has a counter for their photos, albums and tags which is
+bumped whenever one of them changes. Fragments are cached under keys
+which include the counters they depend on, so a change makes the
+fragments showing the old state unreachable at once, rather than
+waiting for them to expire.
+
+Counters missing from the cache start from the current time in
+milliseconds instead of zero, so a counter which was evicted can never
+come back at a value an old fragment was cached under.
+
+Counters are bumped once the change commits: a page rendered between a
+bump and the commit would cache the old state under the new counter.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+GENERATIONS = ('photos', 'albums', 'tags')
+
+
+def generation_key(user_id, name):
+    """Return the cache key of one of a user's generation counters."""
+    return 'image:generation:{}:{}'.format(user_id, name)
+
+
+def fresh_generation():
+    """Return a starting value for a counter which isn't cached."""
+    return int(time.time() * 1000)
+
+
+def get_generations(user_id):
+    """Return a dict of the user's generation counters, by name."""
+    keys = dict((generation_key(user_id, name), name) for name in GENERATIONS)
+    found = cache.get_many(list(keys))
+    generations = {}
+    for key, name in keys.items():
+        if key not in found:
+            fresh = fresh_generation()
+            cache.add(key, fresh, None)
+            found[key] = cache.get(key, fresh)
+        generations[name] = found[key]
+    return generations
+
+
+def bump(user_id, *names):
+    """Advance the named generation counters of a user once the current
+    transaction commits, or at once outside a transaction."""
+    transaction.on_commit(lambda: advance(user_id, names))
+
+
+def advance(user_id, names):
+    """Advance the named generation counters of a user now."""
+    for name in names:
+        key = generation_key(user_id, name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, fresh_generation(), None)
+
+
+def fragment_timeout():
+    """Return the number of seconds cached fragments are kept for."""
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
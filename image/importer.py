@@ -0,0 +1,216 @@
+"""Bulk import of photos from a directory of images.
+
+Images are decoded, validated and hashed on a process pool, then the
+photos are created in batches with bulk_create, along with their
+perceptual hashes, tags, album memberships, metadata, search documents
+and thumbnail jobs.
+Images which the user already has (by content hash) are skipped, so an
+interrupted import can simply be run again.
+"""
+import os
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File
+from django.db import transaction
+from PIL import Image, IptcImagePlugin
+from taggit.models import TaggedItem
+from user_profile.models import reconcile_counters
+
+from .models import Album, Job, Photo, PhotoMetadata, PhotoTag, tag_key
+from .duplicates import dhash, hash_fields
+from .generations import bump
+from .metadata import decode_text, image_metadata
+from .sampler import invalidate_pool
+from .search import index_photos
+from .storage import photo_storage
+from .tagcloud import invalidate_cloud
+from .tagindex import get_or_create_tags
+
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.tif', '.tiff', '.webp', '.bmp')
+
+# EXIF tag Windows writes keywords to, as semicolon separated UTF-16.
+XP_KEYWORDS = 0x9c9e
+
+# IPTC record 2, dataset 25 holds keywords.
+IPTC_KEYWORDS = (2, 25)
+
+
+def find_images(directory):
+    """Yield the paths of image files under directory, in a stable order."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def read_keywords(image):
+    """Return the keywords in an image's EXIF or IPTC metadata."""
+    keywords = []
+    exif = getattr(image, '_getexif', lambda: None)() or {}
+    if XP_KEYWORDS in exif:
+        keywords.extend(decode_text(exif[XP_KEYWORDS]).split(';'))
+    iptc = IptcImagePlugin.getiptcinfo(image) or {}
+    values = iptc.get(IPTC_KEYWORDS, [])
+    if not isinstance(values, list):
+        values = [values]
+    keywords.extend(decode_text(value) for value in values)
+    return [keyword.strip() for keyword in keywords if keyword.strip()]
+
+
+def inspect_image(path):
+    """Decode, validate and hash the image at path.
+
+    Runs in the worker processes, so it only returns plain data: the
+    path, the hashed storage name, perceptual hash, keywords and
+    metadata, or an error message."""
+    try:
+        with open(path, 'rb') as f:
+            image = Image.open(f)
+            keywords = read_keywords(image)
+            metadata = image_metadata(image)
+            image.load()
+            perceptual_hash = dhash(image)
+            f.seek(0)
+            name = photo_storage.hashed_name(path, File(f))
+    except Exception as error:
+        return dict(path=path, error=str(error))
+    return dict(path=path, name=name, dhash=perceptual_hash,
+                keywords=keywords, metadata=metadata)
+
+
+class Importer(object):
+    """Creates photos for a user from inspected images, batch by batch."""
+
+    def __init__(self, user, published='Public', album=None, tags=()):
+        self.user = user
+        self.published = published
+        self.album = album
+        self.tags = list(tags)
+        self.content_type = ContentType.objects.get_for_model(Photo)
+        self.imported = 0
+        self.skipped = 0
+        self.failed = []
+
+    def import_batch(self, images):
+        """Create photos for a batch of inspected images."""
+        new = {}
+        for image in images:
+            if 'error' in image:
+                self.failed.append((image['path'], image['error']))
+            elif image['name'] in new:
+                self.skipped += 1
+            else:
+                new[image['name']] = image
+        existing = Photo.objects.filter(user=self.user, photo__in=list(new))
+        for name in existing.values_list('photo', flat=True):
+            del new[name]
+            self.skipped += 1
+        if not new:
+            return 0
+        with transaction.atomic():
+            for name, image in new.items():
+                with open(image['path'], 'rb') as f:
+                    photo_storage.save_hashed(name, File(f))
+            Photo.objects.bulk_create(
+                Photo(
+                    user=self.user,
+                    photo=name,
+                    title=self.title(image['path']),
+                    published=self.published,
+                    **hash_fields(image['dhash'])
+                )
+                for name, image in new.items()
+            )
+            ids = dict(Photo.objects.filter(
+                user=self.user, photo__in=list(new)
+            ).values_list('photo', 'id'))
+            self.add_tags(dict(
+                (ids[name], image['keywords'] + self.tags)
+                for name, image in new.items()
+            ))
+            index_photos(ids.values())
+            PhotoMetadata.objects.bulk_create(
+                PhotoMetadata(photo_id=ids[name], user=self.user,
+                              **image['metadata'])
+                for name, image in new.items()
+            )
+            if self.album is not None:
+                Album.photos.through.objects.bulk_create(
+                    Album.photos.through(album=self.album, photo_id=pk)
+                    for pk in ids.values()
+                )
+            Job.objects.bulk_create(
+                Job(kind=kind, photo_id=pk)
+                for pk in ids.values()
+                for kind in ('thumbnails', 'renditions')
+            )
+        self.imported += len(new)
+        return len(new)
+
+    def title(self, path):
+        """Return a photo title from an image's file name."""
+        return os.path.splitext(os.path.basename(path))[0][:128]
+
+    def add_tags(self, photo_tags):
+        """Tag photos, given a dict of photo ids to lists of tag names."""
+        tags = get_or_create_tags(
+            name for names in photo_tags.values() for name in names
+        )
+        if not tags:
+            return
+        TaggedItem.objects.bulk_create(
+            TaggedItem(
+                content_type=self.content_type,
+                object_id=photo_id,
+                tag_id=tag_id,
+            )
+            for photo_id, names in photo_tags.items()
+            for tag_id in set(tags[name.lower()] for name in names)
+        )
+        PhotoTag.objects.bulk_create(
+            PhotoTag(user=self.user, photo_id=photo_id, tag_id=tag_id, key=key)
+            for photo_id, names in photo_tags.items()
+            for key, tag_id in set(
+                (tag_key(name), tags[name.lower()]) for name in names
+            )
+        )
+
+    def finish(self):
+        """Refresh state which bulk_create bypassed signals for."""
+        if self.imported and self.published == 'Public':
+            invalidate_pool()
+        invalidate_cloud(self.user.pk)
+        bump(self.user.pk, 'photos', 'albums', 'tags')
+        reconcile_counters(self.user)
+
+
+def run_import(importer, paths, pool=None, batch_size=500, report=None):
+    """Inspect images at paths on pool and import them in batches.
+
+    report, if given, is called after each batch with the number of
+    images handled so far and the elapsed time in seconds."""
+    start = time.time()
+    if pool is not None:
+        images = pool.imap_unordered(inspect_image, paths, chunksize=16)
+    else:
+        images = map(inspect_image, paths)
+    batch = []
+    seen = 0
+    for image in images:
+        batch.append(image)
+        if len(batch) >= batch_size:
+            importer.import_batch(batch)
+            seen += len(batch)
+            batch = []
+            if report is not None:
+                report(seen, time.time() - start)
+    if batch:
+        importer.import_batch(batch)
+        seen += len(batch)
+        if report is not None:
+            report(seen, time.time() - start)
+    importer.finish()
+    return seen, time.time() - start
@@ -0,0 +1,163 @@
+"""A small database-backed job queue.
+
+Jobs are rows of the Job model. Anything which needs slow work done
+outside of the request cycle enqueues a job, and the process_jobs
+management command claims pending jobs and runs them on a local process
+pool. Handlers are looked up by the job's kind in HANDLERS.
+
+A job which fails is queued again until it has been attempted
+MAX_ATTEMPTS times. Jobs still running JOB_TIMEOUT seconds after they
+were claimed or last reported progress are taken to belong to a worker
+which died, and are reclaimed the same way.
+"""
+from datetime import timedelta
+import multiprocessing
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+MAX_ATTEMPTS = 3
+
+JOB_TIMEOUT = 60 * 60
+
+
+HANDLERS = {
+    'thumbnails': 'image.thumbnails.thumbnails_job',
+    'renditions': 'image.renditions.renditions_job',
+    'metadata': 'image.metadata.metadata_job',
+    'dhash': 'image.duplicates.dhash_job',
+    'bulk': 'image.bulk.bulk_job',
+    'collect': 'image.bulk.collect_job',
+}
+
+
+def max_attempts():
+    """Return how many times a job is attempted before it is failed."""
+    return getattr(settings, 'JOB_MAX_ATTEMPTS', MAX_ATTEMPTS)
+
+
+def job_timeout():
+    """Return the seconds a job may run without progress."""
+    return getattr(settings, 'JOB_TIMEOUT', JOB_TIMEOUT)
+
+
+def enqueue(kind, photo=None):
+    """Queue a job of kind, unless an identical one is already pending.
+
+    A partial unique index allows one pending job of each kind per
+    photo, so concurrent saves can't both queue one. Without it, the
+    first of any duplicates is used."""
+    try:
+        job, _ = Job.objects.get_or_create(
+            kind=kind, photo=photo, status='pending'
+        )
+    except Job.MultipleObjectsReturned:
+        job = Job.objects.filter(
+            kind=kind, photo=photo, status='pending'
+        ).order_by('id').first()
+    return job
+
+
+def claim(kind=None, limit=None):
+    """Mark pending jobs as running and return their ids.
+
+    A job is only claimed if it is still pending when it is updated, so
+    several workers can claim from the same queue."""
+    pending = Job.objects.filter(status='pending').order_by('id')
+    if kind is not None:
+        pending = pending.filter(kind=kind)
+    if limit is not None:
+        pending = pending[:limit]
+    claimed = []
+    for job_id in pending.values_list('id', flat=True):
+        updated = Job.objects.filter(id=job_id, status='pending').update(
+            status='running', attempts=F('attempts') + 1,
+            date_modified=timezone.now(),
+        )
+        if updated:
+            claimed.append(job_id)
+    return claimed
+
+
+def retry_status(attempts):
+    """Return the status of a job which didn't finish after attempts."""
+    return 'pending' if attempts < max_attempts() else 'failed'
+
+
+def requeue(job_id, status, **fields):
+    """Move a running job to status, or fail it if it would be a second
+    pending job of its kind for its photo. Returns whether it moved."""
+    running = Job.objects.filter(id=job_id, status='running')
+    try:
+        with transaction.atomic():
+            return running.update(status=status, **fields)
+    except IntegrityError:
+        return running.update(status='failed', **fields)
+
+
+def run_job(job_id):
+    """Run a claimed job and record whether it succeeded.
+
+    Either outcome is only recorded while the job is still running, so
+    a job deleted along with its photo meanwhile stays deleted."""
+    job = Job.objects.select_related('photo').get(id=job_id)
+    try:
+        import_string(HANDLERS[job.kind])(job)
+    except Exception:
+        requeue(job.id, retry_status(job.attempts),
+                error=traceback.format_exc(), done=job.done,
+                date_modified=timezone.now())
+        return False
+    Job.objects.filter(id=job.id, status='running').update(
+        status='done', error='', done=job.done, date_modified=timezone.now()
+    )
+    return True
+
+
+def reclaim(timeout=None):
+    """Queue again, or fail, jobs running for more than timeout seconds
+    without progress, returning how many there were."""
+    if timeout is None:
+        timeout = job_timeout()
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status='running', date_modified__lt=now - timedelta(seconds=timeout)
+    )
+    reclaimed = 0
+    for job_id, attempts in stale.values_list('id', 'attempts'):
+        reclaimed += requeue(
+            job_id, retry_status(attempts), date_modified=now,
+            error='Still running after {} seconds.'.format(timeout),
+        )
+    return reclaimed
+
+
+def run_jobs(job_ids, workers=1):
+    """Run claimed jobs, returning the number which succeeded.
+
+    With more than one worker the jobs run on a process pool. Database
+    connections are closed first so the worker processes don't share
+    the parent's connection."""
+    if not job_ids:
+        return 0
+    if workers <= 1:
+        return sum(map(run_job, job_ids))
+    connections.close_all()
+    pool = multiprocessing.Pool(workers)
+    try:
+        return sum(pool.map(run_job, job_ids))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_pending(kind=None, limit=None, workers=1):
+    """Claim and run pending jobs, returning the number which succeeded."""
+    return run_jobs(claim(kind=kind, limit=limit), workers=workers)
@@ -0,0 +1,126 @@
+"""Keyset pagination over photos ordered by (date_uploaded, id).
+
+Rather than an OFFSET, which makes the database walk every row before
+the page, a page starts from the (date_uploaded, id) position of the
+last photo of the page before it. Each page is then an indexed range
+query however deep into the photos it is. Positions are handed to
+clients as opaque cursors.
+"""
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+
+
+ORDERING = ('date_uploaded', 'id')
+
+
+def position(photo):
+    """Return the position of photo in the ordering."""
+    return photo.date_uploaded, photo.pk
+
+
+def encode_cursor(position):
+    """Encode a (date_uploaded, id) position as an opaque string."""
+    date_uploaded, pk = position
+    value = '{}|{}'.format(date_uploaded.isoformat(), pk)
+    return force_text(base64.urlsafe_b64encode(force_bytes(value)))
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into a position, raising ValueError if it's invalid."""
+    try:
+        value = force_text(base64.urlsafe_b64decode(force_bytes(cursor)))
+        date_uploaded, pk = value.split('|')
+        date_uploaded = parse_datetime(date_uploaded)
+        pk = int(pk)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if date_uploaded is None:
+        raise ValueError('Invalid cursor')
+    return date_uploaded, pk
+
+
+def after(queryset, position):
+    """Filter queryset to the photos after position."""
+    date_uploaded, pk = position
+    return queryset.filter(
+        Q(date_uploaded__gt=date_uploaded) |
+        Q(date_uploaded=date_uploaded, id__gt=pk)
+    )
+
+
+def before(queryset, position):
+    """Filter queryset to the photos before position."""
+    date_uploaded, pk = position
+    return queryset.filter(
+        Q(date_uploaded__lt=date_uploaded) |
+        Q(date_uploaded=date_uploaded, id__lt=pk)
+    )
+
+
+class KeysetPage(object):
+    """A page of photos with cursors for the pages either side of it.
+
+    number and num_pages are for display only: the number is carried
+    along in page links rather than worked out from the position."""
+
+    def __init__(self, object_list, has_next, has_previous, number, count,
+                 size):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.num_pages = max(1, -(-count // size))
+        self.number = min(number, self.num_pages) if has_previous else 1
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def next_cursor(self):
+        """Return the cursor of the page after this one."""
+        return encode_cursor(position(self.object_list[-1]))
+
+    def previous_cursor(self):
+        """Return the cursor of the page before this one."""
+        return encode_cursor(position(self.object_list[0]))
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return max(self.number - 1, 1)
+
+
+def paginate(queryset, size, after_cursor=None, before_cursor=None,
+             number=1):
+    """Return the KeysetPage of queryset after or before a cursor.
+
+    Invalid cursors give the first page, like an invalid page number
+    does with Django's Paginator."""
+    count = queryset.count()
+    try:
+        if before_cursor:
+            start = decode_cursor(before_cursor)
+            photos = before(queryset, start).order_by(
+                *('-' + name for name in ORDERING)
+            )
+            photos = list(photos[:size + 1])
+            has_previous = len(photos) > size
+            photos = photos[:size][::-1]
+            return KeysetPage(photos, bool(photos), has_previous, number,
+                              count, size)
+        if after_cursor:
+            queryset = after(queryset, decode_cursor(after_cursor))
+            has_previous = True
+        else:
+            has_previous = False
+    except ValueError:
+        has_previous = False
+    photos = list(queryset.order_by(*ORDERING)[:size + 1])
+    has_next = len(photos) > size
+    return KeysetPage(photos[:size], has_next, has_previous, number, count,
+                      size)
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from image.jobs import claim, run_jobs
+from image.models import Job, Photo
+
+
+class Command(BaseCommand):
+    """Pre-render thumbnails for photos uploaded before the job queue."""
+
+    help = (
+        'Queue a thumbnails job (or with --kind renditions, metadata or '
+        'dhash, a job of that kind) for every photo without a finished '
+        'one and run them on a local process pool until none can be '
+        'claimed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            choices=['thumbnails', 'renditions', 'metadata', 'dhash'],
+            default='thumbnails'
+        )
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        rendered = Job.objects.filter(kind=kind).exclude(
+            status='failed'
+        ).values('photo')
+        photos = Photo.objects.exclude(photo='').exclude(photo=None)
+        photos = photos.exclude(id__in=rendered)
+        if kind == 'metadata':
+            photos = photos.filter(metadata=None)
+        elif kind == 'dhash':
+            photos = photos.filter(dhash=None)
+        queued = Job.objects.bulk_create(
+            Job(kind=kind, photo_id=photo_id)
+            for photo_id in photos.values_list('id', flat=True).iterator()
+        )
+        self.stdout.write('Queued {} photos'.format(len(queued)))
+        total = 0
+        while True:
+            job_ids = claim(kind=kind, limit=options['batch_size'])
+            if not job_ids:
+                break
+            total += run_jobs(job_ids, workers=options['workers'])
+            self.stdout.write('Rendered {} for {} photos'.format(kind, total))
+        outstanding = Job.objects.filter(
+            kind=kind, status__in=['pending', 'running']
+        ).count()
+        if outstanding:
+            self.stdout.write(
+                '{} {} jobs are still pending or running elsewhere'.format(
+                    outstanding, kind
+                )
+            )
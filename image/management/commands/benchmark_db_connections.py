@@ -0,0 +1,79 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+
+
+class Command(BaseCommand):
+    """Compare latency with fresh and with persistent database connections."""
+
+    help = (
+        'Time a trivial query, and optionally requests for --url, opening a '
+        'new database connection each time and reusing one persistent '
+        'connection, and print the mean, median and 95th percentile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--url', help='Also time requests for this url.')
+        parser.add_argument('--user', help='Log in as this user for --url.')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        self.stdout.write('{} database, engine {}'.format(
+            connection.alias, connection.settings_dict['ENGINE']
+        ))
+
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+
+        def fresh_query():
+            connection.close()
+            query()
+
+        self.time('query, new connection', options['repeat'], fresh_query)
+        self.time('query, persistent connection', options['repeat'], query)
+        if options['url']:
+            self.time_requests(connection, options)
+
+    def time_requests(self, connection, options):
+        """Time requests for the url with each connection lifetime."""
+        client = Client()
+        if options['user']:
+            try:
+                client.force_login(User.objects.get(username=options['user']))
+            except User.DoesNotExist:
+                raise CommandError('No user {}'.format(options['user']))
+        max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            for label, age in (('new connection', 0), ('persistent', None)):
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = age
+                self.time(
+                    'request, {}'.format(label), options['repeat'],
+                    lambda: client.get(options['url'])
+                )
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+
+    def time(self, label, repeat, func):
+        """Time func over repeat calls and print latency statistics."""
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            func()
+            times.append((time.time() - start) * 1000)
+        times.sort()
+        self.stdout.write(
+            '{}: mean {:.2f}ms, median {:.2f}ms, p95 {:.2f}ms'.format(
+                label,
+                sum(times) / len(times),
+                times[len(times) // 2],
+                times[min(len(times) - 1, int(len(times) * 0.95))],
+            )
+        )
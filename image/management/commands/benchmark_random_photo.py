@@ -0,0 +1,62 @@
+import random
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from image.models import Photo
+from image.sampler import POOL_KEY, random_public_photo
+
+
+class Command(BaseCommand):
+    """Compare the random photo sampler against ORDER BY RANDOM()."""
+
+    help = (
+        'Seed public and private photos and time picking a random public '
+        'photo with the sampler and with order_by("?"). The seeded rows '
+        'are rolled back afterwards unless --keep is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--keep', action='store_true')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.seed(options['rows'], options['batch_size'])
+            public = Photo.objects.filter(published='Public')
+            self.time('order_by("?")', options['repeat'],
+                      lambda: public.order_by('?').first())
+            cache.delete(POOL_KEY)
+            self.time('sampler (cold pool)', 1, random_public_photo)
+            self.time('sampler (warm pool)', options['repeat'],
+                      random_public_photo)
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def seed(self, rows, batch_size):
+        """Insert rows photos, about a third of which are not public."""
+        existing = Photo.objects.count()
+        start = time.time()
+        for offset in range(existing, rows, batch_size):
+            Photo.objects.bulk_create(
+                Photo(
+                    title='benchmark {}'.format(i),
+                    published=random.choice(['Public', 'Private', 'Shared']),
+                )
+                for i in range(offset, min(offset + batch_size, rows))
+            )
+        self.stdout.write('Seeded {} photos in {:.1f}s'.format(
+            max(rows - existing, 0), time.time() - start
+        ))
+
+    def time(self, label, repeat, func):
+        """Time func over repeat calls and print the mean in milliseconds."""
+        start = time.time()
+        for _ in range(repeat):
+            func()
+        elapsed = (time.time() - start) / repeat
+        self.stdout.write('{}: {:.2f}ms per call'.format(label, elapsed * 1000))
@@ -0,0 +1,100 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from taggit.models import Tag, TaggedItem
+
+from image.models import Photo, PhotoTag, tag_key
+from image.tagindex import photos_with_tags
+
+
+class Command(BaseCommand):
+    """Compare tag lookups through the tag index and through taggit."""
+
+    help = (
+        'Seed a user with tagged photos and time finding photos by one '
+        'tag, by all of two tags and by any of two tags, through taggit\'s '
+        'generic relation and through the tag index. The seeded rows are '
+        'rolled back afterwards unless --keep is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--photos', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--tags-per-photo', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--keep', action='store_true')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options)
+            photos = user.photos.order_by('date_uploaded', 'id')
+            first, second = ['benchmark{}'.format(i) for i in range(2)]
+
+            def page(queryset):
+                return lambda: list(queryset.order_by('date_uploaded', 'id')[:4])
+
+            self.time('taggit, one tag', options['repeat'],
+                      page(photos.filter(tags__name=first)))
+            self.time('index, one tag', options['repeat'],
+                      page(photos_with_tags(user, [first])))
+            self.time('taggit, all of two tags', options['repeat'], page(
+                photos.filter(tags__name=first).filter(tags__name=second)
+            ))
+            self.time('index, all of two tags', options['repeat'],
+                      page(photos_with_tags(user, [first, second])))
+            self.time('taggit, any of two tags', options['repeat'], page(
+                photos.filter(tags__name__in=[first, second]).distinct()
+            ))
+            self.time('index, any of two tags', options['repeat'],
+                      page(photos_with_tags(user, [first, second], 'any')))
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def seed(self, options):
+        """Create a user with tagged photos, writing the tables in bulk."""
+        start = time.time()
+        user = User.objects.create(username='tag-benchmark')
+        tags = [
+            Tag.objects.create(name='benchmark{}'.format(i))
+            for i in range(options['tags'])
+        ]
+        content_type = ContentType.objects.get_for_model(Photo)
+        rows, batch_size = options['photos'], options['batch_size']
+        for offset in range(0, rows, batch_size):
+            Photo.objects.bulk_create(
+                Photo(user=user, title='benchmark {}'.format(i))
+                for i in range(offset, min(offset + batch_size, rows))
+            )
+            ids = user.photos.order_by('-id').values_list('id', flat=True)
+            chosen = [
+                (photo_id, tag)
+                for photo_id in ids[:min(batch_size, rows - offset)]
+                for tag in random.sample(tags, options['tags_per_photo'])
+            ]
+            TaggedItem.objects.bulk_create(
+                TaggedItem(content_type=content_type, object_id=photo_id,
+                           tag=tag)
+                for photo_id, tag in chosen
+            )
+            PhotoTag.objects.bulk_create(
+                PhotoTag(user=user, photo_id=photo_id, tag=tag,
+                         key=tag_key(tag.name))
+                for photo_id, tag in chosen
+            )
+        self.stdout.write('Seeded {} tagged photos in {:.1f}s'.format(
+            rows, time.time() - start
+        ))
+        return user
+
+    def time(self, label, repeat, func):
+        """Time func over repeat calls and print the mean in milliseconds."""
+        start = time.time()
+        for _ in range(repeat):
+            func()
+        elapsed = (time.time() - start) / repeat
+        self.stdout.write('{}: {:.2f}ms per call'.format(label, elapsed * 1000))
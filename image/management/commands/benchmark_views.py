@@ -0,0 +1,293 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment
+)
+from django.urls import reverse
+from taggit.models import Tag, TaggedItem
+
+from image.models import Album, Photo, PhotoTag, Thumbnail, tag_key
+from image.thumbnails import render_thumbnails
+from user_profile.models import reconcile_counters
+
+
+BASELINES = os.path.join(
+    settings.BASE_DIR, 'imagersite', 'benchmark_baselines.json'
+)
+
+SIZES = (10, 1000, 50000)
+
+TAGS = 50
+TAGS_PER_PHOTO = 4
+ALBUM_SIZE = 100
+ALBUMS = 20
+BATCH_SIZE = 5000
+
+# Views whose queries depend on where random probes land rather than on
+# how many photos there are, which are left out of the N+1 check.
+SAMPLING_VIEWS = ('home_view',)
+
+
+def seed(size):
+    """Create a user with size photos, tagged and filed into albums.
+
+    The first photo is made by PhotoFactory so there is a real image
+    behind it; the rest are written in bulk and share its file and
+    thumbnails, as the thumbnails job would have rendered them. Every
+    photo carries the tag 'common' and TAGS_PER_PHOTO others, every
+    third photo is private, one album holds all of them and up to ALBUMS
+    more hold ALBUM_SIZE each. Returns the user, the big album, the
+    first photo and the common tag name."""
+    from image.factories import PhotoFactory
+
+    rand = random.Random(size)
+    user = User.objects.create(username='benchmark{}'.format(size))
+    first = PhotoFactory(user=user, title='benchmark 0')
+    tags = [Tag.objects.get_or_create(name='tag{}'.format(i))[0]
+            for i in range(TAGS)]
+    common = Tag.objects.get_or_create(name='common')[0]
+    content_type = ContentType.objects.get_for_model(Photo)
+    for offset in range(1, size, BATCH_SIZE):
+        Photo.objects.bulk_create(
+            Photo(user=user, title='benchmark {}'.format(i),
+                  photo=first.photo.name,
+                  published='Private' if i % 3 == 0 else 'Public')
+            for i in range(offset, min(offset + BATCH_SIZE, size))
+        )
+    ids = list(user.photos.order_by('id').values_list('id', flat=True))
+    rendered = render_thumbnails(first)
+    for offset in range(1, size, BATCH_SIZE):
+        Thumbnail.objects.bulk_create(
+            Thumbnail(photo_id=photo_id, geometry=record.geometry,
+                      options=record.options, source=record.source,
+                      name=record.name, width=record.width,
+                      height=record.height)
+            for photo_id in ids[offset:offset + BATCH_SIZE]
+            for record in rendered
+        )
+    for offset in range(0, size, BATCH_SIZE):
+        chosen = [
+            (photo_id, tag)
+            for photo_id in ids[offset:offset + BATCH_SIZE]
+            for tag in [common] + rand.sample(tags, TAGS_PER_PHOTO)
+        ]
+        TaggedItem.objects.bulk_create(
+            TaggedItem(content_type=content_type, object_id=photo_id, tag=tag)
+            for photo_id, tag in chosen
+        )
+        PhotoTag.objects.bulk_create(
+            PhotoTag(user=user, photo_id=photo_id, tag=tag,
+                     key=tag_key(tag.name))
+            for photo_id, tag in chosen
+        )
+    big = Album.objects.create(user=user, title='everything', cover=first)
+    albums = [big] + [
+        Album.objects.create(user=user, title='album {}'.format(i),
+                             cover_id=ids[i * ALBUM_SIZE])
+        for i in range(min(ALBUMS, size // ALBUM_SIZE))
+    ]
+    Through = Album.photos.through
+    members = [(big.id, photo_id) for photo_id in ids] + [
+        (album.id, photo_id)
+        for i, album in enumerate(albums[1:])
+        for photo_id in ids[i * ALBUM_SIZE:(i + 1) * ALBUM_SIZE]
+    ]
+    for offset in range(0, len(members), BATCH_SIZE):
+        Through.objects.bulk_create(
+            Through(album_id=album_id, photo_id=photo_id)
+            for album_id, photo_id in members[offset:offset + BATCH_SIZE]
+        )
+    reconcile_counters(user)
+    return dict(user=user, album=big, photo=first, tag=common.name)
+
+
+def view_urls(seeded):
+    """Return (view name, url) pairs of the views to benchmark."""
+    return [
+        ('home_view', reverse('home')),
+        ('profile_view', reverse('profile')),
+        ('library_view', reverse('library')),
+        ('album_view', reverse('album', args=[seeded['album'].id])),
+        ('tag_view', reverse('tag', args=[seeded['tag']])),
+        ('image_view', reverse('images', args=[seeded['photo'].id])),
+        ('photo_api_view', reverse('photo_api', args=['json'])),
+    ]
+
+
+def measure(client, url, repeat):
+    """Request url with an empty cache and return its cost.
+
+    The first request warms up per-process state, like compiled
+    templates, and isn't counted. Returns the most queries and the median
+    milliseconds of repeat requests, and the peak kilobytes allocated
+    by one more request traced by tracemalloc. The random module is
+    reseeded before each request so sampling views repeat their work."""
+    client.get(url)
+    queries, timings = 0, []
+    for _ in range(repeat):
+        cache.clear()
+        random.seed(0)
+        with CaptureQueriesContext(connection) as context:
+            start = time.time()
+            response = client.get(url)
+            timings.append((time.time() - start) * 1000)
+        if response.status_code != 200:
+            raise CommandError('{} answered {}'.format(
+                url, response.status_code
+            ))
+        queries = max(queries, len(context.captured_queries))
+    timings.sort()
+    result = dict(queries=queries, milliseconds=round(
+        timings[len(timings) // 2], 1
+    ))
+    if tracemalloc is not None:
+        cache.clear()
+        random.seed(0)
+        tracemalloc.start()
+        try:
+            client.get(url)
+            result['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def regressions(results, baselines, time_tolerance, memory_tolerance):
+    """Return descriptions of the results which are worse than baselines.
+
+    A view may not make more queries than its baseline, nor take more
+    time or memory than its baseline plus the tolerance, a fraction of
+    the baseline. A view which makes more queries for a bigger library
+    than for the smallest one is also reported, as that is an N+1,
+    unless it is one of SAMPLING_VIEWS."""
+    limits = (
+        ('queries', 0), ('milliseconds', time_tolerance),
+        ('peak_kb', memory_tolerance),
+    )
+    problems = []
+    for size, views in sorted(results.items(), key=lambda item: int(item[0])):
+        for view, result in sorted(views.items()):
+            baseline = baselines.get(size, {}).get(view, {})
+            for measure_name, tolerance in limits:
+                if measure_name not in baseline or measure_name not in result:
+                    continue
+                limit = baseline[measure_name] * (1 + tolerance)
+                if result[measure_name] > limit:
+                    problems.append('{} with {} photos: {} {} > {}'.format(
+                        view, size, measure_name, result[measure_name],
+                        baseline[measure_name],
+                    ))
+    sizes = sorted(results, key=int)
+    for size in sizes[1:]:
+        for view, result in sorted(results[size].items()):
+            if view in SAMPLING_VIEWS:
+                continue
+            smallest = results[sizes[0]].get(view)
+            if smallest and result['queries'] > smallest['queries']:
+                problems.append(
+                    '{} makes {} queries with {} photos but {} with '
+                    '{}'.format(view, result['queries'], size,
+                                smallest['queries'], sizes[0])
+                )
+    return problems
+
+
+class Command(BaseCommand):
+    """Benchmark the main views against stored baselines."""
+
+    help = (
+        'Create a test database, seed a user for each size with that many '
+        'tagged photos filed into albums, and measure the queries, median '
+        'time and peak memory of each main view for them, with the cache '
+        'cleared before each request. Exit with an error if a view does '
+        'worse than its baseline in imagersite/benchmark_baselines.json, '
+        'or makes more queries for more photos. With --update, store the '
+        'results as the new baselines instead.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default=','.join(str(size) for size in SIZES)
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--baselines', default=BASELINES)
+        parser.add_argument('--time-tolerance', type=float, default=1.0)
+        parser.add_argument('--memory-tolerance', type=float, default=0.25)
+        parser.add_argument('--update', action='store_true')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root,
+                                   DATABASE_REPLICAS=[]):
+                results = self.run(sizes, options['repeat'])
+        finally:
+            shutil.rmtree(media_root)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        if options['update']:
+            with open(options['baselines'], 'w') as baselines:
+                json.dump(results, baselines, indent=2, sort_keys=True)
+                baselines.write('\n')
+            self.stdout.write('Wrote {}'.format(options['baselines']))
+            return
+        try:
+            with open(options['baselines']) as baselines:
+                stored = json.load(baselines)
+        except IOError:
+            raise CommandError('No baselines in {}; run with --update'.format(
+                options['baselines']
+            ))
+        problems = regressions(
+            results, stored, options['time_tolerance'],
+            options['memory_tolerance'],
+        )
+        if problems:
+            raise CommandError('Slower than the baselines:\n' + '\n'.join(
+                problems
+            ))
+
+    def run(self, sizes, repeat):
+        """Seed and measure each size, returning results by size and view."""
+        results = {}
+        for size in sizes:
+            start = time.time()
+            seeded = seed(size)
+            self.stdout.write('Seeded {} photos in {:.1f}s'.format(
+                size, time.time() - start
+            ))
+            client = Client()
+            client.force_login(seeded['user'])
+            results[str(size)] = {}
+            for view, url in view_urls(seeded):
+                result = measure(client, url, repeat)
+                results[str(size)][view] = result
+                self.stdout.write(
+                    '{} with {} photos: {} queries, {}ms, {}kB'.format(
+                        view, size, result['queries'],
+                        result['milliseconds'], result.get('peak_kb', '-'),
+                    )
+                )
+        return results
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from image.uploads import expire_uploads
+
+
+class Command(BaseCommand):
+    """Delete abandoned chunked uploads."""
+
+    help = (
+        'Delete chunked uploads which have had no chunk for the expiry '
+        'time, and their partial files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--expiry', type=float,
+            help='Seconds an upload may go without a chunk.'
+        )
+
+    def handle(self, *args, **options):
+        expired = expire_uploads(options['expiry'])
+        self.stdout.write('Expired {} uploads'.format(expired))
@@ -0,0 +1,106 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Count
+
+from image.queries import explain_shapes
+
+
+# Tables which are too large to read in full on a page request.
+LARGE_TABLES = ('image_photo', 'image_album', 'image_album_photos',
+                'image_phototag', 'image_photometadata',
+                'image_searchdocument')
+
+EXPLAIN = {
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+FULL_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'^SCAN (?:TABLE )?(\w+)(?! USING)(?:\s|$)'),
+}
+
+
+def explain(cursor, vendor, sql, params):
+    """Return the lines of the plan the database picks for a query."""
+    cursor.execute(EXPLAIN[vendor] + sql, params)
+    return [str(row[-1]) for row in cursor.fetchall()]
+
+
+def full_scans(vendor, plan):
+    """Return the large tables a plan reads in full."""
+    scans = []
+    for line in plan:
+        match = FULL_SCAN[vendor].search(line.strip())
+        if match and match.group(1) in LARGE_TABLES:
+            scans.append(match.group(1))
+    return scans
+
+
+class Command(BaseCommand):
+    """EXPLAIN the query shapes of the busiest pages."""
+
+    help = (
+        'Print the plan of each query shape in image.queries for a user '
+        '(by default the one with the most photos) and flag full scans of '
+        'the photo, album, tag index and search document tables. With '
+        '--check, exit with an error if there are any. PostgreSQL is told '
+        'to avoid sequential scans while explaining, so small tables show '
+        'whether an index could be used rather than whether it is worth '
+        'it yet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--check', action='store_true')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor not in EXPLAIN:
+            raise CommandError(
+                'Explaining queries on {} is not supported'.format(
+                    connection.vendor
+                )
+            )
+        user = self.get_user(options['user'])
+        problems = []
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                for label, shape in explain_shapes(user):
+                    sql, params = getattr(
+                        shape, 'query', shape
+                    ).sql_with_params()
+                    plan = explain(cursor, connection.vendor, sql, params)
+                    scans = full_scans(connection.vendor, plan)
+                    self.stdout.write('{}{}'.format(
+                        label, ' (FULL SCAN)' if scans else ''
+                    ))
+                    for line in plan:
+                        self.stdout.write('    ' + line)
+                    problems.extend(
+                        '{}: {}'.format(label, table) for table in scans
+                    )
+        if problems and options['check']:
+            raise CommandError('Full scans of large tables:\n' + '\n'.join(
+                problems
+            ))
+
+    def get_user(self, username):
+        """Return the named user, or the user with the most photos."""
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError('No user {}'.format(username))
+        user = User.objects.annotate(
+            photo_count=Count('photos')
+        ).order_by('-photo_count').first()
+        if user is None:
+            raise CommandError('There are no users')
+        return user
@@ -0,0 +1,88 @@
+import multiprocessing
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from image.importer import Importer, find_images, run_import
+from image.models import Album, PUB_CHOICES
+
+
+class Command(BaseCommand):
+    """Import a directory of images as photos of a user."""
+
+    help = (
+        'Walk a directory, decode and validate its images on a process '
+        'pool and create photos for them in batches. Images the user '
+        'already has are skipped, so an interrupted import can be rerun.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--user', required=True)
+        parser.add_argument('--album', help='Title of an album to add to.')
+        parser.add_argument(
+            '--published',
+            default='Public',
+            choices=[choice for choice, _ in PUB_CHOICES]
+        )
+        parser.add_argument(
+            '--tag', action='append', default=[], dest='tags',
+            help='Tag every imported photo. May be repeated.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count()
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('No user named {}'.format(options['user']))
+        album = None
+        if options['album']:
+            album, _ = Album.objects.get_or_create(
+                user=user, title=options['album']
+            )
+        importer = Importer(
+            user,
+            published=options['published'],
+            album=album,
+            tags=options['tags'],
+        )
+        paths = find_images(options['directory'])
+        pool = None
+        if options['workers'] > 1:
+            connections.close_all()
+            pool = multiprocessing.Pool(options['workers'])
+        try:
+            seen, elapsed = run_import(
+                importer,
+                paths,
+                pool=pool,
+                batch_size=options['batch_size'],
+                report=self.report,
+            )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        for path, error in importer.failed:
+            self.stderr.write('Could not import {}: {}'.format(path, error))
+        self.stdout.write(
+            'Imported {} photos, skipped {} already imported and {} '
+            'invalid images in {:.1f}s ({:.1f} images/sec)'.format(
+                importer.imported,
+                importer.skipped,
+                len(importer.failed),
+                elapsed,
+                seen / elapsed if elapsed else 0,
+            )
+        )
+
+    def report(self, seen, elapsed):
+        """Print the progress of the import."""
+        self.stdout.write('{} images in {:.1f}s ({:.1f} images/sec)'.format(
+            seen, elapsed, seen / elapsed if elapsed else 0
+        ))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from image.jobs import reclaim, run_pending
+
+
+class Command(BaseCommand):
+    """Run pending background jobs."""
+
+    help = (
+        'Claim pending jobs and run them on a local process pool, first '
+        'reclaiming jobs left running by workers which died.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind')
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep polling for new jobs instead of exiting when done.'
+        )
+        parser.add_argument('--interval', type=float, default=2.0)
+        parser.add_argument(
+            '--timeout', type=float,
+            help='Seconds a running job may go without progress.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            reclaimed = reclaim(options['timeout'])
+            if reclaimed:
+                self.stdout.write('Reclaimed {} jobs'.format(reclaimed))
+            done = run_pending(
+                kind=options['kind'],
+                limit=options['batch_size'],
+                workers=options['workers'],
+            )
+            if done:
+                self.stdout.write('Ran {} jobs'.format(done))
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
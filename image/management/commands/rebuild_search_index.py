@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from image.models import Album, Photo
+from image.search import index_albums, index_photos
+
+
+class Command(BaseCommand):
+    """Rebuild the search documents of photos and albums."""
+
+    help = (
+        'Rewrite the search documents of every photo and album, or of '
+        'those of the given users, from their titles, descriptions and '
+        'tags.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*', help='Only rebuild these users\' documents.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model, index in ((Photo, index_photos), (Album, index_albums)):
+            objects = model.objects.order_by('id')
+            if options['usernames']:
+                objects = objects.filter(
+                    user__username__in=options['usernames']
+                )
+            ids = list(objects.values_list('id', flat=True))
+            for offset in range(0, len(ids), options['batch_size']):
+                index(ids[offset:offset + options['batch_size']])
+            self.stdout.write('Rebuilt the search documents of {} {}s'.format(
+                len(ids), model._meta.model_name
+            ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from image.models import Photo
+from image.tagindex import rebuild
+
+
+class Command(BaseCommand):
+    """Rebuild the tag index from taggit's tables."""
+
+    help = (
+        'Rebuild the tag index entries of every photo, or of the photos of '
+        'the given users, from the tags taggit has recorded.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*', help='Only rebuild these users\' photos.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.order_by('id')
+        if options['usernames']:
+            photos = photos.filter(user__username__in=options['usernames'])
+        batch, count = [], 0
+        for photo in photos.only('id', 'user').iterator():
+            batch.append(photo)
+            if len(batch) == options['batch_size']:
+                rebuild(batch)
+                count += len(batch)
+                batch = []
+        rebuild(batch)
+        count += len(batch)
+        self.stdout.write('Rebuilt the tag index of {} photos'.format(count))
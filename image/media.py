@@ -0,0 +1,150 @@
+"""Delivery of uploaded media.
+
+Files under MEDIA_ROOT are only served for photos the requesting user
+may see. When a front-end server is configured, the actual bytes are
+handed off to it: nginx with MEDIA_ACCEL_REDIRECT_PREFIX (an internal
+location aliased to MEDIA_ROOT) or Apache/lighttpd with
+MEDIA_SENDFILE_HEADER. Otherwise the file is streamed by Django, with
+support for Range requests and ETags, through the server's
+wsgi.file_wrapper where available.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, quote_etag
+
+from .models import Photo
+
+
+# Thumbnails are named by a hash of their source and options, so they
+# are served without a permission check.
+PUBLIC_PREFIXES = ('cache/',)
+
+# Renditions are checked against the photo they were rendered from.
+RENDITIONS_PREFIX = 'renditions/'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64 * 1024
+
+
+def can_view(user, photo):
+    """Return whether user may see photo.
+
+    Public photos are visible to everyone, shared photos to logged in
+    users and private photos only to their owner."""
+    if photo.published == 'Public':
+        return True
+    if not user.is_authenticated:
+        return False
+    return photo.published == 'Shared' or photo.user_id == user.pk
+
+
+def can_view_path(user, path):
+    """Return whether user may see the media file at path."""
+    if path.startswith(PUBLIC_PREFIXES):
+        return True
+    if path.startswith(RENDITIONS_PREFIX):
+        photos = Photo.objects.filter(renditions__image=path)
+    else:
+        photos = Photo.objects.filter(photo=path)
+    photos = photos.only('user', 'published')
+    return any(can_view(user, photo) for photo in photos)
+
+
+def file_etag(stat):
+    """Return an ETag for a file from its modification time and size."""
+    return '{:x}-{:x}'.format(int(stat.st_mtime * 1000000), stat.st_size)
+
+
+def parse_range(header, size):
+    """Return the (start, end) byte range asked for by a Range header.
+
+    Returns None when the whole file should be sent and raises
+    ValueError when the range can't be satisfied. Only single ranges
+    are supported; multiple ranges get the whole file."""
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+
+def read_range(path, start, length):
+    """Yield length bytes of the file at path, starting at start."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def offload(path):
+    """Return a response handing path to the front-end server, or None."""
+    prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', None)
+    header = getattr(settings, 'MEDIA_SENDFILE_HEADER', None)
+    if not prefix and not header:
+        return None
+    content_type, _ = mimetypes.guess_type(path)
+    response = HttpResponse(content_type=content_type)
+    if prefix:
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + path
+    else:
+        response[header] = os.path.join(settings.MEDIA_ROOT, path)
+    return response
+
+
+def serve_file(request, path, full_path):
+    """Stream the file at full_path, honouring Range and ETag headers."""
+    stat = os.stat(full_path)
+    etag = file_etag(stat)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+    size = stat.st_size
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if 'HTTP_RANGE' in request.META and (
+        not if_range or etag in parse_etags(if_range)
+    ):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(
+            read_range(full_path, start, length),
+            content_type=content_type,
+            status=206,
+        )
+        response['Content-Length'] = length
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
@@ -0,0 +1,98 @@
+"""Set-based changes to the photos of albums.
+
+Album.photos.add() and remove() work through the related manager, and an
+album form diffs every photo id it is posted against the album. Here
+photos are added and removed by id with bulk inserts into and deletes
+from the through table, checked and applied with the cover change in one
+transaction, and the album is saved once at the end, which expires the
+cached fragments showing it.
+"""
+from collections import OrderedDict
+
+from django.db import transaction
+
+from .models import Album, Photo
+
+
+Through = Album.photos.through
+
+# Ids per IN clause, below SQLite's limit on query parameters.
+CHUNK_SIZE = 500
+
+UNCHANGED = object()
+
+
+class MembershipError(Exception):
+    """A change to an album's photos which can't be applied."""
+
+
+def chunks(ids):
+    """Split a list of ids into lists of at most CHUNK_SIZE."""
+    return [ids[start:start + CHUNK_SIZE]
+            for start in range(0, len(ids), CHUNK_SIZE)]
+
+
+def album_photo_ids(album, photo_ids):
+    """Return which of photo_ids are photos of album."""
+    found = set()
+    for chunk in chunks(photo_ids):
+        found.update(Through.objects.filter(
+            album_id=album.pk, photo_id__in=chunk
+        ).values_list('photo_id', flat=True))
+    return found
+
+
+def owned_photo_ids(user, photo_ids):
+    """Return which of photo_ids are photos of user."""
+    found = set()
+    for chunk in chunks(photo_ids):
+        found.update(Photo.objects.filter(
+            user=user, id__in=chunk
+        ).values_list('id', flat=True))
+    return found
+
+
+def change_album(album, add=(), remove=(), cover=UNCHANGED):
+    """Add and remove photos of album by id and set its cover.
+
+    Photos already in the album are not added again, and photos not in
+    it are not removed. The cover must be a photo of the album once the
+    changes are made, or None to clear it; removing the cover clears
+    it. Raises MembershipError, changing nothing, if a photo added or
+    the cover isn't one of the owner's photos or an id is both added and
+    removed. Returns the numbers of photos added and removed."""
+    add = list(OrderedDict.fromkeys(add))
+    remove = list(OrderedDict.fromkeys(remove))
+    both = set(add) & set(remove)
+    if both:
+        raise MembershipError('Photos both added and removed: {}'.format(
+            ', '.join(str(pk) for pk in sorted(both))
+        ))
+    wanted = add + ([cover] if cover not in (UNCHANGED, None) else [])
+    foreign = set(wanted) - owned_photo_ids(album.user, wanted)
+    if foreign:
+        raise MembershipError('Not your photos: {}'.format(
+            ', '.join(str(pk) for pk in sorted(foreign))
+        ))
+    with transaction.atomic():
+        album = Album.objects.select_for_update().get(pk=album.pk)
+        present = album_photo_ids(album, add)
+        added = [pk for pk in add if pk not in present]
+        Through.objects.bulk_create(
+            Through(album_id=album.pk, photo_id=pk) for pk in added
+        )
+        removed = 0
+        for chunk in chunks(remove):
+            removed += Through.objects.filter(
+                album_id=album.pk, photo_id__in=chunk
+            ).delete()[0]
+        if cover is not UNCHANGED:
+            album.cover_id = cover
+        elif album.cover_id in remove:
+            album.cover_id = None
+        if album.cover_id is not None and not album_photo_ids(
+            album, [album.cover_id]
+        ):
+            raise MembershipError("Cover not in album's photos.")
+        album.save(update_fields=['cover', 'date_modified'])
+    return len(added), removed
@@ -0,0 +1,228 @@
+"""Metadata read from the headers of photos' images, and filters on it.
+
+Opening an image with PIL only reads its header, which holds the size
+and the EXIF tags, so the metadata is read without decoding any pixels.
+A metadata job reads it once for each new or replaced image into a
+PhotoMetadata row, and the library and photo API filter on those rows.
+"""
+from datetime import datetime, time, timedelta
+
+from django import forms
+from django.utils import six, timezone
+from django.utils.http import urlencode
+from PIL import Image
+
+from .models import PhotoMetadata
+
+
+# EXIF tag numbers.
+MAKE = 0x010f
+MODEL = 0x0110
+ORIENTATION = 0x0112
+DATE_TIME = 0x0132
+DATE_TIME_ORIGINAL = 0x9003
+ISO_SPEED = 0x8827
+LENS_MODEL = 0xa434
+GPS_INFO = 0x8825
+
+# GPSInfo tag numbers.
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+# Orientations which store the image turned on its side.
+TRANSPOSED = (5, 6, 7, 8)
+
+EXIF_DATE_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+
+def decode_text(value):
+    """Decode an EXIF or IPTC value to text."""
+    if isinstance(value, tuple):
+        value = bytes(bytearray(value))
+    if isinstance(value, bytes):
+        if len(value) > 1 and value[1:2] == b'\x00':
+            return value.decode('utf-16-le', 'ignore').rstrip('\x00')
+        return value.decode('utf-8', 'ignore')
+    return value
+
+
+def read_exif(image):
+    """Return the EXIF tags of an opened image by number, or {}.
+
+    Malformed EXIF is treated as missing rather than as a broken image."""
+    try:
+        return getattr(image, '_getexif', lambda: None)() or {}
+    except Exception:
+        return {}
+
+
+def text(exif, tag):
+    """Return an EXIF tag as stripped text, or ''."""
+    value = decode_text(exif.get(tag, ''))
+    if not isinstance(value, six.string_types):
+        return ''
+    return value.replace('\x00', '').strip()[:128]
+
+
+def rational(value):
+    """Return an EXIF rational, a pair or a number, as a float."""
+    if isinstance(value, tuple):
+        return float(value[0]) / value[1] if value[1] else 0.0
+    return float(value)
+
+
+def taken_at(exif):
+    """Return when a photo was taken, or None.
+
+    EXIF dates carry no time zone, so they are stored as if in UTC."""
+    for tag in (DATE_TIME_ORIGINAL, DATE_TIME):
+        try:
+            taken = datetime.strptime(text(exif, tag), EXIF_DATE_FORMAT)
+        except ValueError:
+            continue
+        return timezone.make_aware(taken, timezone.utc)
+    return None
+
+
+def camera(exif):
+    """Return the camera make and model, without repeating the make."""
+    make, model = text(exif, MAKE), text(exif, MODEL)
+    if make and not model.lower().startswith(make.lower()):
+        return '{} {}'.format(make, model).strip()[:128]
+    return model
+
+
+def iso(exif):
+    """Return the ISO speed, or None."""
+    value = exif.get(ISO_SPEED)
+    if isinstance(value, (tuple, list)):
+        value = value[0] if value else None
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def coordinate(gps, tag, ref_tag):
+    """Return a GPS latitude or longitude in signed degrees, or None."""
+    try:
+        degrees, minutes, seconds = (rational(value) for value in gps[tag])
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    value = degrees + minutes / 60 + seconds / 3600
+    if decode_text(gps.get(ref_tag, '')) in ('S', 'W'):
+        value = -value
+    return value
+
+
+def read_metadata(f):
+    """Return a dict of the metadata of the image in file f."""
+    return image_metadata(Image.open(f))
+
+
+def image_metadata(image):
+    """Return a dict of the metadata of an opened image.
+
+    Only the header is read. The size is given the way the image is
+    displayed, turned by its EXIF orientation."""
+    width, height = image.size
+    exif = read_exif(image)
+    if exif.get(ORIENTATION) in TRANSPOSED:
+        width, height = height, width
+    gps = exif.get(GPS_INFO)
+    if not isinstance(gps, dict):
+        gps = {}
+    return dict(
+        width=width,
+        height=height,
+        taken_at=taken_at(exif),
+        camera=camera(exif),
+        lens=text(exif, LENS_MODEL),
+        iso=iso(exif),
+        latitude=coordinate(gps, GPS_LATITUDE, GPS_LATITUDE_REF),
+        longitude=coordinate(gps, GPS_LONGITUDE, GPS_LONGITUDE_REF),
+    )
+
+
+def extract_metadata(photo):
+    """Read the metadata of photo's image into its PhotoMetadata row."""
+    with photo.photo.storage.open(photo.photo.name) as f:
+        values = read_metadata(f)
+    values['user_id'] = photo.user_id
+    metadata, _ = PhotoMetadata.objects.update_or_create(
+        photo=photo, defaults=values
+    )
+    return metadata
+
+
+def metadata_job(job):
+    """Job handler reading the metadata of the job's photo."""
+    if job.photo is not None and job.photo.photo:
+        extract_metadata(job.photo)
+
+
+def start_of_day(date):
+    """Return the first moment of a date in UTC."""
+    return timezone.make_aware(datetime.combine(date, time()), timezone.utc)
+
+
+class MetadataFilterForm(forms.Form):
+    """Filters on the metadata of a user's photos, from query parameters.
+
+    Dates are whole days: taken_before includes the day it names."""
+    camera = forms.CharField(required=False, max_length=128)
+    lens = forms.CharField(required=False, max_length=128)
+    taken_after = forms.DateField(required=False)
+    taken_before = forms.DateField(required=False)
+    min_width = forms.IntegerField(required=False, min_value=1)
+    min_height = forms.IntegerField(required=False, min_value=1)
+    min_iso = forms.IntegerField(required=False, min_value=0)
+    max_iso = forms.IntegerField(required=False, min_value=0)
+    located = forms.BooleanField(required=False)
+
+    LOOKUPS = {
+        'camera': lambda value: dict(camera=value),
+        'lens': lambda value: dict(lens=value),
+        'taken_after': lambda value: dict(taken_at__gte=start_of_day(value)),
+        'taken_before': lambda value: dict(
+            taken_at__lt=start_of_day(value + timedelta(days=1))
+        ),
+        'min_width': lambda value: dict(width__gte=value),
+        'min_height': lambda value: dict(height__gte=value),
+        'min_iso': lambda value: dict(iso__gte=value),
+        'max_iso': lambda value: dict(iso__lte=value),
+        'located': lambda value: dict(latitude__isnull=False),
+    }
+
+    def lookups(self):
+        """Return PhotoMetadata lookups for the valid filters given."""
+        if not self.is_valid():
+            return {}
+        lookups = {}
+        for name, value in self.cleaned_data.items():
+            if value not in (None, '', False):
+                lookups.update(self.LOOKUPS[name](value))
+        return lookups
+
+    def filter(self, photos, user):
+        """Return the photos of user's photos which match the filters."""
+        lookups = self.lookups()
+        if not lookups:
+            return photos
+        return photos.filter(id__in=PhotoMetadata.objects.filter(
+            user=user, **lookups
+        ).values('photo'))
+
+    def query_string(self):
+        """Return the filters given, to carry over to other pages."""
+        return urlencode([
+            (name, self.data[name]) for name in self.fields
+            if self.data.get(name)
+        ])
+
+
+def filtering(request):
+    """Return whether a request filters photos by metadata."""
+    return any(request.GET.get(name) for name in MetadataFilterForm.base_fields)
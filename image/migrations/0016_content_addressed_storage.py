@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-18 09:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import image.models
+import image.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image', '0015_photoupload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='photo',
+            name='photo',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=image.storage.ContentAddressedStorage(), upload_to=image.models.photo_path),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-18 09:05
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_index(apps, schema_editor):
+    """Index the tags of existing photos."""
+    Photo = apps.get_model('image', 'Photo')
+    PhotoTag = apps.get_model('image', 'PhotoTag')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    content_type = ContentType.objects.filter(
+        app_label='image', model='photo'
+    ).first()
+    if content_type is None:
+        return
+    owners = dict(Photo.objects.values_list('id', 'user_id'))
+    items = TaggedItem.objects.filter(
+        content_type=content_type
+    ).values_list('object_id', 'tag_id', 'tag__name')
+    PhotoTag.objects.bulk_create((
+        PhotoTag(
+            user_id=owners[photo_id],
+            photo_id=photo_id,
+            tag_id=tag_id,
+            key=name.lower(),
+        )
+        for photo_id, tag_id, name in items
+        if owners.get(photo_id) is not None
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0002_auto_20150616_2121'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('image', '0016_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_entries', to='image.Photo')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_tags', to='taggit.Tag')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_tags', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='phototag',
+            unique_together=set([('photo', 'tag')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='phototag',
+            index_together=set([('user', 'key', 'photo')]),
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-18 09:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import image.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image', '0017_phototag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoRendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(max_length=255, upload_to=image.models.rendition_path)),
+                ('format', models.CharField(choices=[('JPEG', 'JPEG'), ('WEBP', 'WebP')], max_length=4)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='image.Photo')),
+            ],
+            options={
+                'ordering': ('format', 'width'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='photorendition',
+            unique_together=set([('photo', 'format', 'width')]),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-18 09:20
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_public_index(apps, schema_editor):
+    """Index the ids of public photos, where partial indexes are supported.
+
+    The random photo sampler probes public photos by id, and this index
+    holds only those rows."""
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute(
+            "CREATE INDEX image_photo_public_id ON image_photo (id) "
+            "WHERE published = 'Public'"
+        )
+
+
+def drop_public_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute('DROP INDEX image_photo_public_id')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('image', '0019_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='album',
+            options={'ordering': ('date_created', 'id')},
+        ),
+        migrations.AlterModelOptions(
+            name='photo',
+            options={'ordering': ('date_uploaded', 'id')},
+        ),
+        migrations.AlterIndexTogether(
+            name='album',
+            index_together=set([('user', 'date_created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='photo',
+            index_together=set([('user', 'published'), ('user', 'date_uploaded'), ('published', 'id')]),
+        ),
+        migrations.RunPython(create_public_index, drop_public_index),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-18 09:33
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('image', '0020_photo_album_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoMetadata',
+            fields=[
+                ('photo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metadata', serialize=False, to='image.Photo')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('taken_at', models.DateTimeField(blank=True, null=True)),
+                ('camera', models.CharField(blank=True, max_length=128)),
+                ('lens', models.CharField(blank=True, max_length=128)),
+                ('iso', models.PositiveIntegerField(blank=True, null=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('date_extracted', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_metadata', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='photometadata',
+            index_together=set([('user', 'taken_at'), ('user', 'lens'), ('user', 'latitude', 'longitude'), ('user', 'iso'), ('user', 'width', 'height'), ('user', 'camera')]),
+        ),
+    ]
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-18 09:36
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POSTGRESQL_INDEX = [
+    'ALTER TABLE image_searchdocument ADD COLUMN document tsvector',
+    'CREATE INDEX image_searchdocument_document ON image_searchdocument '
+    'USING gin (document)',
+    """CREATE FUNCTION image_searchdocument_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.document :=
+            setweight(to_tsvector('english', NEW.title), 'A') ||
+            setweight(to_tsvector('english', NEW.tags), 'B') ||
+            setweight(to_tsvector('english', NEW.body), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    'CREATE TRIGGER image_searchdocument_vector '
+    'BEFORE INSERT OR UPDATE ON image_searchdocument '
+    'FOR EACH ROW EXECUTE PROCEDURE image_searchdocument_vector()',
+]
+
+POSTGRESQL_DROP = [
+    'DROP TRIGGER image_searchdocument_vector ON image_searchdocument',
+    'DROP FUNCTION image_searchdocument_vector()',
+    'DROP INDEX image_searchdocument_document',
+    'ALTER TABLE image_searchdocument DROP COLUMN document',
+]
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE image_searchdocument_fts USING fts5("
+    "title, tags, body, content='image_searchdocument', content_rowid='id', "
+    "tokenize='porter unicode61')",
+    """CREATE TRIGGER image_searchdocument_insert
+    AFTER INSERT ON image_searchdocument BEGIN
+        INSERT INTO image_searchdocument_fts (rowid, title, tags, body)
+        VALUES (new.id, new.title, new.tags, new.body);
+    END""",
+    """CREATE TRIGGER image_searchdocument_delete
+    AFTER DELETE ON image_searchdocument BEGIN
+        INSERT INTO image_searchdocument_fts
+            (image_searchdocument_fts, rowid, title, tags, body)
+        VALUES ('delete', old.id, old.title, old.tags, old.body);
+    END""",
+    """CREATE TRIGGER image_searchdocument_update
+    AFTER UPDATE ON image_searchdocument BEGIN
+        INSERT INTO image_searchdocument_fts
+            (image_searchdocument_fts, rowid, title, tags, body)
+        VALUES ('delete', old.id, old.title, old.tags, old.body);
+        INSERT INTO image_searchdocument_fts (rowid, title, tags, body)
+        VALUES (new.id, new.title, new.tags, new.body);
+    END""",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER image_searchdocument_insert',
+    'DROP TRIGGER image_searchdocument_delete',
+    'DROP TRIGGER image_searchdocument_update',
+    'DROP TABLE image_searchdocument_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Add the full-text index of the database in use, if it has one."""
+    statements = dict(postgresql=POSTGRESQL_INDEX, sqlite=SQLITE_INDEX)
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = dict(postgresql=POSTGRESQL_DROP, sqlite=SQLITE_DROP)
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def build_documents(apps, schema_editor):
+    """Write the search documents of existing photos and albums."""
+    Photo = apps.get_model('image', 'Photo')
+    Album = apps.get_model('image', 'Album')
+    PhotoTag = apps.get_model('image', 'PhotoTag')
+    SearchDocument = apps.get_model('image', 'SearchDocument')
+    tags = {}
+    for photo_id, name in PhotoTag.objects.values_list('photo_id', 'tag__name'):
+        tags.setdefault(photo_id, []).append(name)
+    SearchDocument.objects.bulk_create((
+        SearchDocument(
+            user_id=user_id, photo_id=pk, title=title, body=description,
+            tags=' '.join(sorted(tags.get(pk, []))),
+        )
+        for pk, user_id, title, description in Photo.objects.filter(
+            user__isnull=False
+        ).values_list('id', 'user_id', 'title', 'description').iterator()
+    ), batch_size=1000)
+    SearchDocument.objects.bulk_create((
+        SearchDocument(
+            user_id=user_id, album_id=pk, title=title, body=description
+        )
+        for pk, user_id, title, description in Album.objects.values_list(
+            'id', 'user_id', 'title', 'description'
+        ).iterator()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('image', '0021_photometadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.TextField(blank=True)),
+                ('tags', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('album', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='image.Album')),
+                ('photo', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='image.Photo')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Min
+
+
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_pending_index(apps, schema_editor):
+    """Allow one pending job of each kind per photo, where partial indexes
+    are supported, dropping duplicates already queued."""
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+    Job = apps.get_model('image', 'Job')
+    pending = Job.objects.filter(status='pending', photo__isnull=False)
+    first = pending.values('kind', 'photo').annotate(first=Min('id'))
+    pending.exclude(
+        id__in=[row['first'] for row in first]
+    ).delete()
+    schema_editor.execute(
+        "CREATE UNIQUE INDEX image_job_pending ON image_job (kind, photo_id) "
+        "WHERE status = 'pending'"
+    )
+
+
+def drop_pending_index(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        schema_editor.execute('DROP INDEX image_job_pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image', '0024_job_progress'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pending_index, drop_pending_index),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# btree_gin lets the GIN index lead with user_id, so a search matches
+# only the user's documents instead of every user's matches being
+# fetched from the index and then filtered by user.
+POSTGRESQL_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS btree_gin',
+    'CREATE INDEX image_searchdocument_user_document '
+    'ON image_searchdocument USING gin (user_id, document)',
+    'DROP INDEX image_searchdocument_document',
+]
+
+POSTGRESQL_DROP = [
+    'CREATE INDEX image_searchdocument_document ON image_searchdocument '
+    'USING gin (document)',
+    'DROP INDEX image_searchdocument_user_document',
+]
+
+
+def create_user_index(apps, schema_editor):
+    """Index search documents by user and document together on
+    PostgreSQL, replacing the index of documents alone."""
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRESQL_INDEX:
+            schema_editor.execute(sql)
+
+
+def drop_user_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRESQL_DROP:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image', '0025_job_pending_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_index, drop_user_index),
+    ]
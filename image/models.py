@@ -1,8 +1,14 @@
 from __future__ import unicode_literals
-from django.db import models
+import uuid
+
+from django.db import models, transaction
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils.encoding import python_2_unicode_compatible
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
+
+from .storage import collect, photo_storage
 
 
 PUB_CHOICES = (
@@ -12,8 +18,21 @@ PUB_CHOICES = (
 )
 
 
+TRACKED_FIELDS = ('published', 'photo', 'title', 'description')
+
+JOB_STATUSES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+
 def photo_path(instance, filename):
-    """Create file path for the photo."""
+    """Create file path for the photo.
+
+    Only the extension of the path is kept by the content-addressed
+    photo storage."""
     return "{0}/{1}".format(instance.user.username, filename)
 
 
@@ -29,8 +48,10 @@ class Photo(models.Model):
     )
     photo = models.ImageField(
         upload_to=photo_path,
+        storage=photo_storage,
         blank=True,
-        null=True
+        null=True,
+        db_index=True
     )
     title = models.CharField(max_length=128)
     description = models.TextField(blank=True)
@@ -43,6 +64,60 @@ class Photo(models.Model):
         default='Public'
     )
     tags = TaggableManager(blank=True)
+    dhash = models.BigIntegerField(blank=True, null=True, editable=False)
+    dhash_band0 = models.PositiveIntegerField(
+        blank=True, null=True, editable=False
+    )
+    dhash_band1 = models.PositiveIntegerField(
+        blank=True, null=True, editable=False
+    )
+    dhash_band2 = models.PositiveIntegerField(
+        blank=True, null=True, editable=False
+    )
+    dhash_band3 = models.PositiveIntegerField(
+        blank=True, null=True, editable=False
+    )
+
+    class Meta(object):
+        ordering = ('date_uploaded', 'id')
+        index_together = [
+            ('user', 'date_uploaded'),
+            ('published', 'id'),
+            ('user', 'published'),
+            ('user', 'dhash_band0'),
+            ('user', 'dhash_band1'),
+            ('user', 'dhash_band2'),
+            ('user', 'dhash_band3'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        """Remember the state the photo was loaded with."""
+        super(Photo, self).__init__(*args, **kwargs)
+        self._remember_state()
+
+    def save(self, *args, **kwargs):
+        """Save the photo and remember its new state.
+
+        The save is atomic so a new image stays locked until the photo
+        referring to it is committed."""
+        with transaction.atomic():
+            super(Photo, self).save(*args, **kwargs)
+        self._remember_state()
+
+    def _remember_state(self):
+        """Store the tracked fields' current values."""
+        self._loaded = dict(
+            (name, self._raw_value(name)) for name in TRACKED_FIELDS
+        )
+
+    def _raw_value(self, name):
+        """Return a field's value without loading deferred fields."""
+        value = self.__dict__.get(name)
+        return getattr(value, 'name', value)
+
+    def field_changed(self, name):
+        """Return whether a tracked field changed since it was loaded."""
+        return self._raw_value(name) != self._loaded[name]
 
     def __str__(self):
         return self.title
@@ -78,5 +153,411 @@ class Album(models.Model):
         default='Public',
     )
 
+    class Meta(object):
+        ordering = ('date_created', 'id')
+        index_together = [('user', 'date_created')]
+
     def __str__(self):
         return '{}'.format(self.title)
+
+
+@python_2_unicode_compatible
+class Job(models.Model):
+    """A unit of background work, run by the process_jobs command.
+
+    Jobs about one photo name it; jobs over many photos name the user
+    they were started for, keep their parameters as JSON in data and
+    count how many of their total items are done as they go."""
+    kind = models.CharField(max_length=32)
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.deletion.CASCADE,
+        related_name='jobs',
+        blank=True,
+        null=True
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.deletion.CASCADE,
+        related_name='jobs',
+        blank=True,
+        null=True
+    )
+    data = models.TextField(blank=True)
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    status = models.CharField(
+        max_length=7,
+        choices=JOB_STATUSES,
+        default='pending',
+        db_index=True
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} job {} ({})'.format(self.kind, self.pk, self.status)
+
+
+@python_2_unicode_compatible
+class PhotoUpload(models.Model):
+    """A resumable upload of a photo, written to disk in chunks."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.deletion.CASCADE,
+        related_name='uploads'
+    )
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    image_format = models.CharField(max_length=16, blank=True)
+    title = models.CharField(max_length=128)
+    description = models.TextField(blank=True)
+    published = models.CharField(
+        max_length=7,
+        choices=PUB_CHOICES,
+        default='Public'
+    )
+    tags = models.CharField(max_length=255, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} ({}/{})'.format(self.filename, self.offset, self.size)
+
+
+def tag_key(name):
+    """Return the case-folded key tags are looked up by."""
+    return name.lower()
+
+
+@python_2_unicode_compatible
+class PhotoTag(models.Model):
+    """An entry of the per-user index from case-folded tag names to photos.
+
+    taggit stores tags through a generic relation, which can't be
+    indexed by user. This index mirrors it, kept up to date from
+    taggit's m2m_changed signal."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.deletion.CASCADE,
+        related_name='photo_tags'
+    )
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.deletion.CASCADE,
+        related_name='tag_entries'
+    )
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.deletion.CASCADE,
+        related_name='photo_tags'
+    )
+    key = models.CharField(max_length=100)
+
+    class Meta(object):
+        unique_together = [('photo', 'tag')]
+        index_together = [('user', 'key', 'photo')]
+
+    def __str__(self):
+        return '{} on photo {}'.format(self.key, self.photo_id)
+
+
+@python_2_unicode_compatible
+class Thumbnail(models.Model):
+    """A rendered sorl thumbnail of a photo, with its file name and size.
+
+    Rows are looked up in bulk for a page of photos, in place of one
+    key value store lookup per thumbnail tag. source is the image the
+    thumbnail was rendered from, so a row outlived by a replaced image
+    is never used."""
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.deletion.CASCADE,
+        related_name='thumbnails'
+    )
+    geometry = models.CharField(max_length=32)
+    options = models.CharField(max_length=255)
+    source = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta(object):
+        unique_together = [('photo', 'geometry', 'options')]
+
+    def __str__(self):
+        return '{} thumbnail of photo {}'.format(self.geometry, self.photo_id)
+
+    @property
+    def url(self):
+        """Return the url of the thumbnail file."""
+        from sorl.thumbnail import default
+        return default.storage.url(self.name)
+
+
+RENDITION_FORMATS = (
+    ('JPEG', 'JPEG'),
+    ('WEBP', 'WebP'),
+)
+
+
+def rendition_path(instance, filename):
+    """Return the path a rendition of a photo is stored at."""
+    return 'renditions/{}/{}'.format(instance.photo_id, filename)
+
+
+@python_2_unicode_compatible
+class PhotoRendition(models.Model):
+    """A resized copy of a photo's image, for responsive image markup."""
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.deletion.CASCADE,
+        related_name='renditions'
+    )
+    image = models.ImageField(upload_to=rendition_path, max_length=255)
+    format = models.CharField(max_length=4, choices=RENDITION_FORMATS)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta(object):
+        unique_together = [('photo', 'format', 'width')]
+        ordering = ('format', 'width')
+
+    def __str__(self):
+        return '{} {}w of photo {}'.format(
+            self.format, self.width, self.photo_id
+        )
+
+
+@python_2_unicode_compatible
+class PhotoMetadata(models.Model):
+    """Metadata read from the header of a photo's image.
+
+    Photos are filtered by camera, lens, date taken, size and location
+    through these indexed columns instead of by opening their files. The
+    user is copied from the photo so every filter is a range of a
+    per-user index."""
+    photo = models.OneToOneField(
+        Photo,
+        on_delete=models.deletion.CASCADE,
+        primary_key=True,
+        related_name='metadata'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.deletion.CASCADE,
+        related_name='photo_metadata'
+    )
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    taken_at = models.DateTimeField(blank=True, null=True)
+    camera = models.CharField(max_length=128, blank=True)
+    lens = models.CharField(max_length=128, blank=True)
+    iso = models.PositiveIntegerField(blank=True, null=True)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    date_extracted = models.DateTimeField(auto_now=True)
+
+    class Meta(object):
+        index_together = [
+            ('user', 'taken_at'),
+            ('user', 'camera'),
+            ('user', 'lens'),
+            ('user', 'width', 'height'),
+            ('user', 'iso'),
+            ('user', 'latitude', 'longitude'),
+        ]
+
+    def __str__(self):
+        return 'Metadata of photo {}'.format(self.photo_id)
+
+
+@python_2_unicode_compatible
+class SearchDocument(models.Model):
+    """The searchable text of a photo or an album.
+
+    The text is copied here from the photo or album and the photo's
+    tags, and a full-text index over it is added by the migration for
+    the database in use: a tsvector column with a GIN index, filled in
+    by a trigger, on PostgreSQL, or an FTS5 table kept in step by
+    triggers on SQLite. See image.search."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.deletion.CASCADE,
+        related_name='search_documents'
+    )
+    photo = models.OneToOneField(
+        Photo,
+        on_delete=models.deletion.CASCADE,
+        related_name='search_document',
+        blank=True,
+        null=True
+    )
+    album = models.OneToOneField(
+        Album,
+        on_delete=models.deletion.CASCADE,
+        related_name='search_document',
+        blank=True,
+        null=True
+    )
+    title = models.TextField(blank=True)
+    tags = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+
+    def __str__(self):
+        if self.photo_id is not None:
+            return 'Search document of photo {}'.format(self.photo_id)
+        return 'Search document of album {}'.format(self.album_id)
+
+
+@receiver(models.signals.post_save, sender=Photo)
+def photo_saved(sender, instance, created, **kwargs):
+    """Update the random photo pool when a photo's published state changes."""
+    from .sampler import update_pool
+    if created or instance.field_changed('published'):
+        update_pool(instance)
+
+
+@receiver(models.signals.post_save, sender=Photo)
+def queue_thumbnails(sender, instance, created, **kwargs):
+    """Queue rendering of thumbnails and renditions, reading of metadata
+    and hashing for a new or replaced image."""
+    from .jobs import enqueue
+    if instance.photo and (created or instance.field_changed('photo')):
+        enqueue('thumbnails', photo=instance)
+        enqueue('renditions', photo=instance)
+        enqueue('metadata', photo=instance)
+        enqueue('dhash', photo=instance)
+
+
+@receiver(models.signals.post_delete, sender=Photo)
+def photo_deleted(sender, instance, **kwargs):
+    """Remove a deleted photo from the random photo pool."""
+    from .sampler import update_pool
+    update_pool(instance, removed=True)
+
+
+@receiver(models.signals.post_save, sender=Photo)
+def forget_thumbnails(sender, instance, created, **kwargs):
+    """Drop the thumbnail records of a replaced image."""
+    if not created and instance.field_changed('photo'):
+        instance.thumbnails.all().delete()
+
+
+@receiver(models.signals.post_save, sender=Photo)
+def collect_replaced_image(sender, instance, created, **kwargs):
+    """Delete a replaced image once no other photo refers to it."""
+    if not created and instance.field_changed('photo'):
+        name = instance._loaded['photo']
+        transaction.on_commit(lambda: collect(name))
+
+
+@receiver(models.signals.post_delete, sender=Photo)
+def collect_deleted_image(sender, instance, **kwargs):
+    """Delete a photo's image once no other photo refers to it."""
+    if instance.photo:
+        name = instance.photo.name
+        transaction.on_commit(lambda: collect(name))
+
+
+@receiver(models.signals.m2m_changed, sender=TaggedItem)
+def index_photo_tags(sender, instance, action, pk_set, **kwargs):
+    """Mirror changes to a photo's tags in the tag index."""
+    from .tagindex import index_tags, unindex_tags
+    if not isinstance(instance, Photo):
+        return
+    if action == 'post_add' and pk_set:
+        index_tags({instance: pk_set})
+    elif action == 'post_remove' and pk_set:
+        unindex_tags(instance, pk_set)
+    elif action == 'post_clear':
+        unindex_tags(instance)
+
+
+@receiver(models.signals.m2m_changed, sender=TaggedItem)
+def index_photo_tag_text(sender, instance, action, pk_set, **kwargs):
+    """Rewrite a photo's search document when its tags change.
+
+    Registered after index_photo_tags, as the tags are read from the
+    tag index."""
+    from .search import index_photos
+    if not isinstance(instance, Photo):
+        return
+    if action in ('post_add', 'post_remove') and pk_set or (
+        action == 'post_clear'
+    ):
+        index_photos([instance.pk])
+
+
+@receiver(models.signals.post_delete, sender=PhotoRendition)
+def delete_rendition_file(sender, instance, **kwargs):
+    """Delete a rendition's file once its row is gone."""
+    name, storage = instance.image.name, instance.image.storage
+    if name:
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(models.signals.post_save, sender=Photo)
+@receiver(models.signals.post_delete, sender=Photo)
+def bump_photo_generations(sender, instance, **kwargs):
+    """Expire cached fragments showing a changed photo.
+
+    Album grids show cover photos and deleting a photo removes its tags,
+    so those generations move on too."""
+    from .generations import bump
+    if instance.user_id is not None:
+        bump(instance.user_id, 'photos', 'albums', 'tags')
+
+
+@receiver(models.signals.post_save, sender=Photo)
+def index_photo_text(sender, instance, created, **kwargs):
+    """Rewrite a photo's search document when its text changes."""
+    from .search import index_photos
+    if created or any(
+        instance.field_changed(name) for name in ('title', 'description')
+    ):
+        index_photos([instance.pk])
+
+
+@receiver(models.signals.post_save, sender=Album)
+def index_album_text(sender, instance, **kwargs):
+    """Rewrite an album's search document."""
+    from .search import index_albums
+    index_albums([instance.pk])
+
+
+@receiver(models.signals.post_save, sender=PhotoMetadata)
+def bump_metadata_generations(sender, instance, **kwargs):
+    """Expire cached photo lists which may be filtered by metadata."""
+    from .generations import bump
+    bump(instance.user_id, 'photos')
+
+
+@receiver(models.signals.post_save, sender=Album)
+@receiver(models.signals.post_delete, sender=Album)
+def bump_album_generations(sender, instance, **kwargs):
+    """Expire cached fragments showing a changed album."""
+    from .generations import bump
+    if instance.user_id is not None:
+        bump(instance.user_id, 'albums')
+
+
+@receiver(models.signals.m2m_changed, sender=Album.photos.through)
+def bump_album_photos_generations(sender, instance, action, **kwargs):
+    """Expire cached fragments of albums whose photos changed."""
+    from .generations import bump
+    if action.startswith('post_') and instance.user_id is not None:
+        bump(instance.user_id, 'albums')
+
+
+@receiver(models.signals.m2m_changed, sender=TaggedItem)
+def bump_tag_generations(sender, instance, action, **kwargs):
+    """Expire cached fragments showing a photo's tags."""
+    from .generations import bump
+    if (isinstance(instance, Photo) and action.startswith('post_') and
+            instance.user_id is not None):
+        bump(instance.user_id, 'tags')
@@ -0,0 +1,94 @@
+"""The query shapes behind the busiest pages.
+
+Views build their querysets from these functions, and the
+explain_queries command runs EXPLAIN over the same shapes, so a change
+which stops one of them using an index shows up there. Each shape notes
+the index it is meant to use.
+"""
+from django.db.models import Max, Min
+
+from . import keyset
+from .duplicates import candidates
+from .metadata import MetadataFilterForm
+from .models import Album, Photo
+from .search import SearchResults, search_terms
+from .tagindex import photos_with_tags
+
+
+def library_photos(user):
+    """A user's photos, oldest first: the (user, date_uploaded) index."""
+    return Photo.objects.filter(user=user).order_by(*keyset.ORDERING)
+
+
+def library_albums(user):
+    """A user's albums, oldest first: the (user, date_created) index."""
+    return Album.objects.filter(user=user).select_related('cover').order_by(
+        'date_created', 'id'
+    )
+
+
+def public_photos():
+    """Public photos by id: the partial index of public photo ids, or the
+    (published, id) index where partial indexes aren't supported."""
+    return Photo.objects.filter(published='Public').order_by('id')
+
+
+def user_public_photos(user):
+    """A user's public photos: the (user, published) index."""
+    return Photo.objects.filter(user=user, published='Public')
+
+
+def explain_shapes(user):
+    """Return (label, queryset) pairs of the shapes, filled in from user.
+
+    Search is given as its SearchResults, whose sql_with_params() is the
+    full-text query. Shapes which need a photo, album, tag, camera or
+    titled document of the user are left out if the user has none."""
+    photos = library_photos(user)
+    bounds = Photo.objects.aggregate(low=Min('id'), high=Max('id'))
+    pivot = 0
+    if bounds['low'] is not None:
+        pivot = (bounds['low'] + bounds['high']) // 2
+    shapes = [
+        ('library photos, first page', photos[:4]),
+        ('library albums, first page', library_albums(user)[:4]),
+        ('public photo probe', public_photos().filter(id__gte=pivot)[:1]),
+        ('public photo count', user_public_photos(user).values('id')),
+    ]
+    first = photos.first()
+    if first is not None:
+        shapes.append((
+            'library photos, next page',
+            keyset.after(photos, keyset.position(first))[:4],
+        ))
+    tag = user.photo_tags.values_list('key', flat=True).first()
+    if tag is not None:
+        shapes.append((
+            'photos by tag', photos_with_tags(user, [tag]).order_by(
+                *keyset.ORDERING
+            )[:4],
+        ))
+    metadata = user.photo_metadata.exclude(camera='').first()
+    if metadata is not None:
+        filters = MetadataFilterForm(dict(camera=metadata.camera))
+        shapes.append((
+            'photos by camera', filters.filter(photos, user)[:4],
+        ))
+    hashed = user.photos.exclude(dhash=None).first()
+    if hashed is not None:
+        shapes.append(('near-duplicate candidates', candidates(hashed)))
+    album = user.albums.first()
+    if album is not None:
+        shapes.append((
+            'album photos, first page',
+            album.photos.order_by(*keyset.ORDERING)[:4],
+        ))
+    title = user.search_documents.exclude(title='').values_list(
+        'title', flat=True
+    ).first()
+    if title and search_terms(title):
+        shapes.append((
+            'photo search, first page',
+            SearchResults(user, search_terms(title)[0], photos),
+        ))
+    return shapes
@@ -0,0 +1,124 @@
+"""Responsive renditions of photos.
+
+Each photo's image is resized to a ladder of widths, and each width is
+saved as a progressive JPEG and, where Pillow was built with WebP
+support, as WebP. Browsers pick the smallest rendition which fills the
+space the image takes on screen from the srcset markup the
+``renditions`` template tags write.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image
+
+from .metadata import ORIENTATION, read_exif
+from .models import PhotoRendition
+
+
+# Widths in pixels, narrowest first.
+WIDTHS = (320, 640, 1024, 1600, 2048)
+
+# Options passed to Image.save for each format.
+SAVE_OPTIONS = {
+    'JPEG': dict(quality=82, progressive=True, optimize=True),
+    'WEBP': dict(quality=80, method=4),
+}
+
+EXTENSIONS = {
+    'JPEG': 'jpg',
+    'WEBP': 'webp',
+}
+
+# Transpositions turning an image the way its EXIF orientation says it
+# is displayed, as sorl does for thumbnails.
+ORIENTATIONS = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.ROTATE_270, Image.FLIP_LEFT_RIGHT),
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_90, Image.FLIP_LEFT_RIGHT),
+    8: (Image.ROTATE_90,),
+}
+
+
+def rendition_widths(source_width):
+    """Return the widths to render an image source_width pixels wide at.
+
+    Images are never scaled up; an image narrower than the largest width
+    also gets a rendition at its own width."""
+    widths = getattr(settings, 'PHOTO_RENDITION_WIDTHS', WIDTHS)
+    ladder = [width for width in widths if width < source_width]
+    if source_width <= max(widths):
+        ladder.append(source_width)
+    return ladder
+
+
+def rendition_formats():
+    """Return the formats to save renditions in."""
+    Image.init()
+    return [name for name in ('JPEG', 'WEBP') if name in Image.SAVE]
+
+
+def orient(image):
+    """Return image turned the way its EXIF orientation says it is shown."""
+    for method in ORIENTATIONS.get(read_exif(image).get(ORIENTATION), ()):
+        image = image.transpose(method)
+    return image
+
+
+def flatten(image):
+    """Return image as RGB, laying transparent images on white."""
+    if image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    ):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def encode(image, format):
+    """Return image encoded in format as a ContentFile."""
+    out = BytesIO()
+    image.save(out, format, **SAVE_OPTIONS[format])
+    return ContentFile(out.getvalue())
+
+
+def render_renditions(photo):
+    """Replace the renditions of photo with freshly rendered ones.
+
+    The source is decoded once, turned upright by its EXIF orientation,
+    and each width is resized from the one above it, which is much
+    faster than resizing from full size every time and looks the same."""
+    with photo.photo.storage.open(photo.photo.name) as f:
+        source = Image.open(f)
+        source.load()
+    source = flatten(orient(source))
+    formats = rendition_formats()
+    renditions = []
+    image = source
+    for width in reversed(rendition_widths(source.width)):
+        height = max(1, int(round(source.height * width / source.width)))
+        if width != image.width:
+            image = image.resize((width, height), Image.LANCZOS)
+        for format in formats:
+            renditions.append((format, width, height, encode(image, format)))
+    with transaction.atomic():
+        photo.renditions.all().delete()
+        for format, width, height, content in renditions:
+            rendition = PhotoRendition(
+                photo=photo, format=format, width=width, height=height
+            )
+            name = '{}w.{}'.format(width, EXTENSIONS[format])
+            rendition.image.save(name, content)
+    return photo.renditions.all()
+
+
+def renditions_job(job):
+    """Job handler rendering the renditions of the job's photo."""
+    if job.photo is not None and job.photo.photo:
+        render_renditions(job.photo)
@@ -0,0 +1,96 @@
+"""Constant-time sampling of random public photos.
+
+Sorting the whole public photo table with ``ORDER BY RANDOM()`` on every
+request is expensive, so a small pool of public photo ids is sampled by
+probing random points of the id range and kept in the cache. Each
+request then only picks an id from the pool and fetches that one photo.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Min
+
+from .models import Photo
+from .queries import public_photos
+
+
+POOL_KEY = 'image:public-photo-pool'
+
+
+def pool_size():
+    """Return the number of photo ids to keep in the pool."""
+    return getattr(settings, 'PHOTO_SAMPLE_POOL_SIZE', 32)
+
+
+def pool_timeout():
+    """Return the number of seconds before the pool is resampled."""
+    return getattr(settings, 'PHOTO_SAMPLE_POOL_TIMEOUT', 300)
+
+
+def build_pool(size):
+    """Sample up to size distinct public photo ids.
+
+    Each probe picks a random id between the smallest and largest photo
+    id and takes the first public photo at or after it, wrapping around
+    to the last one before it. Every probe is an index range scan, so
+    the cost does not depend on the size of the table."""
+    bounds = Photo.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return []
+    public = public_photos().values_list('id', flat=True)
+    ids = set()
+    for _ in range(size):
+        pivot = random.randint(bounds['low'], bounds['high'])
+        found = public.filter(id__gte=pivot).first()
+        if found is None:
+            found = public.filter(id__lt=pivot).last()
+        if found is None:
+            break
+        ids.add(found)
+    return sorted(ids)
+
+
+def get_pool():
+    """Return the cached pool of public photo ids, sampling it if needed."""
+    pool = cache.get(POOL_KEY)
+    if pool is None:
+        pool = build_pool(pool_size())
+        cache.set(POOL_KEY, pool, pool_timeout())
+    return pool
+
+
+def invalidate_pool():
+    """Drop the cached pool so the next request samples a fresh one."""
+    cache.delete(POOL_KEY)
+
+
+def update_pool(photo, removed=False):
+    """Keep the cached pool consistent with a photo's published state.
+
+    The pool is dropped when it holds a photo which is no longer public,
+    or when a photo becomes public while the pool is smaller than its
+    target size (which only happens for small tables)."""
+    pool = cache.get(POOL_KEY)
+    if pool is None:
+        return
+    public = photo.published == 'Public' and not removed
+    if photo.pk in pool:
+        if not public:
+            invalidate_pool()
+    elif public and len(pool) < pool_size():
+        invalidate_pool()
+
+
+def random_public_photo():
+    """Return a random public photo, or None if there are none."""
+    for _ in range(2):
+        pool = get_pool()
+        if not pool:
+            return None
+        photo_id = random.choice(pool)
+        photo = Photo.objects.filter(id=photo_id, published='Public').first()
+        if photo is not None:
+            return photo
+        invalidate_pool()
+    return None
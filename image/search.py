@@ -0,0 +1,194 @@
+"""Full-text search over a user's photos and albums.
+
+Each photo and album has a SearchDocument row holding its title, its
+description as the body and, for photos, its tag names, kept up to date
+by signal receivers and by index_photos calls from bulk writes. The
+full-text index over those rows depends on the database:
+
+* On PostgreSQL a trigger fills a tsvector column, weighting titles
+  over tags over bodies, which a btree_gin index covers together with
+  the user, so only the user's documents are matched. Results are
+  ranked by ts_rank.
+* On SQLite an FTS5 table using the same rows as its external content
+  is kept in step by triggers. Results are ranked by bm25 with the same
+  column weighting.
+
+On other databases every document of the user is scanned with LIKE, so
+search works but isn't fast.
+
+Queries are split into words, all of which must match; the last word
+also matches as a prefix, so results follow what is being typed.
+"""
+import re
+
+from django.db import connections, transaction
+from django.db.models import Q
+
+from .models import Album, Photo, PhotoTag, SearchDocument
+
+
+# The PostgreSQL text search configuration, also used by the trigger.
+SEARCH_CONFIG = 'english'
+
+# bm25 weights of the title, tags and body columns of the FTS5 table.
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+MAX_TERMS = 16
+
+WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def search_terms(query):
+    """Return the lower-cased words of a search query."""
+    return [word.lower() for word in WORD.findall(query or '')][:MAX_TERMS]
+
+
+def photo_documents(photo_ids):
+    """Return unsaved search documents for photos, with their tags."""
+    tags = {}
+    for photo_id, name in PhotoTag.objects.filter(
+        photo_id__in=photo_ids
+    ).values_list('photo_id', 'tag__name'):
+        tags.setdefault(photo_id, []).append(name)
+    return [
+        SearchDocument(
+            user_id=user_id, photo_id=pk, title=title, body=description,
+            tags=' '.join(sorted(tags.get(pk, []))),
+        )
+        for pk, user_id, title, description in Photo.objects.filter(
+            id__in=photo_ids, user__isnull=False
+        ).values_list('id', 'user_id', 'title', 'description')
+    ]
+
+
+def index_photos(photo_ids):
+    """Write the search documents of photos, replacing their old ones."""
+    photo_ids = list(photo_ids)
+    with transaction.atomic():
+        SearchDocument.objects.filter(photo_id__in=photo_ids).delete()
+        SearchDocument.objects.bulk_create(photo_documents(photo_ids))
+
+
+def index_albums(album_ids):
+    """Write the search documents of albums, replacing their old ones."""
+    album_ids = list(album_ids)
+    with transaction.atomic():
+        SearchDocument.objects.filter(album_id__in=album_ids).delete()
+        SearchDocument.objects.bulk_create(
+            SearchDocument(
+                user_id=user_id, album_id=pk, title=title, body=description
+            )
+            for pk, user_id, title, description in Album.objects.filter(
+                id__in=album_ids
+            ).values_list('id', 'user_id', 'title', 'description')
+        )
+
+
+class SearchResults(object):
+    """The objects of a queryset of a user's photos or albums which match
+    a query, best match first.
+
+    Works with Paginator: counting the results and loading a page of them
+    are each a query against the full-text index, plus one to load the
+    page's objects from queryset."""
+
+    def __init__(self, user, query, queryset):
+        self.user = user
+        self.terms = search_terms(query)
+        self.queryset = queryset
+        self.column = 'photo_id' if queryset.model is Photo else 'album_id'
+        self.db = SearchDocument.objects.db
+        self._count = None
+
+    def count(self):
+        """Return the number of matching documents."""
+        if self._count is None:
+            if not self.terms:
+                self._count = 0
+            elif self.vendor() in ('postgresql', 'sqlite'):
+                from_where, params, _ = self.match()
+                self._count = self.fetch(
+                    'SELECT COUNT(*) ' + from_where, params
+                )[0][0]
+            else:
+                self._count = self.scan().count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        limit = None if index.stop is None else index.stop - start
+        ids = self.ids(start, limit)
+        objects = self.queryset.in_bulk(ids)
+        return [objects[pk] for pk in ids if pk in objects]
+
+    def ids(self, offset, limit):
+        """Return the ids of a range of the results, in rank order."""
+        if limit is None:
+            limit = self.count() - offset
+        if not self.terms or limit <= 0:
+            return []
+        if self.vendor() not in ('postgresql', 'sqlite'):
+            ids = self.scan().values_list(self.column, flat=True)
+            return list(ids[offset:offset + limit])
+        sql, params = self.sql_with_params(offset, limit)
+        return [row[0] for row in self.fetch(sql, params)]
+
+    def sql_with_params(self, offset=0, limit=1):
+        """Return the full-text query selecting the ids of a range of the
+        results, and its parameters."""
+        from_where, params, rank = self.match()
+        sql = 'SELECT d.{0} {1} ORDER BY {2}, d.{0} LIMIT %s OFFSET %s'.format(
+            self.column, from_where, rank
+        )
+        return sql, params + [limit, offset]
+
+    def vendor(self):
+        return connections[self.db].vendor
+
+    def fetch(self, sql, params):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def match(self):
+        """Return the FROM and WHERE clauses matching the query, their
+        parameters and the expression to order the results by."""
+        if self.vendor() == 'postgresql':
+            words = list(self.terms)
+            words[-1] += ':*'
+            return (
+                'FROM image_searchdocument d, to_tsquery(%s, %s) q '
+                'WHERE d.document @@ q AND d.user_id = %s '
+                'AND d.{} IS NOT NULL'.format(self.column),
+                [SEARCH_CONFIG, ' & '.join(words), self.user.pk],
+                'ts_rank(d.document, q) DESC',
+            )
+        words = ['"{}"'.format(word) for word in self.terms]
+        words[-1] += '*'
+        # CROSS JOIN keeps SQLite from walking the user's documents and
+        # running the full-text query again for each one.
+        return (
+            'FROM image_searchdocument_fts f '
+            'CROSS JOIN image_searchdocument d ON d.id = f.rowid '
+            'WHERE image_searchdocument_fts MATCH %s AND d.user_id = %s '
+            'AND d.{} IS NOT NULL'.format(self.column),
+            [' '.join(words), self.user.pk],
+            'bm25(image_searchdocument_fts, {}, {}, {})'.format(*BM25_WEIGHTS),
+        )
+
+    def scan(self):
+        """Return the matching documents found without a full-text index."""
+        documents = SearchDocument.objects.using(self.db).filter(
+            user=self.user, **{self.column + '__isnull': False}
+        )
+        for term in self.terms:
+            documents = documents.filter(
+                Q(title__icontains=term) | Q(tags__icontains=term) |
+                Q(body__icontains=term)
+            )
+        return documents.order_by(self.column)
@@ -0,0 +1,140 @@
+"""Content-addressed storage for photo images.
+
+Images are stored under a name derived from a SHA-256 hash of their
+content, fanned out into nested directories so no single directory
+grows too large. Uploading an image which is already stored only hashes
+it and links the photo to the existing file. Files are shared by every
+photo with the same content, and are deleted by collect() once no photo
+refers to them any more.
+
+A saved image may not be referred to until its photo is committed, so
+saving holds a shared lock on the image until the transaction commits,
+and collect() holds it exclusively while checking for references and
+deleting. Locks are striped over LOCK_STRIPES files by the first
+characters of the hash.
+"""
+import hashlib
+import json
+import os
+import uuid
+
+from django.core.files import File, locks
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+
+LOCK_STRIPES = 256
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Filesystem storage which names files by a hash of their content."""
+
+    def __init__(self, prefix='blobs', fanout=2, depth=2, **kwargs):
+        super(ContentAddressedStorage, self).__init__(**kwargs)
+        self.prefix = prefix
+        self.fanout = fanout
+        self.depth = depth
+
+    def hashed_name(self, name, content):
+        """Return the name content is stored under.
+
+        The content is hashed in chunks, so large files are never held
+        in memory. The original name only contributes its extension."""
+        sha = hashlib.sha256()
+        for chunk in content.chunks():
+            sha.update(chunk)
+        digest = sha.hexdigest()
+        shards = [
+            digest[i * self.fanout:(i + 1) * self.fanout]
+            for i in range(self.depth)
+        ]
+        extension = os.path.splitext(name)[1].lower()
+        return '/'.join([self.prefix] + shards + [digest + extension])
+
+    def save(self, name, content, max_length=None):
+        """Store content unless identical content is already stored."""
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return self.save_hashed(self.hashed_name(name, content), content)
+
+    def save_hashed(self, name, content):
+        """Store content under its already computed hashed name.
+
+        New content is written under a temporary name and renamed into
+        place, so concurrent saves of the same content all end up with
+        the hashed name. The image is locked until the current
+        transaction commits."""
+        lock = self.lock(name, shared=True)
+        try:
+            if not self.exists(name):
+                temporary = self._save(
+                    '{}.{}.part'.format(name, uuid.uuid4().hex), content
+                )
+                os.rename(self.path(temporary), self.path(name))
+        except Exception:
+            self.unlock(lock)
+            raise
+        transaction.on_commit(lambda: self.unlock(lock))
+        return name
+
+    def lock(self, name, shared=False, blocking=True):
+        """Lock the image stored under name, returning the open lock file,
+        or None if blocking is false and the lock is held elsewhere."""
+        digest = os.path.basename(name)
+        stripe = int(digest[:2], 16) % LOCK_STRIPES if digest[:2] else 0
+        directory = self.path(os.path.join(self.prefix, '.locks'))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        f = open(os.path.join(directory, '{:02x}'.format(stripe)), 'a')
+        flags = locks.LOCK_SH if shared else locks.LOCK_EX
+        if not blocking:
+            flags |= locks.LOCK_NB
+        try:
+            locks.lock(f, flags)
+        except (IOError, OSError):
+            f.close()
+            return None
+        return f
+
+    def unlock(self, lock):
+        """Release a lock returned by lock()."""
+        locks.unlock(lock)
+        lock.close()
+
+
+photo_storage = ContentAddressedStorage()
+
+
+def collect(name):
+    """Delete a stored image and its thumbnails if no photo refers to it.
+
+    The image is locked while it is checked and deleted. If a save of
+    the same content holds the lock, collecting is left to a collect job
+    rather than waiting. Returns whether the image was collected."""
+    from sorl.thumbnail import delete
+    from .models import Job, Photo
+    if not name:
+        return False
+    lock = photo_storage.lock(name, blocking=False)
+    if lock is None:
+        Job.objects.create(kind='collect', data=json.dumps(
+            dict(images=[name], renditions=[])
+        ))
+        return False
+    try:
+        if Photo.objects.filter(photo=name).exists():
+            return False
+        if photo_storage.exists(name):
+            delete(photo_storage.path(name), delete_file=False)
+            photo_storage.delete(name)
+        return True
+    finally:
+        photo_storage.unlock(lock)
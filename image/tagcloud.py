@@ -0,0 +1,52 @@
+"""Per-user tag clouds.
+
+A user's tag cloud maps each tag on their photos to the number of
+photos carrying it. It is counted from the tag index with one grouped
+query and cached per user under their tags generation, which moves on
+once a change to their tags commits. A rolled back change leaves the
+cached cloud alone, and a cloud counted while a change was committing
+is cached under the old generation, where it is never read again.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .generations import bump, get_generations
+from .models import PhotoTag
+
+
+def cloud_key(user_id, generation):
+    """Return the cache key of a user's tag cloud."""
+    return 'image:tag-cloud:{}:{}'.format(user_id, generation)
+
+
+def cloud_timeout():
+    """Return the number of seconds before a cached cloud is recounted."""
+    return getattr(settings, 'TAG_CLOUD_TIMEOUT', 60 * 60)
+
+
+def count_tags(user_id):
+    """Count the user's photos by tag name."""
+    counts = PhotoTag.objects.filter(user_id=user_id).values_list(
+        'tag__name'
+    ).annotate(count=Count('photo'))
+    return dict(counts)
+
+
+def get_cloud(user):
+    """Return the user's tags with their counts, ordered by name."""
+    key = cloud_key(user.pk, get_generations(user.pk)['tags'])
+    counts = cache.get(key)
+    if counts is None:
+        counts = count_tags(user.pk)
+        cache.set(key, counts, cloud_timeout())
+    return [
+        dict(name=name, count=counts[name])
+        for name in sorted(counts, key=lambda name: name.lower())
+    ]
+
+
+def invalidate_cloud(user_id):
+    """Expire a user's cached cloud once the current transaction commits,
+    for changes which bypass signals."""
+    bump(user_id, 'tags')
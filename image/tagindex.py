@@ -0,0 +1,81 @@
+"""The per-user tag index.
+
+PhotoTag rows map a user's case-folded tag names to their photos, with
+a composite index on (user, key, photo). Looking up photos by one or
+more tags is then an index range scan instead of a join through
+taggit's generic TaggedItem table.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+from django.db.models.functions import Lower
+from taggit.models import Tag, TaggedItem
+
+from .models import Photo, PhotoTag, tag_key
+
+
+def get_or_create_tags(names):
+    """Return a dict of lower-cased tag names to the ids of the tags with
+    those names in any case, creating the tags which don't exist yet."""
+    names = dict((name.lower(), name) for name in names)
+    if not names:
+        return {}
+    tags = dict(
+        Tag.objects.annotate(lower_name=Lower('name')).filter(
+            lower_name__in=list(names)
+        ).values_list('lower_name', 'id')
+    )
+    for lower_name, name in names.items():
+        if lower_name not in tags:
+            tags[lower_name] = Tag.objects.create(name=name).pk
+    return tags
+
+
+def index_tags(photo_tags):
+    """Add index entries, given a dict of photos to lists of tag ids."""
+    tag_ids = set(tag_id for ids in photo_tags.values() for tag_id in ids)
+    names = dict(Tag.objects.filter(id__in=tag_ids).values_list('id', 'name'))
+    PhotoTag.objects.bulk_create(
+        PhotoTag(
+            user_id=photo.user_id,
+            photo_id=photo.pk,
+            tag_id=tag_id,
+            key=tag_key(names[tag_id]),
+        )
+        for photo, ids in photo_tags.items()
+        for tag_id in ids
+        if photo.user_id is not None
+    )
+
+
+def unindex_tags(photo, tag_ids=None):
+    """Remove a photo's index entries for tag_ids, or all of them."""
+    entries = PhotoTag.objects.filter(photo=photo)
+    if tag_ids is not None:
+        entries = entries.filter(tag_id__in=tag_ids)
+    entries.delete()
+
+
+def rebuild(photos):
+    """Rebuild the index entries of photos from taggit's tables."""
+    photos = list(photos)
+    PhotoTag.objects.filter(photo__in=photos).delete()
+    photo_tags = dict((photo, []) for photo in photos)
+    by_id = dict((photo.pk, photo) for photo in photos)
+    items = TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Photo),
+        object_id__in=list(by_id),
+    ).values_list('object_id', 'tag_id')
+    for photo_id, tag_id in items:
+        photo_tags[by_id[photo_id]].append(tag_id)
+    index_tags(photo_tags)
+
+
+def photos_with_tags(user, names, match='all'):
+    """Return the user's photos tagged with all (or any) of names."""
+    keys = set(tag_key(name) for name in names)
+    entries = PhotoTag.objects.filter(user=user, key__in=keys)
+    if match == 'all' and len(keys) > 1:
+        entries = entries.values('photo').annotate(
+            matched=Count('key', distinct=True)
+        ).filter(matched=len(keys))
+    return Photo.objects.filter(id__in=entries.values('photo'))
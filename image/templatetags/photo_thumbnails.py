@@ -0,0 +1,30 @@
+"""Template tags attaching recorded thumbnails to photos being rendered.
+
+Attaching from the template rather than the view means a page of photos
+is only loaded when the fragment showing it isn't already cached::
+
+    {% load photo_thumbnails %}
+    {% attach_thumbnails photos %}
+    {% for photo in photos %}
+      <img src="{{ photo.thumbnail.url }}">
+    {% endfor %}
+"""
+from django import template
+
+from ..thumbnails import LIBRARY_THUMBNAIL, attach_thumbnails as attach
+
+register = template.Library()
+
+
+@register.simple_tag
+def attach_thumbnails(photos):
+    """Set the library thumbnail of each of photos."""
+    attach(photos, *LIBRARY_THUMBNAIL)
+    return ''
+
+
+@register.simple_tag
+def attach_cover_thumbnails(albums):
+    """Set the library thumbnail of each of albums' covers."""
+    attach([album.cover for album in albums], *LIBRARY_THUMBNAIL)
+    return ''
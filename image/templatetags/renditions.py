@@ -0,0 +1,68 @@
+"""Template tags writing srcset markup for photo renditions.
+
+Usage::
+
+    {% load renditions %}
+    {% responsive_image photo sizes="(min-width: 60em) 50vw, 100vw" %}
+
+Photos whose renditions haven't been rendered yet fall back to a plain
+img of the original image.
+"""
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+def renditions_by_format(photo):
+    """Return photo's renditions as a dict of format to renditions by width.
+
+    Uses photo.renditions.all() so that prefetched renditions are used."""
+    formats = {}
+    for rendition in photo.renditions.all():
+        formats.setdefault(rendition.format, []).append(rendition)
+    for renditions in formats.values():
+        renditions.sort(key=lambda rendition: rendition.width)
+    return formats
+
+
+def srcset_value(renditions):
+    """Return a srcset attribute value listing renditions by width."""
+    return ', '.join(
+        '{} {}w'.format(rendition.image.url, rendition.width)
+        for rendition in renditions
+    )
+
+
+@register.simple_tag
+def srcset(photo, format='JPEG'):
+    """Return the srcset of photo's renditions in format."""
+    return srcset_value(renditions_by_format(photo).get(format, []))
+
+
+@register.simple_tag
+def responsive_image(photo, sizes='100vw', css_class='', alt=''):
+    """Return a picture element offering photo's renditions.
+
+    WebP renditions are offered to browsers which accept them, with
+    the JPEG renditions as the img fallback."""
+    formats = renditions_by_format(photo)
+    jpeg = formats.get('JPEG')
+    if not jpeg:
+        return format_html(
+            '<img src="{}" class="{}" alt="{}">',
+            photo.photo.url, css_class, alt
+        )
+    largest = jpeg[-1]
+    sources = ''
+    if formats.get('WEBP'):
+        sources = format_html(
+            '<source type="image/webp" srcset="{}" sizes="{}">',
+            srcset_value(formats['WEBP']), sizes
+        )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" width="{}" '
+        'height="{}" class="{}" alt="{}"></picture>',
+        sources, largest.image.url, srcset_value(jpeg), sizes,
+        largest.width, largest.height, css_class, alt
+    )
@@ -1,15 +1,69 @@
-from datetime import datetime
-from django.test import TestCase
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from io import BytesIO
+from unittest import skipUnless
+from django.db import IntegrityError, connection, transaction
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.utils.six import StringIO
+from PIL import Image
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.timezone import utc
 from django.urls import reverse
-from factory.django import DjangoModelFactory, ImageField
-from .models import Album, Photo
-
-
-class PhotoFactory(DjangoModelFactory):
-    class Meta(object):
-        model = Photo
-    photo = ImageField()
+from sorl.thumbnail import default as thumbnail_default
+from sorl.thumbnail.images import ImageFile
+from .jobs import (
+    HANDLERS, MAX_ATTEMPTS, claim, enqueue, reclaim, run_job, run_pending
+)
+from . import uploads
+from .storage import ContentAddressedStorage, photo_storage
+from .bulk import delete_photos, publish_photos, run_operation, tag_photos
+from .duplicates import (
+    MAX_DISTANCE, dhash, distances, duplicate_groups, hash_fields,
+    near_duplicates
+)
+from .membership import MembershipError, change_album
+from .metadata import (
+    coordinate, extract_metadata, image_metadata, read_metadata
+)
+from .models import (
+    Album, Job, Photo, PhotoMetadata, PhotoTag, PhotoUpload, SearchDocument,
+    Thumbnail
+)
+from .generations import bump, get_generations
+from .management.commands.benchmark_views import (
+    measure, regressions, seed, view_urls
+)
+from .management.commands.explain_queries import full_scans
+from .renditions import WIDTHS, render_renditions, rendition_widths
+from .sampler import POOL_KEY, random_public_photo
+from .factories import PhotoFactory
+from .search import SearchResults
+from .tagcloud import count_tags, get_cloud
+from .tagindex import photos_with_tags, rebuild
+from .thumbnails import LIBRARY_THUMBNAIL, Placeholder, attach_thumbnails
+
+
+def run_on_commit():
+    """Run the on_commit callbacks waiting on TestCase's transaction,
+    which never commits."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
+def delete_photo_job(job):
+    """Job handler deleting the job's photo, as a user might meanwhile."""
+    delete_photos(job.photo.user, [job.photo_id])
 
 
 class PhotoTestCase(TestCase):
@@ -115,11 +169,502 @@ class AlbumTestCase(TestCase):
         )
 
 
+class SamplerTestCase(TestCase):
+    """Test case for sampling random public photos."""
+
+    def setUp(self):
+        """Set up a user with a public and a private photo."""
+        cache.clear()
+        self.user = User(username='Cris')
+        self.user.save()
+        self.public = PhotoFactory(user=self.user, published='Public')
+        self.private = PhotoFactory(user=self.user, published='Private')
+
+    def test_random_photo_is_public(self):
+        """Test sampled photos are always public."""
+        for _ in range(10):
+            self.assertEqual(random_public_photo(), self.public)
+
+    def test_no_public_photos(self):
+        """Test sampling returns None without public photos."""
+        self.public.published = 'Private'
+        self.public.save()
+        self.assertIsNone(random_public_photo())
+
+    def test_pool_invalidated_when_unpublished(self):
+        """Test making a pooled photo private drops the pool."""
+        random_public_photo()
+        self.assertEqual(cache.get(POOL_KEY), [self.public.pk])
+        self.public.published = 'Private'
+        self.public.save()
+        self.assertIsNone(cache.get(POOL_KEY))
+
+    def test_pool_invalidated_when_published(self):
+        """Test publishing a photo drops an underfull pool."""
+        random_public_photo()
+        self.private.published = 'Public'
+        self.private.save()
+        self.assertIsNone(cache.get(POOL_KEY))
+        self.assertEqual(
+            set(random_public_photo().pk for _ in range(50)),
+            {self.public.pk, self.private.pk}
+        )
+
+    def test_pool_invalidated_when_deleted(self):
+        """Test deleting a pooled photo drops the pool."""
+        random_public_photo()
+        self.public.delete()
+        self.assertIsNone(cache.get(POOL_KEY))
+        self.assertIsNone(random_public_photo())
+
+    def test_pool_kept_on_unrelated_save(self):
+        """Test saving a photo without publishing it keeps the pool."""
+        random_public_photo()
+        self.private.title = 'still private'
+        self.private.save()
+        self.assertEqual(cache.get(POOL_KEY), [self.public.pk])
+
+
+class ThumbnailJobTestCase(TestCase):
+    """Test case for pre-rendering thumbnails in background jobs."""
+
+    def setUp(self):
+        """Set up a user with a photo."""
+        self.user = User(username='Cris')
+        self.user.save()
+        self.photo = PhotoFactory(user=self.user)
+
+    def test_job_queued_on_upload(self):
+        """Test uploading a photo queues a thumbnails job."""
+        job = Job.objects.get(photo=self.photo, kind='thumbnails')
+        self.assertEqual(job.status, 'pending')
+        self.assertTrue(Job.objects.filter(
+            photo=self.photo, kind='renditions', status='pending'
+        ).exists())
+
+    def test_no_job_for_metadata_edit(self):
+        """Test editing a photo's title does not queue another job."""
+        run_pending()
+        self.photo.title = 'new title'
+        self.photo.save()
+        self.assertFalse(Job.objects.filter(status='pending').exists())
+
+    def test_job_queued_on_new_image(self):
+        """Test replacing a photo's image queues another job."""
+        run_pending()
+        self.photo.photo = PhotoFactory(
+            user=self.user, photo__color='red'
+        ).photo
+        self.photo.save()
+        self.assertTrue(
+            Job.objects.filter(photo=self.photo, status='pending').exists()
+        )
+
+    def test_run_pending_renders_thumbnails(self):
+        """Test running the job stores the thumbnail in sorl's store."""
+        self.assertEqual(run_pending(kind='thumbnails'), 1)
+        source = ImageFile(self.photo.photo.path)
+        self.assertTrue(
+            thumbnail_default.kvstore._get(source.key, identity='thumbnails')
+        )
+        job = Job.objects.get(photo=self.photo, kind='thumbnails')
+        self.assertEqual(job.status, 'done')
+
+    def test_job_records_thumbnail(self):
+        """Test running the job records the thumbnail's file and size."""
+        run_pending(kind='thumbnails')
+        record = Thumbnail.objects.get(photo=self.photo)
+        self.assertEqual((record.width, record.height), (100, 100))
+        self.assertEqual(record.source, self.photo.photo.name)
+        self.assertTrue(record.url.startswith('/media/cache/'))
+
+    def test_replaced_image_forgets_thumbnails(self):
+        """Test replacing a photo's image drops its thumbnail records."""
+        run_pending(kind='thumbnails')
+        self.photo.photo = PhotoFactory(
+            user=self.user, photo__color='red'
+        ).photo
+        self.photo.save()
+        self.assertFalse(Thumbnail.objects.filter(photo=self.photo).exists())
+
+    def test_attach_thumbnails(self):
+        """Test thumbnails are attached from one query."""
+        others = [PhotoFactory(user=self.user) for _ in range(3)]
+        run_pending(kind='thumbnails')
+        photos = [self.photo] + others
+        with self.assertNumQueries(1):
+            attach_thumbnails(photos, *LIBRARY_THUMBNAIL)
+        self.assertTrue(all(
+            isinstance(photo.thumbnail, Thumbnail) for photo in photos
+        ))
+
+    def test_missing_thumbnail_not_rendered(self):
+        """Test a photo without a thumbnail gets a placeholder and a job
+        rather than rendering during the request."""
+        Job.objects.all().delete()
+        attach_thumbnails([self.photo], *LIBRARY_THUMBNAIL)
+        self.assertIsInstance(self.photo.thumbnail, Placeholder)
+        self.assertEqual(self.photo.thumbnail.url, self.photo.photo.url)
+        self.assertEqual(self.photo.thumbnail.width, '100')
+        self.assertFalse(Thumbnail.objects.exists())
+        self.assertEqual(run_pending(kind='thumbnails'), 1)
+        attach_thumbnails([self.photo], *LIBRARY_THUMBNAIL)
+        self.assertIsInstance(self.photo.thumbnail, Thumbnail)
+
+    def test_stale_record_not_used(self):
+        """Test a record for an image other than the photo's is replaced
+        by a placeholder and rendered again by a job."""
+        run_pending(kind='thumbnails')
+        Thumbnail.objects.update(source='old.png', name='stale.jpg')
+        attach_thumbnails([self.photo], *LIBRARY_THUMBNAIL)
+        self.assertIsInstance(self.photo.thumbnail, Placeholder)
+        run_pending(kind='thumbnails')
+        attach_thumbnails([self.photo], *LIBRARY_THUMBNAIL)
+        self.assertNotEqual(self.photo.thumbnail.name, 'stale.jpg')
+        self.assertEqual(self.photo.thumbnail.source, self.photo.photo.name)
+
+    def test_failed_job(self):
+        """Test a job whose handler raises is queued again, then marked
+        failed after its last attempt."""
+        job = Job.objects.get(kind='thumbnails', photo=self.photo)
+        Photo.objects.filter(id=self.photo.id).update(photo='missing.png')
+        run_pending(kind='thumbnails')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertTrue(job.error)
+        for attempt in range(MAX_ATTEMPTS - 1):
+            run_pending(kind='thumbnails')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', MAX_ATTEMPTS))
+
+    def test_reclaim_stale_jobs(self):
+        """Test jobs left running are queued again, or failed once out of
+        attempts, and jobs still in time are left alone."""
+        claim(kind='thumbnails')
+        job = Job.objects.get(kind='thumbnails', photo=self.photo)
+        self.assertEqual(reclaim(timeout=60), 0)
+        Job.objects.filter(id=job.id).update(
+            date_modified=job.date_modified - timedelta(hours=2)
+        )
+        self.assertEqual(reclaim(timeout=60), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        Job.objects.filter(id=job.id).update(
+            status='running', attempts=MAX_ATTEMPTS,
+            date_modified=job.date_modified - timedelta(hours=2),
+        )
+        reclaim(timeout=60)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    def test_backfill_leaves_running_jobs(self):
+        """Test backfilling stops once nothing can be claimed, reporting
+        jobs running elsewhere."""
+        claim(kind='thumbnails')
+        PhotoFactory(user=self.user)
+        out = StringIO()
+        call_command('backfill_thumbnails', '--workers', '1', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'Queued 0 photos',
+            'Rendered thumbnails for 1 photos',
+            '1 thumbnails jobs are still pending or running elsewhere',
+        ])
+
+    def test_one_pending_job(self):
+        """Test a photo can't have two pending jobs of a kind, and
+        enqueue uses the pending one."""
+        job = enqueue('thumbnails', self.photo)
+        self.assertEqual(enqueue('thumbnails', self.photo), job)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Job.objects.create(kind='thumbnails', photo=self.photo)
+
+
+class RenditionTestCase(TestCase):
+    """Test case for rendering responsive renditions of photos."""
+
+    def setUp(self):
+        """Set up a user with a photo 1000 pixels wide."""
+        self.user = User.objects.create(username='Cris')
+        self.photo = PhotoFactory(
+            user=self.user, photo__width=1000, photo__height=500,
+            photo__filename='wide.jpg', photo__format='JPEG',
+        )
+        self.client.force_login(self.user)
+
+    def test_widths(self):
+        """Test images are never scaled up."""
+        self.assertEqual(rendition_widths(100), [100])
+        self.assertEqual(rendition_widths(1000), [320, 640, 1000])
+        self.assertEqual(rendition_widths(4000), list(WIDTHS))
+
+    def test_job_renders_ladder(self):
+        """Test the renditions job renders each width as progressive JPEG."""
+        self.assertEqual(run_pending(kind='renditions'), 1)
+        jpegs = self.photo.renditions.filter(format='JPEG')
+        self.assertEqual(
+            list(jpegs.values_list('width', 'height')),
+            [(320, 160), (640, 320), (1000, 500)]
+        )
+        for rendition in jpegs:
+            image = Image.open(rendition.image.path)
+            self.assertEqual(image.size, (rendition.width, rendition.height))
+            self.assertTrue(image.info.get('progressive'))
+        webps = self.photo.renditions.filter(format='WEBP')
+        self.assertEqual(webps.count(), 3 if 'WEBP' in Image.SAVE else 0)
+
+    def test_exif_orientation(self):
+        """Test renditions of a rotated JPEG are turned upright, sized as
+        its metadata says it is displayed."""
+        image = Image.new('RGB', (40, 20), (0, 0, 255))
+        image.paste((255, 0, 0), (0, 0, 20, 20))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        f = BytesIO()
+        image.save(f, 'JPEG', exif=exif.tobytes())
+        photo = Photo(user=self.user, title='rotated')
+        photo.photo.save('rotated.jpg', ContentFile(f.getvalue()))
+        rendition = render_renditions(photo).get(format='JPEG')
+        self.assertEqual((rendition.width, rendition.height), (20, 40))
+        upright = Image.open(rendition.image.path).convert('RGB')
+        self.assertEqual(upright.size, (20, 40))
+        self.assertGreater(upright.getpixel((10, 5))[0], 200)
+        self.assertLess(upright.getpixel((10, 35))[0], 50)
+        metadata = image_metadata(Image.open(photo.photo.path))
+        self.assertEqual((metadata['width'], metadata['height']), (20, 40))
+
+    def test_rerender_replaces(self):
+        """Test rendering again replaces the photo's renditions."""
+        render_renditions(self.photo)
+        count = self.photo.renditions.count()
+        render_renditions(self.photo)
+        self.assertEqual(self.photo.renditions.count(), count)
+
+    def test_photo_page_srcset(self):
+        """Test the photo page offers renditions once they're rendered."""
+        url = reverse('images', args=[self.photo.pk])
+        response = self.client.get(url)
+        self.assertContains(response, 'src="{}"'.format(self.photo.photo.url))
+        render_renditions(self.photo)
+        response = self.client.get(url)
+        for rendition in self.photo.renditions.all():
+            self.assertContains(response, '{} {}w'.format(
+                rendition.image.url, rendition.width
+            ))
+        self.assertContains(response, 'width="1000" height="500"')
+
+    def test_rendition_permissions(self):
+        """Test renditions of private photos are only served to the owner."""
+        self.photo.published = 'Private'
+        self.photo.save()
+        rendition = render_renditions(self.photo).first()
+        url = rendition.image.url
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_login(User.objects.create(username='other'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ContentAddressedStorageTestCase(TransactionTestCase):
+    """Test case for storing photos by the hash of their content."""
+
+    def setUp(self):
+        """Set up a user and two photos with the same image."""
+        self.user = User(username='Cris')
+        self.user.save()
+        self.first = PhotoFactory(user=self.user)
+        self.second = PhotoFactory(user=self.user)
+
+    def make_photo(self, content, name='photo.png'):
+        """Create a photo whose image has content."""
+        photo = Photo(user=self.user, title='photo')
+        photo.photo.save(name, ContentFile(content))
+        return photo
+
+    def test_same_content_shares_file(self):
+        """Test photos with the same image share one stored file."""
+        self.assertEqual(self.first.photo.name, self.second.photo.name)
+
+    def test_name_is_sharded_hash(self):
+        """Test files are named by their hash in fanned out directories."""
+        photo = self.make_photo(b'content', 'Photo.PNG')
+        digest = hashlib.sha256(b'content').hexdigest()
+        self.assertEqual(
+            photo.photo.name,
+            'blobs/{}/{}/{}.png'.format(digest[:2], digest[2:4], digest)
+        )
+
+    def test_delete_keeps_shared_file(self):
+        """Test deleting one of two photos sharing a file keeps the file."""
+        self.first.delete()
+        self.assertTrue(photo_storage.exists(self.second.photo.name))
+
+    def test_delete_last_reference_collects_file(self):
+        """Test deleting the last photo using a file deletes the file."""
+        name = self.first.photo.name
+        self.first.delete()
+        self.second.delete()
+        self.assertFalse(photo_storage.exists(name))
+
+    def test_replaced_image_collected(self):
+        """Test replacing a photo's only copy of an image deletes it."""
+        photo = self.make_photo(b'old image')
+        name = photo.photo.name
+        photo.photo.save('new.png', ContentFile(b'new image'))
+        self.assertFalse(photo_storage.exists(name))
+        self.assertTrue(photo_storage.exists(photo.photo.name))
+
+    def test_concurrent_save_keeps_hashed_name(self):
+        """Test content stored while being saved again keeps its name."""
+        storage = ContentAddressedStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        name = storage.save('photo.png', ContentFile(b'content'))
+        storage.exists = lambda name: False
+        self.assertEqual(storage.save('photo.png', ContentFile(b'content')),
+                         name)
+        directory = os.path.dirname(storage.path(name))
+        self.assertEqual(os.listdir(directory), [os.path.basename(name)])
+
+    def test_collect_waits_for_save(self):
+        """Test an image isn't collected while it is being saved again,
+        and is collected by a job afterwards."""
+        name = self.first.photo.name
+        lock = photo_storage.lock(name, shared=True)
+        Photo.objects.filter(user=self.user).delete()
+        self.assertTrue(photo_storage.exists(name))
+        photo_storage.unlock(lock)
+        self.assertEqual(run_pending('collect'), 2)
+        self.assertFalse(photo_storage.exists(name))
+
+    def test_save_locks_until_commit(self):
+        """Test a saved image is locked until its transaction commits."""
+        with transaction.atomic():
+            photo = self.make_photo(b'locked')
+            self.assertIsNone(
+                photo_storage.lock(photo.photo.name, blocking=False)
+            )
+        lock = photo_storage.lock(photo.photo.name, blocking=False)
+        self.assertIsNotNone(lock)
+        photo_storage.unlock(lock)
+
+    def test_bulk_delete_collects_files(self):
+        """Test images of photos deleted in bulk are collected by a job."""
+        name = self.first.photo.name
+        delete_photos(self.user, [self.first.id, self.second.id])
+        self.assertTrue(photo_storage.exists(name))
+        self.assertEqual(run_pending('collect'), 1)
+        self.assertFalse(photo_storage.exists(name))
+
+
+class ImportPhotosTestCase(TestCase):
+    """Test case for the import_photos management command."""
+
+    def setUp(self):
+        """Set up a directory of images to import."""
+        self.user = User(username='Cris')
+        self.user.save()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        os.mkdir(os.path.join(self.directory, 'nested'))
+        options = {}
+        if hasattr(Image, 'Exif'):
+            exif = Image.Exif()
+            exif[0x9c9e] = 'beach;Sunset'.encode('utf-16-le')
+            options['exif'] = exif.tobytes()
+        Image.new('RGB', (20, 20), 'red').save(
+            os.path.join(self.directory, 'red.jpg'), **options
+        )
+        Image.new('RGB', (20, 20), 'blue').save(
+            os.path.join(self.directory, 'nested', 'blue.png')
+        )
+        shutil.copy(
+            os.path.join(self.directory, 'red.jpg'),
+            os.path.join(self.directory, 'nested', 'copy.jpg')
+        )
+        with open(os.path.join(self.directory, 'broken.jpg'), 'wb') as f:
+            f.write(b'not an image')
+
+    def run_import(self, *args):
+        """Import the directory for the user and return the output."""
+        out = StringIO()
+        call_command(
+            'import_photos', self.directory, '--user', 'Cris',
+            '--workers', '1', stdout=out, stderr=StringIO(), *args
+        )
+        return out.getvalue()
+
+    def test_import_creates_photos(self):
+        """Test each distinct valid image becomes a photo."""
+        self.run_import()
+        titles = sorted(self.user.photos.values_list('title', flat=True))
+        self.assertIn(titles, (['blue', 'red'], ['blue', 'copy']))
+
+    def test_import_indexes_tags(self):
+        """Test imported tags are found through the tag index."""
+        self.run_import('--tag', 'Imported')
+        photos = photos_with_tags(self.user, ['imported'])
+        self.assertEqual(photos.count(), 2)
+
+    def test_import_indexes_text(self):
+        """Test imported photos can be searched for."""
+        self.run_import('--tag', 'Imported')
+        results = SearchResults(self.user, 'imported', Photo.objects.all())
+        self.assertEqual(results.count(), 2)
+
+    def test_import_reads_metadata(self):
+        """Test imported photos get their metadata without a job."""
+        self.run_import()
+        photo = self.user.photos.get(title='blue')
+        self.assertEqual((photo.metadata.width, photo.metadata.height),
+                         (20, 20))
+        self.assertFalse(Job.objects.filter(kind='metadata').exists())
+
+    def test_import_hashes_images(self):
+        """Test imported photos get their perceptual hash without a job."""
+        self.run_import()
+        self.assertFalse(self.user.photos.filter(dhash=None).exists())
+        self.assertFalse(Job.objects.filter(kind='dhash').exists())
+
+    @skipUnless(hasattr(Image, 'Exif'), 'Writing EXIF needs Pillow 6')
+    def test_import_reads_keywords(self):
+        """Test EXIF keywords and extra tags are attached."""
+        self.run_import('--tag', 'imported')
+        photo = self.user.photos.exclude(title='blue').get()
+        self.assertEqual(
+            sorted(photo.tags.names()), ['Sunset', 'beach', 'imported']
+        )
+        blue = self.user.photos.get(title='blue')
+        self.assertEqual(list(blue.tags.names()), ['imported'])
+
+    def test_import_into_album(self):
+        """Test imported photos are added to the named album."""
+        self.run_import('--album', 'Imported')
+        album = self.user.albums.get(title='Imported')
+        self.assertEqual(album.photos.count(), 2)
+
+    def test_import_queues_thumbnails(self):
+        """Test imported photos get thumbnails and renditions jobs."""
+        self.run_import()
+        self.assertEqual(Job.objects.filter(kind='thumbnails').count(), 2)
+        self.assertEqual(Job.objects.filter(kind='renditions').count(), 2)
+
+    def test_import_is_restartable(self):
+        """Test importing again skips images already imported."""
+        self.run_import()
+        output = self.run_import()
+        self.assertIn('Imported 0 photos', output)
+        self.assertEqual(self.user.photos.count(), 2)
+
+    def test_import_reports_throughput(self):
+        """Test the import reports images per second."""
+        self.assertIn('images/sec', self.run_import())
+
+
 class UserTestCase(TestCase):
     """Testcase with a user."""
 
     def setUp(self, test_url=None):
         """Setup User testcase."""
+        cache.clear()
         self.user = User(username='acutebird')
         self.user.save()
         self.client.force_login(self.user)
@@ -145,6 +690,7 @@ class LibraryTestCase(UserTestCase):
     """Testcase for Library."""
     def setUp(self):
         super(LibraryTestCase, self).setUp()
+        run_pending(kind='thumbnails')
         self.response = self.client.get(reverse('library'))
 
     def test_library_status_code(self):
@@ -184,6 +730,486 @@ class LibraryTestCase(UserTestCase):
                 self.assertContains(self.response, tag)
 
 
+class LibraryQueryCountTestCase(UserTestCase):
+    """Testcase for the number of queries the library page runs."""
+
+    def count_queries(self):
+        """Count the queries of a library request with warm thumbnails."""
+        self.client.get(reverse('library'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('library'))
+        return len(queries)
+
+    def test_library_query_count_is_small(self):
+        """Test library page runs a small, fixed number of queries."""
+        self.assertLessEqual(self.count_queries(), 10)
+
+    def test_library_query_count_constant(self):
+        """Test library query count does not grow with the library."""
+        before = self.count_queries()
+        for i in range(20):
+            photo = PhotoFactory(user=self.user, title='more{}'.format(i))
+            photo.tags.add('more{}'.format(i), 'shared')
+        for photo in self.user.photos.all()[:4]:
+            album = Album(user=self.user, title='album', cover=photo)
+            album.save()
+            album.photos.add(photo)
+        self.assertEqual(before, self.count_queries())
+
+
+class ExplainQueriesTestCase(UserTestCase):
+    """Test the hot query shapes use indexes."""
+
+    def test_no_full_scans(self):
+        """Test no shape scans a large table in full."""
+        out = StringIO()
+        call_command('explain_queries', '--check', stdout=out)
+        output = out.getvalue()
+        self.assertIn('library photos, next page', output)
+        self.assertIn('album photos, first page', output)
+        self.assertIn('photo search, first page', output)
+        self.assertNotIn('FULL SCAN', output)
+
+    def test_full_scans_detected(self):
+        """Test full scans are recognised in each database's plans."""
+        self.assertEqual(
+            full_scans('sqlite', ['SCAN TABLE image_photo']), ['image_photo']
+        )
+        self.assertEqual(full_scans('sqlite', ['SCAN image_album']),
+                         ['image_album'])
+        self.assertEqual(full_scans('sqlite', [
+            'SCAN TABLE image_photo USING INDEX image_photo_public_id',
+        ]), [])
+        self.assertEqual(full_scans('postgresql', [
+            'Limit  (cost=0.00..1.04 rows=4 width=80)',
+            '  ->  Seq Scan on image_photo  (cost=0.00..13.00 rows=50)',
+        ]), ['image_photo'])
+
+    def test_default_ordering(self):
+        """Test photos come oldest first by default."""
+        photos = list(Photo.objects.all())
+        self.assertEqual(photos, sorted(
+            photos, key=lambda photo: (photo.date_uploaded, photo.pk)
+        ))
+
+
+class PhotoMetadataTestCase(UserTestCase):
+    """Test metadata is read from images and photos filtered by it."""
+
+    def set_metadata(self, photo, **values):
+        """Give a photo a metadata row."""
+        values.setdefault('width', 100)
+        values.setdefault('height', 100)
+        PhotoMetadata.objects.update_or_create(
+            photo=photo, defaults=dict(values, user=photo.user)
+        )
+
+    @skipUnless(hasattr(Image, 'Exif'), 'Writing EXIF needs Pillow 6')
+    def test_read_metadata(self):
+        """Test the camera, date, ISO and turned size are read."""
+        exif = Image.Exif()
+        exif[0x010f] = 'Canon'
+        exif[0x0110] = 'Canon EOS 5D'
+        exif[0x0112] = 6
+        exif[0x0132] = '2016:09:01 12:30:00'
+        exif[0x8827] = 400
+        f = BytesIO()
+        Image.new('RGB', (40, 20)).save(f, 'JPEG', exif=exif.tobytes())
+        f.seek(0)
+        metadata = read_metadata(f)
+        self.assertEqual((metadata['width'], metadata['height']), (20, 40))
+        self.assertEqual(metadata['camera'], 'Canon EOS 5D')
+        self.assertEqual(metadata['iso'], 400)
+        self.assertEqual(metadata['taken_at'].isoformat(),
+                         '2016-09-01T12:30:00+00:00')
+        self.assertIsNone(metadata['latitude'])
+
+    def test_coordinates(self):
+        """Test GPS coordinates are signed degrees."""
+        gps = {1: 'S', 2: ((33, 1), (30, 1), (0, 1))}
+        self.assertEqual(coordinate(gps, 2, 1), -33.5)
+        self.assertIsNone(coordinate(gps, 4, 3))
+
+    def test_job_reads_metadata(self):
+        """Test the metadata job of an uploaded photo fills in its row."""
+        photo = self.user.photos.first()
+        run_pending(kind='metadata')
+        photo.refresh_from_db()
+        self.assertEqual(photo.metadata.user, self.user)
+        self.assertGreater(photo.metadata.width, 0)
+
+    def test_extraction_expires_fragments(self):
+        """Test reading metadata expires the cached photo lists."""
+        photos = get_generations(self.user.pk)['photos']
+        extract_metadata(self.user.photos.first())
+        run_on_commit()
+        self.assertNotEqual(get_generations(self.user.pk)['photos'], photos)
+
+    def test_library_filter(self):
+        """Test the library only lists photos matching the filters."""
+        first, second = list(self.user.photos.all())[:2]
+        self.set_metadata(first, camera='Nikon D750')
+        self.set_metadata(second, camera='Canon EOS 5D')
+        response = self.client.get(reverse('library'), dict(camera='Nikon D750'))
+        self.assertEqual(list(response.context['photos']), [first])
+        self.assertEqual(response.context['filter_query'], 'camera=Nikon+D750')
+
+    def test_library_date_filter(self):
+        """Test taken_before includes the whole day it names."""
+        first, second = list(self.user.photos.all())[:2]
+        self.set_metadata(first, taken_at=datetime(2016, 9, 1, 23, tzinfo=utc))
+        self.set_metadata(second, taken_at=datetime(2016, 9, 2, tzinfo=utc))
+        response = self.client.get(reverse('library'), dict(
+            taken_after='2016-09-01', taken_before='2016-09-01'
+        ))
+        self.assertEqual(list(response.context['photos']), [first])
+
+    def test_library_invalid_filter(self):
+        """Test invalid filters are reported and not applied."""
+        response = self.client.get(reverse('library'), dict(min_width='x'))
+        self.assertEqual(len(response.context['photos']), 4)
+        self.assertIn('min_width', response.context['filters'].errors)
+
+
+def textured_image(seed, size=(900, 800)):
+    """Return an image of random grey blocks, the same for the same seed."""
+    rand = random.Random(seed)
+    blocks = Image.new('L', (9, 8))
+    blocks.putdata([rand.randrange(256) for _ in range(72)])
+    return blocks.resize(size, Image.BILINEAR)
+
+
+class DuplicatesTestCase(UserTestCase):
+    """Test near-duplicate photos are found by their perceptual hashes."""
+
+    def set_hash(self, photo, value):
+        """Give a photo a perceptual hash."""
+        Photo.objects.filter(id=photo.id).update(**hash_fields(value))
+
+    def test_hash_survives_exporting(self):
+        """Test a resized JPEG export hashes close to its original, and
+        another image doesn't."""
+        original = textured_image(1)
+        f = BytesIO()
+        original.resize((450, 400), Image.BILINEAR).save(f, 'JPEG', quality=60)
+        f.seek(0)
+        exported = Image.open(f)
+        other = textured_image(2)
+        self.assertLessEqual(
+            distances(dhash(original), [dhash(exported)])[0], MAX_DISTANCE
+        )
+        self.assertGreater(
+            distances(dhash(original), [dhash(other)])[0], MAX_DISTANCE
+        )
+
+    def test_hash_fields(self):
+        """Test the bands are the unsigned 16 bit slices of the hash."""
+        fields = hash_fields(-2)
+        self.assertEqual(fields['dhash'], -2)
+        self.assertEqual(fields['dhash_band0'], 0xfffe)
+        self.assertEqual(fields['dhash_band3'], 0xffff)
+
+    def test_job_hashes_photo(self):
+        """Test the dhash job of an uploaded photo fills in its hash
+        without marking the photo modified, and expires cached groups."""
+        f = BytesIO()
+        textured_image(3).save(f, 'PNG')
+        f.seek(0)
+        photo = PhotoFactory(user=self.user, photo__from_file=f)
+        modified = Photo.objects.get(id=photo.id).date_modified
+        photos = get_generations(self.user.pk)['photos']
+        run_pending(kind='dhash')
+        run_on_commit()
+        photo.refresh_from_db()
+        self.assertEqual(photo.dhash, dhash(textured_image(3)))
+        self.assertEqual(photo.date_modified, modified)
+        self.assertNotEqual(get_generations(self.user.pk)['photos'], photos)
+
+    def test_groups(self):
+        """Test photos within MAX_DISTANCE bits are grouped, transitively,
+        and photos further apart aren't."""
+        photos = list(self.user.photos.all())
+        value = 0x0123456789abcdef
+        self.set_hash(photos[0], value)
+        self.set_hash(photos[1], value ^ 0b111)
+        self.set_hash(photos[2], value ^ 0b111 ^ 1 << 20)
+        self.set_hash(photos[3], value ^ (1 | 1 << 16 | 1 << 32 | 1 << 48))
+        self.set_hash(photos[4], ~value)
+        self.assertEqual(duplicate_groups(self.user), [
+            [photos[0].id, photos[1].id, photos[2].id]
+        ])
+
+    def test_near_duplicates(self):
+        """Test a photo's near-duplicates come closest first with their
+        distance, and photos of other users are left out."""
+        photos = list(self.user.photos.all())
+        self.set_hash(photos[0], 42)
+        self.set_hash(photos[1], 42 ^ 0b11)
+        self.set_hash(photos[2], 42 ^ 1)
+        other = PhotoFactory(user=User.objects.create(username='other'))
+        self.set_hash(other, 42)
+        duplicates = near_duplicates(Photo.objects.get(id=photos[0].id))
+        self.assertEqual([photo.id for photo in duplicates],
+                         [photos[2].id, photos[1].id])
+        self.assertEqual([photo.distance for photo in duplicates], [1, 2])
+
+    def test_duplicates_view(self):
+        """Test the near-duplicates page shows each group's photos."""
+        photos = list(self.user.photos.all())
+        self.set_hash(photos[0], 7)
+        self.set_hash(photos[1], 7)
+        response = self.client.get(reverse('duplicates'))
+        self.assertEqual(response.context['photo_groups'],
+                         [[photos[0], photos[1]]])
+        self.assertContains(response, photos[1].title)
+
+
+class SearchTestCase(UserTestCase):
+    """Test photos and albums are found by their text."""
+
+    def setUp(self):
+        super(SearchTestCase, self).setUp()
+        self.photo = PhotoFactory(
+            user=self.user, title='Sunset over the beach',
+            description='Waves on the shore.', photo__color='orange',
+        )
+        self.photo.tags.add('holiday')
+
+    def search(self, query, queryset=None):
+        """Return the user's photos matching query, best first."""
+        if queryset is None:
+            queryset = Photo.objects.all()
+        return list(SearchResults(self.user, query, queryset)[:10])
+
+    def test_title_description_and_tags(self):
+        """Test every word must match the title, description or tags."""
+        self.assertEqual(self.search('beach'), [self.photo])
+        self.assertEqual(self.search('waves sunset'), [self.photo])
+        self.assertEqual(self.search('HOLIDAY'), [self.photo])
+        self.assertEqual(self.search('waves mountain'), [])
+        self.assertEqual(self.search('  '), [])
+
+    def test_prefix(self):
+        """Test the last word matches as a prefix."""
+        self.assertEqual(self.search('sunset bea'), [self.photo])
+
+    def test_ranking(self):
+        """Test title matches rank above description matches."""
+        described = PhotoFactory(
+            user=self.user, title='Boats', description='In the harbour.',
+            photo__color='green',
+        )
+        titled = PhotoFactory(
+            user=self.user, title='Harbour', photo__color='navy'
+        )
+        self.assertEqual(self.search('harbour'), [titled, described])
+
+    def test_other_users(self):
+        """Test other users' photos are not found."""
+        other = User.objects.create(username='other')
+        PhotoFactory(user=other, title='Beach', photo__color='yellow')
+        self.assertEqual(self.search('beach'), [self.photo])
+
+    def test_changes_followed(self):
+        """Test edits, tag changes and deletes update the index."""
+        self.photo.title = 'Mountains'
+        self.photo.save()
+        self.assertEqual(self.search('beach'), [])
+        self.assertEqual(self.search('mountains'), [self.photo])
+        self.photo.tags.remove('holiday')
+        self.assertEqual(self.search('holiday'), [])
+        self.photo.tags.add('Alps')
+        self.assertEqual(self.search('alps'), [self.photo])
+        self.photo.delete()
+        self.assertEqual(self.search('mountains'), [])
+
+    def test_albums(self):
+        """Test albums are found by their title and description."""
+        album = self.user.albums.get()
+        self.assertEqual(self.search('blue', Album.objects.all()), [album])
+        album.description = 'Skies and seas.'
+        album.save()
+        self.assertEqual(self.search('seas', Album.objects.all()), [album])
+
+    def test_search_view(self):
+        """Test the search page pages through the matching photos."""
+        response = self.client.get(reverse('search'), dict(q='beach'))
+        self.assertEqual(list(response.context['photos']), [self.photo])
+        self.assertContains(response, 'Sunset over the beach')
+        response = self.client.get(reverse('search'), dict(q='blue'))
+        self.assertContains(response, 'Blue Pictures')
+
+    def test_rebuild_command(self):
+        """Test the index can be rebuilt from scratch."""
+        SearchDocument.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('beach'), [self.photo])
+        self.assertEqual(SearchDocument.objects.count(), 12)
+
+
+class BenchmarkViewsTestCase(TestCase):
+    """Test the view benchmarks."""
+
+    def test_seed_and_measure(self):
+        """Test a seeded library is measured for every view."""
+        seeded = seed(10)
+        self.assertEqual(seeded['user'].photos.count(), 10)
+        self.assertEqual(seeded['album'].photos.count(), 10)
+        self.assertEqual(
+            photos_with_tags(seeded['user'], [seeded['tag']]).count(), 10
+        )
+        self.client.force_login(seeded['user'])
+        for view, url in view_urls(seeded):
+            result = measure(self.client, url, 1)
+            self.assertGreater(result['queries'], 0, view)
+
+    def test_regressions(self):
+        """Test results worse than the baselines are reported."""
+        baselines = {'10': {'library_view': dict(queries=5, milliseconds=10)}}
+        same = {'10': {'library_view': dict(queries=5, milliseconds=19)}}
+        self.assertEqual(regressions(same, baselines, 1.0, 0.25), [])
+        worse = {'10': {'library_view': dict(queries=6, milliseconds=21)}}
+        self.assertEqual(len(regressions(worse, baselines, 1.0, 0.25)), 2)
+
+    def test_queries_growing_with_size(self):
+        """Test a view making more queries for more photos is reported."""
+        results = {
+            '10': {'library_view': dict(queries=5, milliseconds=10)},
+            '1000': {'library_view': dict(queries=7, milliseconds=10)},
+        }
+        self.assertEqual(len(regressions(results, {}, 1.0, 0.25)), 1)
+
+
+class FragmentCacheTestCase(UserTestCase):
+    """Test the library's cached fragments follow changes exactly."""
+
+    def library(self):
+        """Return the content of the library page."""
+        return self.client.get(reverse('library')).content.decode('utf-8')
+
+    def test_cached_fragments_skip_queries(self):
+        """Test a repeated library request doesn't load the page again."""
+        with CaptureQueriesContext(connection) as cold:
+            self.library()
+        with CaptureQueriesContext(connection) as warm:
+            self.library()
+        self.assertLess(len(warm), len(cold))
+
+    def test_photo_change_shows(self):
+        """Test changing a photo renders the photos again."""
+        self.library()
+        photo = self.user.photos.order_by('date_uploaded', 'id').first()
+        photo.title = 'renamed photo'
+        photo.save()
+        run_on_commit()
+        self.assertIn('renamed photo', self.library())
+
+    def test_album_change_shows(self):
+        """Test changing an album renders the albums again."""
+        self.library()
+        album = self.user.albums.first()
+        album.title = 'renamed album'
+        album.save()
+        run_on_commit()
+        self.assertIn('renamed album', self.library())
+
+    def test_tag_change_shows(self):
+        """Test tagging a photo renders the tags again."""
+        self.library()
+        self.user.photos.first().tags.add('brand new tag')
+        run_on_commit()
+        self.assertIn('brand new tag', self.library())
+
+    def test_users_do_not_share_fragments(self):
+        """Test another user's library isn't served from the cache."""
+        self.library()
+        other = User.objects.create(username='other')
+        self.client.force_login(other)
+        self.assertIn('No photos!', self.library())
+
+    def test_bump_advances(self):
+        """Test bumping a generation changes only that generation, once
+        the transaction commits."""
+        run_on_commit()
+        before = get_generations(self.user.pk)
+        bump(self.user.pk, 'tags')
+        self.assertEqual(get_generations(self.user.pk), before)
+        run_on_commit()
+        after = get_generations(self.user.pk)
+        self.assertNotEqual(before['tags'], after['tags'])
+        self.assertEqual(before['photos'], after['photos'])
+
+
+class ConditionalGetTestCase(UserTestCase):
+    """Test case for answering conditional GETs with 304 Not Modified."""
+
+    def setUp(self):
+        """Set up a photo and an album to revalidate."""
+        super(ConditionalGetTestCase, self).setUp()
+        self.photo = self.user.photos.first()
+        self.album = self.user.albums.first()
+        self.urls = [
+            reverse('library'),
+            reverse('images', args=[self.photo.pk]),
+            reverse('album', args=[self.album.pk]),
+        ]
+
+    def revalidate(self, url):
+        """GET url twice, revalidating with the first response's ETag."""
+        etag = self.client.get(url)['ETag']
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def assert_changes(self, change):
+        """Assert change makes every page's ETag stale."""
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        change()
+        for url, etag in zip(self.urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_unchanged_pages_not_modified(self):
+        """Test revalidating unchanged pages returns 304."""
+        for url in self.urls:
+            self.assertEqual(self.revalidate(url).status_code, 304)
+
+    def test_pages_revalidate(self):
+        """Test pages ask to be revalidated on every use."""
+        response = self.client.get(self.urls[0])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_other_page_not_modified(self):
+        """Test ETags differ between pages of the library."""
+        etag = self.client.get(self.urls[0])['ETag']
+        response = self.client.get(
+            self.urls[0] + '?page=2', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_photo_edit_modifies(self):
+        """Test editing a photo makes the pages stale."""
+        def change():
+            self.photo.title = 'changed'
+            self.photo.save()
+        self.assert_changes(change)
+
+    def test_tag_change_modifies(self):
+        """Test tagging a photo makes the pages stale."""
+        self.assert_changes(lambda: self.photo.tags.add('new tag'))
+
+    def test_tag_removal_modifies(self):
+        """Test removing a tag makes the pages stale."""
+        self.assert_changes(lambda: self.photo.tags.clear())
+
+    def test_album_membership_modifies_album(self):
+        """Test adding a photo to an album makes the album stale."""
+        url = reverse('album', args=[self.album.pk])
+        etag = self.client.get(url)['ETag']
+        self.album.photos.add(self.user.photos.last())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
 class PhotoViewTestCase(UserTestCase):
     """Test case for viewing a single image."""
 
@@ -262,6 +1288,169 @@ class AlbumViewTestCase(UserTestCase):
                 self.assertContains(self.response, tag.name)
 
 
+class AlbumPagingTestCase(UserTestCase):
+    """Test paging through a large album."""
+
+    def setUp(self):
+        super(AlbumPagingTestCase, self).setUp()
+        self.album = self.user.albums.last()
+        self.album.photos.add(*self.user.photos.all())
+        self.url = reverse('album', args=[self.album.pk])
+
+    def test_pages_cover_album_in_order(self):
+        """Test following next links shows each photo once, in order."""
+        response = self.client.get(self.url)
+        pages = [response]
+        while response.context['photos'].has_next:
+            page = response.context['photos']
+            response = self.client.get(self.url, {
+                'after': page.next_cursor(),
+                'page': page.next_page_number(),
+            })
+            pages.append(response)
+        ids = [p.pk for page in pages for p in page.context['photos']]
+        expected = self.album.photos.order_by('date_uploaded', 'id')
+        self.assertEqual(ids, list(expected.values_list('id', flat=True)))
+        self.assertContains(pages[-1], 'Page 3 of 3')
+
+    def test_previous_page(self):
+        """Test the previous link leads back to the page before."""
+        first = self.client.get(self.url).context['photos']
+        second = self.client.get(self.url, {
+            'after': first.next_cursor(), 'page': 2
+        }).context['photos']
+        back = self.client.get(self.url, {
+            'before': second.previous_cursor(), 'page': 1
+        }).context['photos']
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous)
+
+    def test_invalid_cursor_shows_first_page(self):
+        """Test a garbled cursor falls back to the first page."""
+        response = self.client.get(self.url, {'after': 'garbage'})
+        self.assertContains(response, 'Page 1 of 3')
+
+    def test_tags_counted_once(self):
+        """Test the tag union lists each tag once with its count."""
+        for photo in self.user.photos.all()[:5]:
+            photo.tags.add('common')
+        response = self.client.get(self.url)
+        self.assertContains(response, '"common"</a> (5)', count=1)
+
+    def test_query_count_is_constant(self):
+        """Test the album page takes the same queries however large."""
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('album', args=[self.album.pk]))
+        for i in range(20):
+            photo = PhotoFactory(user=self.user)
+            photo.tags.add('extra{}'.format(i))
+            self.album.photos.add(photo)
+        run_on_commit()
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(reverse('album', args=[self.album.pk]))
+        self.assertEqual(len(small), len(large))
+
+
+class MediaViewTestCase(TestCase):
+    """Test case for serving uploaded media."""
+
+    def setUp(self):
+        """Set up a user with a public and a private photo."""
+        self.user = User(username='acutebird')
+        self.user.save()
+        self.public = PhotoFactory(user=self.user, published='Public')
+        self.private = PhotoFactory(
+            user=self.user, published='Private', photo__color='red'
+        )
+        with open(self.public.photo.path, 'rb') as f:
+            self.content = f.read()
+
+    def get(self, photo, **headers):
+        """GET the media url of photo's image."""
+        return self.client.get(photo.photo.url, **headers)
+
+    def test_public_photo_served(self):
+        """Test anyone can get a public photo's image."""
+        response = self.get(self.public)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_private_photo_hidden(self):
+        """Test other users can't get a private photo's image."""
+        self.assertEqual(self.get(self.private).status_code, 404)
+        other = User(username='whoever')
+        other.save()
+        self.client.force_login(other)
+        self.assertEqual(self.get(self.private).status_code, 404)
+
+    def test_private_photo_served_to_owner(self):
+        """Test the owner can get a private photo's image."""
+        self.client.force_login(self.user)
+        self.assertEqual(self.get(self.private).status_code, 200)
+
+    def test_unknown_file(self):
+        """Test files which don't belong to a photo are not served."""
+        response = self.client.get('/media/../manage.py')
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_modified(self):
+        """Test revalidating with the file's ETag returns 304."""
+        etag = self.get(self.public)['ETag']
+        response = self.get(self.public, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        """Test a byte range is served as partial content."""
+        response = self.get(self.public, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(
+            b''.join(response.streaming_content), self.content[10:20]
+        )
+        self.assertEqual(
+            response['Content-Range'],
+            'bytes 10-19/{}'.format(len(self.content))
+        )
+
+    def test_suffix_range(self):
+        """Test a suffix range is served from the end of the file."""
+        response = self.get(self.public, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(
+            b''.join(response.streaming_content), self.content[-5:]
+        )
+
+    def test_unsatisfiable_range(self):
+        """Test a range past the end of the file is rejected."""
+        response = self.get(
+            self.public, HTTP_RANGE='bytes={}-'.format(len(self.content))
+        )
+        self.assertEqual(response.status_code, 416)
+
+    def test_stale_if_range(self):
+        """Test a range with a stale If-Range gets the whole file."""
+        response = self.get(
+            self.public, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_PREFIX='/protected/')
+    def test_accel_redirect(self):
+        """Test files are handed to nginx when configured."""
+        response = self.get(self.public)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            '/protected/' + self.public.photo.name
+        )
+        self.assertEqual(response.content, b'')
+
+    @override_settings(MEDIA_SENDFILE_HEADER='X-Sendfile')
+    def test_sendfile(self):
+        """Test files are handed to the server with X-Sendfile."""
+        response = self.get(self.public)
+        self.assertEqual(response['X-Sendfile'], self.public.photo.path)
+
+
 class CreateAlbumTestCase(UserTestCase):
     """Test case for creating albums."""
 
@@ -288,6 +1477,9 @@ class CreateAlbumTestCase(UserTestCase):
         response = self.client.post(reverse('add_album'), data)
         self.assertEqual(response.status_code, 302)
         self.assertEqual(self.user.albums.last().title, data['title'])
+        self.assertEqual(response['Location'], reverse(
+            'edit_album', args=[self.user.albums.last().pk]
+        ))
 
     def test_album_create_page_301(self):
         """Test create photo page returns 301 for unauthenticated user."""
@@ -339,6 +1531,153 @@ class CreatePhotoTestCase(UserTestCase):
         self.assertEqual(response.status_code, 302)
 
 
+class ChunkedUploadTestCase(UserTestCase):
+    """Test case for resumable, chunked photo uploads."""
+
+    def setUp(self):
+        """Start an upload of a generated image."""
+        super(ChunkedUploadTestCase, self).setUp()
+        source = PhotoFactory(user=self.user)
+        with open(source.photo.path, 'rb') as f:
+            self.content = f.read()
+        source.delete()
+        self.upload = self.start(len(self.content))
+
+    def start(self, size, **data):
+        """Start an upload of size bytes and return its state."""
+        data.update(
+            filename='big.jpg',
+            size=size,
+            title='Big',
+            published='Public',
+            tags='raw, huge',
+        )
+        response = self.client.post(reverse('start_photo_upload'), data)
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.content.decode('utf-8'))
+
+    def put(self, start, end, content=None):
+        """Send the bytes start to end of the image as a chunk."""
+        content = self.content if content is None else content
+        return self.client.put(
+            self.upload['url'],
+            content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes {}-{}/{}'.format(
+                start, end, len(content)
+            ),
+        )
+
+    def test_chunks_create_photo(self):
+        """Test uploading every chunk creates the photo."""
+        size = len(self.content)
+        middle = size - 10
+        response = self.put(0, middle - 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PhotoUpload.objects.get().image_format, 'JPEG')
+        response = self.put(middle, size - 1)
+        self.assertEqual(response.status_code, 201)
+        photo = self.user.photos.get(title='Big')
+        with open(photo.photo.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(
+            sorted(photo.tags.names()), ['huge', 'raw']
+        )
+        self.assertFalse(PhotoUpload.objects.exists())
+
+    def test_resume(self):
+        """Test the upload reports the offset to resume from."""
+        self.put(0, 99)
+        response = self.client.get(self.upload['url'])
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['offset'], 100)
+
+    def test_out_of_order_chunk(self):
+        """Test a chunk not starting at the offset is a conflict."""
+        self.put(0, 99)
+        response = self.put(200, 299)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(PhotoUpload.objects.get().offset, 100)
+
+    def test_chunk_overtaken_while_received(self):
+        """Test a chunk is checked against the offset again once the
+        upload is locked, in case another was appended meanwhile."""
+        upload = PhotoUpload.objects.get()
+        start, chunk = uploads.receive_chunk(
+            upload, BytesIO(self.content[:100]),
+            'bytes 0-99/{}'.format(len(self.content)),
+        )
+        self.put(0, 99)
+        upload.refresh_from_db()
+        with chunk, self.assertRaises(uploads.UploadError) as raised:
+            uploads.append_chunk(upload, start, chunk)
+        self.assertEqual(raised.exception.status, 409)
+        self.assertEqual(os.path.getsize(uploads.part_path(upload)), 100)
+
+    def test_missing_content_range(self):
+        """Test a chunk without a Content-Range is rejected."""
+        response = self.client.put(
+            self.upload['url'], b'data', content_type='application/octet-stream'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_an_image(self):
+        """Test an upload which is not an image is discarded."""
+        content = b'not an image' * 100
+        self.upload = self.start(len(content))
+        response = self.put(0, len(content) - 1, content)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            PhotoUpload.objects.filter(pk=self.upload['id']).exists()
+        )
+
+    def test_other_users_upload(self):
+        """Test users can't write to another user's upload."""
+        other_user = User(username='whoever')
+        other_user.save()
+        self.client.force_login(other_user)
+        self.assertEqual(self.put(0, 99).status_code, 404)
+
+    def test_too_large(self):
+        """Test uploads over the size limit are refused."""
+        response = self.client.post(reverse('start_photo_upload'), dict(
+            filename='huge.jpg',
+            size=uploads.max_upload_size() + 1,
+            title='Huge',
+            published='Public',
+        ))
+        self.assertEqual(response.status_code, 400)
+
+    def test_cancel(self):
+        """Test deleting an upload removes its partial file."""
+        self.put(0, 99)
+        upload = PhotoUpload.objects.get()
+        response = self.client.delete(self.upload['url'])
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(os.path.exists(uploads.part_path(upload)))
+
+    def test_expire_abandoned(self):
+        """Test uploads without a chunk for the expiry time are deleted
+        with their partial files, along with stray old partial files."""
+        self.put(0, 99)
+        upload = PhotoUpload.objects.get()
+        fresh = self.start(len(self.content))
+        stray = os.path.join(uploads.upload_dir(), 'stray.part')
+        open(stray, 'wb').close()
+        os.utime(stray, (0, 0))
+        self.assertEqual(uploads.expire_uploads(3600), 0)
+        PhotoUpload.objects.filter(pk=upload.pk).update(
+            date_modified=upload.date_modified - timedelta(hours=2)
+        )
+        self.assertEqual(uploads.expire_uploads(3600), 1)
+        self.assertEqual(
+            list(PhotoUpload.objects.values_list('pk', flat=True)),
+            [uuid.UUID(fresh['id'])]
+        )
+        self.assertFalse(os.path.exists(uploads.part_path(upload)))
+        self.assertFalse(os.path.exists(stray))
+
+
 class EditPhotoTestCase(UserTestCase):
     """Edit photo test case."""
 
@@ -430,6 +1769,86 @@ class EditAlbumTestCase(UserTestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class AlbumMembershipTestCase(UserTestCase):
+    """Test albums' photos are changed in bulk by id."""
+
+    def setUp(self):
+        """Find the album holding the first three photos."""
+        super(AlbumMembershipTestCase, self).setUp()
+        self.album = self.user.albums.get()
+        self.photos = list(self.user.photos.all())
+
+    def test_add_and_remove(self):
+        """Test photos are added and removed, skipping ones already in or
+        out of the album."""
+        first, second, third, fourth, fifth = self.photos[:5]
+        counts = change_album(
+            self.album, add=[first.id, fourth.id, fifth.id, fourth.id],
+            remove=[second.id, fifth.id + 100],
+        )
+        self.assertEqual(counts, (2, 1))
+        self.assertEqual(set(self.album.photos.all()),
+                         set([first, third, fourth, fifth]))
+
+    def test_queries(self):
+        """Test the queries don't grow with the number of photos changed."""
+        ids = [photo.id for photo in self.photos]
+        with CaptureQueriesContext(connection) as few:
+            change_album(self.album, add=ids[3:5], remove=ids[:1])
+        with CaptureQueriesContext(connection) as many:
+            change_album(self.album, add=ids[5:], remove=ids[1:3])
+        self.assertEqual(len(few), len(many))
+
+    def test_cover(self):
+        """Test the cover is set, and cleared when it is removed."""
+        first = self.photos[0]
+        change_album(self.album, cover=first.id)
+        self.assertEqual(Album.objects.get(id=self.album.id).cover, first)
+        change_album(self.album, remove=[first.id])
+        self.assertIsNone(Album.objects.get(id=self.album.id).cover)
+
+    def test_invalid_changes(self):
+        """Test other users' photos, covers outside the album and photos
+        both added and removed change nothing."""
+        other = PhotoFactory(user=User.objects.create(username='other'))
+        first, fourth = self.photos[0], self.photos[3]
+        for changes in (dict(add=[fourth.id, other.id]),
+                        dict(add=[fourth.id], cover=self.photos[5].id),
+                        dict(add=[fourth.id], remove=[fourth.id]),
+                        dict(remove=[first.id], cover=first.id)):
+            with self.assertRaises(MembershipError):
+                change_album(self.album, **changes)
+        self.assertEqual(list(self.album.photos.all()), self.photos[:3])
+        self.assertIsNone(Album.objects.get(id=self.album.id).cover)
+
+    def test_expires_fragments(self):
+        """Test changing an album's photos expires the album fragments."""
+        albums = get_generations(self.user.pk)['albums']
+        change_album(self.album, add=[self.photos[4].id])
+        run_on_commit()
+        self.assertNotEqual(get_generations(self.user.pk)['albums'], albums)
+
+    def test_edit_page_lists_no_photos(self):
+        """Test the edit page leaves the photos to the album photos API."""
+        response = self.client.get(
+            reverse('edit_album', args=[self.album.id])
+        )
+        self.assertNotIn('photos', response.context['form'].fields)
+        self.assertNotIn('cover', response.context['form'].fields)
+        self.assertContains(
+            response, reverse('album_photos_api', args=[self.album.id])
+        )
+
+    def test_edit_keeps_photos(self):
+        """Test editing an album without posting photos keeps them."""
+        response = self.client.post(
+            reverse('edit_album', args=[self.album.id]),
+            dict(title='Renamed', published='Public'),
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.album.photos.all()), self.photos[:3])
+
+
 class DeleteAlbumTestCase(UserTestCase):
     """Delete album test case."""
 
@@ -490,6 +1909,114 @@ class DeletePhotoTestCase(UserTestCase):
         self.assertIn(photo, Photo.objects.all())
 
 
+class BulkPhotosTestCase(UserTestCase):
+    """Test many photos are published, tagged and deleted at once."""
+
+    def setUp(self):
+        """Collect the ids of the user's photos."""
+        super(BulkPhotosTestCase, self).setUp()
+        self.ids = list(self.user.photos.values_list('id', flat=True))
+
+    def test_publish(self):
+        """Test photos are published and the public count follows."""
+        changed = publish_photos(self.user, self.ids[:4], 'Private')
+        self.assertEqual(changed, 4)
+        self.assertEqual(
+            self.user.photos.filter(published='Private').count(), 4
+        )
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.public_photo_count, 6)
+        self.assertEqual(publish_photos(self.user, self.ids[:4], 'Private'), 0)
+
+    def test_ignores_other_users_photos(self):
+        """Test other users' photos are left alone."""
+        other = PhotoFactory(user=User.objects.create(username='other'))
+        self.assertEqual(publish_photos(self.user, [other.id], 'Private'), 0)
+        self.assertEqual(delete_photos(self.user, [other.id]), 0)
+        self.assertEqual(Photo.objects.get(id=other.id).published, 'Public')
+
+    def test_tag(self):
+        """Test tags are added and removed through the tag index, the
+        search index and the tag count."""
+        tagged = tag_photos(self.user, self.ids[:3], add=['Beach', 'sea'],
+                            remove=['DSLKJFAFKJASDF0'])
+        self.assertEqual(tagged, 3)
+        self.assertEqual(
+            set(photos_with_tags(self.user, ['beach', 'sea'])),
+            set(Photo.objects.filter(id__in=self.ids[:3]))
+        )
+        self.assertEqual(Photo.objects.get(id=self.ids[1]).tags.count(), 3)
+        self.assertFalse(photos_with_tags(self.user, ['dslkjfafkjasdf0']))
+        results = SearchResults(self.user, 'beach', Photo.objects.all())
+        self.assertEqual(results.count(), 3)
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.tag_count, 11)
+        tag_photos(self.user, self.ids[:3], add=['beach'])
+        self.assertEqual(Photo.objects.get(id=self.ids[1]).tags.count(), 3)
+
+    def test_tag_queries(self):
+        """Test the queries don't grow with the number of photos tagged."""
+        tag_photos(self.user, [], add=['one'])
+        with CaptureQueriesContext(connection) as few:
+            tag_photos(self.user, self.ids[:2], add=['one'], remove=['two'])
+        with CaptureQueriesContext(connection) as many:
+            tag_photos(self.user, self.ids[2:], add=['one'], remove=['two'])
+        self.assertEqual(len(few), len(many))
+
+    def test_delete(self):
+        """Test photos and the rows referring to them are deleted, and
+        their images are left to a collect job."""
+        photo = Photo(user=self.user, title='bulk')
+        photo.photo.save('bulk.png', ContentFile(b'bulk deleted image'))
+        album = self.user.albums.get()
+        album.cover = album.photos.first()
+        album.save()
+        ids = [album.cover_id, photo.id]
+        self.assertEqual(delete_photos(self.user, ids), 2)
+        self.assertFalse(Photo.objects.filter(id__in=ids).exists())
+        self.assertFalse(PhotoTag.objects.filter(photo_id__in=ids).exists())
+        self.assertFalse(
+            SearchDocument.objects.filter(photo_id__in=ids).exists()
+        )
+        album.refresh_from_db()
+        self.assertIsNone(album.cover)
+        self.assertEqual(album.photos.count(), 2)
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.photo_count, 9)
+        self.assertTrue(photo_storage.exists(photo.photo.name))
+        job = Job.objects.get(kind='collect')
+        self.assertIn(photo.photo.name, json.loads(job.data)['images'])
+
+    def test_delete_while_job_runs(self):
+        """Test a job whose photo is deleted while it runs isn't saved
+        again when it finishes."""
+        self.addCleanup(
+            HANDLERS.__setitem__, 'thumbnails', HANDLERS['thumbnails']
+        )
+        HANDLERS['thumbnails'] = 'image.tests.delete_photo_job'
+        job_id, = claim(kind='thumbnails', limit=1)
+        self.assertTrue(run_job(job_id))
+        self.assertFalse(Job.objects.filter(id=job_id).exists())
+        self.assertEqual(self.user.photos.count(), 9)
+
+    @override_settings(BULK_INLINE_LIMIT=4)
+    def test_large_selection_queued(self):
+        """Test a selection over the inline limit runs as a job which
+        counts its progress."""
+        changed, job = run_operation(
+            self.user, 'publish', self.ids, published='Shared'
+        )
+        self.assertIsNone(changed)
+        self.assertEqual((job.kind, job.total, job.done), ('bulk', 10, 0))
+        self.assertFalse(self.user.photos.filter(published='Shared'))
+        self.assertEqual(run_pending('bulk'), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done), ('done', 10))
+        self.assertEqual(
+            self.user.photos.filter(published='Shared').count(), 10
+        )
+
+
 class TagViewTestCase(UserTestCase):
     """Test viewing photos which contain a tag."""
 
@@ -507,3 +2034,187 @@ class TagViewTestCase(UserTestCase):
         """Test response contains the tagged photo."""
         url = reverse('images', args=[self.photo.pk])
         self.assertContains(self.response, url)
+
+    def photo_urls(self, url):
+        """Return the photo links on every page of url."""
+        urls, page = [], 1
+        while True:
+            response = self.client.get(url, {'page': page, 'match': self.match})
+            urls.extend(
+                reverse('images', args=[photo.pk])
+                for photo in response.context['photos']
+            )
+            if not response.context['photos'].has_next():
+                return urls
+            page += 1
+
+    def test_tags_are_case_insensitive(self):
+        """Test a tag matches whatever its case."""
+        tag = self.photo.tags.first().name.upper()
+        response = self.client.get(reverse('tag', args=[tag]))
+        self.assertContains(response, reverse('images', args=[self.photo.pk]))
+
+    def test_all_tags_must_match(self):
+        """Test photos must have every tag by default."""
+        self.match = 'all'
+        photos = list(self.user.photos.order_by('id'))
+        for photo in photos[:6]:
+            photo.tags.add('red')
+        for photo in photos[3:]:
+            photo.tags.add('round')
+        urls = self.photo_urls(reverse('tag', args=['red, round']))
+        self.assertEqual(
+            urls, [reverse('images', args=[p.pk]) for p in photos[3:6]]
+        )
+
+    def test_any_tag_may_match(self):
+        """Test match=any finds photos with any of the tags, once each."""
+        self.match = 'any'
+        photos = list(self.user.photos.order_by('id'))
+        photos[0].tags.add('red', 'round')
+        photos[1].tags.add('round')
+        urls = self.photo_urls(reverse('tag', args=['red,round']))
+        self.assertEqual(
+            urls, [reverse('images', args=[p.pk]) for p in photos[:2]]
+        )
+
+    def test_tag_pages(self):
+        """Test the tag view shows four photos a page."""
+        self.match = 'all'
+        for photo in self.user.photos.all():
+            photo.tags.add('everything')
+        response = self.client.get(reverse('tag', args=['everything']))
+        self.assertEqual(len(response.context['photos']), 4)
+        self.assertContains(response, 'Page 1 of 3')
+        urls = self.photo_urls(reverse('tag', args=['everything']))
+        self.assertEqual(len(set(urls)), 10)
+
+    def test_other_users_photos_excluded(self):
+        """Test only the user's own photos are found."""
+        other = User.objects.create(username='other')
+        photo = PhotoFactory(user=other)
+        photo.tags.add(self.photo.tags.first().name)
+        response = self.client.get(self.url)
+        self.assertNotContains(response, reverse('images', args=[photo.pk]))
+
+
+class TagCloudTestCase(TestCase):
+    """Test the cached tag cloud follows changes to photos' tags."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='cloudy')
+        self.photos = [PhotoFactory(user=self.user) for _ in range(3)]
+        for photo in self.photos:
+            photo.tags.add('sky')
+        self.photos[0].tags.add('sea')
+
+    def cloud(self):
+        """Return the user's cloud as a dict of names to counts."""
+        return dict(
+            (tag['name'], tag['count']) for tag in get_cloud(self.user)
+        )
+
+    def assert_cached_cloud_correct(self, change):
+        """Assert the cloud matches a recount once change commits."""
+        self.cloud()
+        change()
+        run_on_commit()
+        cloud = self.cloud()
+        self.assertEqual(cloud, count_tags(self.user.pk))
+        return cloud
+
+    def test_cached(self):
+        """Test the cloud is counted once until the tags change."""
+        run_on_commit()
+        self.cloud()
+        with self.assertNumQueries(0):
+            self.cloud()
+
+    def test_counts(self):
+        """Test tags are counted by photo."""
+        self.assertEqual(self.cloud(), dict(sky=3, sea=1))
+
+    def test_add(self):
+        """Test adding tags updates the cached cloud."""
+        cloud = self.assert_cached_cloud_correct(
+            lambda: self.photos[1].tags.add('sea', 'sun')
+        )
+        self.assertEqual(cloud, dict(sky=3, sea=2, sun=1))
+
+    def test_remove_and_clear(self):
+        """Test removing and clearing tags updates the cached cloud."""
+        def change():
+            self.photos[0].tags.remove('sea')
+            self.photos[1].tags.clear()
+        cloud = self.assert_cached_cloud_correct(change)
+        self.assertEqual(cloud, dict(sky=2))
+
+    def test_rolled_back_change(self):
+        """Test tagging which rolls back leaves the cached cloud alone."""
+        run_on_commit()
+        cloud = self.cloud()
+        try:
+            with transaction.atomic():
+                self.photos[1].tags.add('sea', 'sun')
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        run_on_commit()
+        self.assertEqual(self.cloud(), cloud)
+        self.assertEqual(self.cloud(), count_tags(self.user.pk))
+
+    def test_delete_photo(self):
+        """Test deleting a photo updates the cached cloud."""
+        cloud = self.assert_cached_cloud_correct(self.photos[0].delete)
+        self.assertEqual(cloud, dict(sky=2))
+
+    def test_library_shows_counts(self):
+        """Test the library lists each tag once with its count."""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('library'))
+        self.assertContains(response, '"sky"</a> (3)', count=1)
+
+
+class TagIndexTestCase(TestCase):
+    """Test the tag index follows changes to photos' tags."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='indexer')
+        self.photo = PhotoFactory(user=self.user)
+
+    def keys(self):
+        """Return the index keys of the photo."""
+        return sorted(self.photo.tag_entries.values_list('key', flat=True))
+
+    def test_add(self):
+        """Test added tags are indexed case folded."""
+        self.photo.tags.add('Sea', 'sky')
+        self.assertEqual(self.keys(), ['sea', 'sky'])
+
+    def test_remove(self):
+        """Test removed tags leave the index."""
+        self.photo.tags.add('sea', 'sky')
+        self.photo.tags.remove('sea')
+        self.assertEqual(self.keys(), ['sky'])
+
+    def test_set_and_clear(self):
+        """Test replacing and clearing tags."""
+        self.photo.tags.add('sea')
+        self.photo.tags.set('sky', 'sun')
+        self.assertEqual(self.keys(), ['sky', 'sun'])
+        self.photo.tags.clear()
+        self.assertEqual(self.keys(), [])
+
+    def test_photo_delete(self):
+        """Test deleting a photo removes its entries."""
+        self.photo.tags.add('sea')
+        self.photo.delete()
+        self.assertFalse(PhotoTag.objects.exists())
+
+    def test_rebuild(self):
+        """Test rebuilding restores missing entries."""
+        self.photo.tags.add('sea')
+        PhotoTag.objects.all().delete()
+        rebuild([self.photo])
+        self.assertEqual(self.keys(), ['sea'])
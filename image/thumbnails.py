@@ -0,0 +1,105 @@
+"""Pre-rendering and lookup of the thumbnails the templates display.
+
+sorl's thumbnail tag looks each thumbnail up in its key value store,
+and creates the file on first use. Instead, every geometry in
+THUMBNAILS is rendered ahead of time from a background job and recorded
+as a Thumbnail row. Views then attach the thumbnails of a whole page of
+photos with attach_thumbnails, in one query. Thumbnails are never
+rendered during a request: until a photo's is, the original image is
+shown at the thumbnail's size.
+"""
+from sorl.thumbnail import get_thumbnail
+
+from .jobs import enqueue
+from .models import Thumbnail
+
+
+# Geometries and options of the thumbnails shown in the templates.
+LIBRARY_THUMBNAIL = ('100x100', dict(crop='center', format='JPEG'))
+
+THUMBNAILS = [
+    LIBRARY_THUMBNAIL,
+]
+
+
+def options_key(options):
+    """Return a canonical string for a dict of thumbnail options."""
+    return ','.join(
+        '{}={}'.format(name, options[name]) for name in sorted(options)
+    )
+
+
+class Placeholder(object):
+    """Stands in for a thumbnail not rendered yet, showing the original
+    image at the thumbnail's size."""
+
+    def __init__(self, photo, geometry):
+        self.url = photo.photo.url
+        width, _, height = geometry.partition('x')
+        self.width = width or height
+        self.height = height or width
+
+
+def render_thumbnail(photo, geometry, options):
+    """Render a thumbnail of photo with sorl and record it.
+
+    sorl logs and swallows errors reading the source image, so a missing
+    thumbnail file is raised as an IOError."""
+    thumbnail = get_thumbnail(photo.photo.path, geometry, **options)
+    if not thumbnail.exists():
+        raise IOError('Could not render thumbnail of {}'.format(
+            photo.photo.name
+        ))
+    record, _ = Thumbnail.objects.update_or_create(
+        photo=photo,
+        geometry=geometry,
+        options=options_key(options),
+        defaults=dict(
+            source=photo.photo.name,
+            name=thumbnail.name,
+            width=thumbnail.width,
+            height=thumbnail.height,
+        ),
+    )
+    return record
+
+
+def render_thumbnails(photo):
+    """Render and record every thumbnail of photo used by the templates."""
+    return [
+        render_thumbnail(photo, geometry, options)
+        for geometry, options in THUMBNAILS
+    ]
+
+
+def attach_thumbnails(photos, geometry, options):
+    """Set the thumbnail attribute of each of photos.
+
+    Recorded thumbnails are loaded in a single query. Any not recorded
+    yet, or recorded for an image since replaced, get a Placeholder and
+    a thumbnails job is queued to render them. Photos without an image
+    get None."""
+    photos = [photo for photo in photos if photo is not None]
+    if not photos:
+        return photos
+    records = Thumbnail.objects.filter(
+        photo__in=[photo.pk for photo in photos],
+        geometry=geometry,
+        options=options_key(options),
+    )
+    by_photo = dict((record.photo_id, record) for record in records)
+    for photo in photos:
+        record = by_photo.get(photo.pk)
+        if not photo.photo:
+            record = None
+        elif record is None or record.source != photo.photo.name:
+            enqueue('thumbnails', photo=photo)
+            record = Placeholder(photo, geometry)
+        photo.thumbnail = record
+    return photos
+
+
+def thumbnails_job(job):
+    """Job handler rendering the thumbnails of the job's photo."""
+    if job.photo is not None and job.photo.photo:
+        render_thumbnails(job.photo)
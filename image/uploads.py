@@ -0,0 +1,227 @@
+"""Resumable, chunked photo uploads.
+
+A client starts an upload by posting the photo's details and the size
+of its image, then sends the image in chunks, each with a Content-Range
+header. Each chunk is streamed from the request to a temporary file in
+PHOTO_UPLOAD_DIR, so memory use does not depend on the size of the
+image, and then appended to the upload's partial file while the upload
+is locked. The image header is checked as soon as enough of it has arrived,
+without decoding any pixels, and once the last chunk is written the
+partial file is renamed into the photo's storage location.
+
+Uploads which haven't had a chunk for PHOTO_UPLOAD_EXPIRY seconds are
+abandoned, and are deleted with their partial files by the
+expire_uploads command.
+"""
+from datetime import timedelta
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from taggit.utils import parse_tags
+
+from .models import Photo, PhotoUpload
+
+
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# Pillow 5 and later raise DecompressionBombError for huge images.
+HEADER_ERRORS = (IOError, SyntaxError, ValueError) + tuple(
+    getattr(Image, name) for name in ['DecompressionBombError']
+    if hasattr(Image, name)
+)
+
+
+class UploadError(Exception):
+    """An upload request which can't be applied."""
+
+    def __init__(self, message, status=400):
+        super(UploadError, self).__init__(message)
+        self.status = status
+
+
+class PartFile(File):
+    """A partial upload file, moved rather than copied into storage."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def upload_dir():
+    """Return the directory partial uploads are written to.
+
+    It should be on the same filesystem as MEDIA_ROOT, so finished
+    uploads can be renamed into place atomically."""
+    return getattr(
+        settings,
+        'PHOTO_UPLOAD_DIR',
+        os.path.join(settings.MEDIA_ROOT, '.uploads')
+    )
+
+
+def max_upload_size():
+    """Return the largest image size which may be uploaded, in bytes."""
+    return getattr(settings, 'PHOTO_UPLOAD_MAX_SIZE', 200 * 1024 * 1024)
+
+
+def upload_expiry():
+    """Return the seconds an upload may go without a chunk."""
+    return getattr(settings, 'PHOTO_UPLOAD_EXPIRY', 24 * 60 * 60)
+
+
+def header_limit():
+    """Return how many bytes may arrive before the header must be read."""
+    return getattr(settings, 'PHOTO_UPLOAD_HEADER_LIMIT', 1024 * 1024)
+
+
+def part_path(upload):
+    """Return the path of an upload's partial file."""
+    return os.path.join(upload_dir(), '{}.part'.format(upload.pk))
+
+
+def parse_content_range(header, size):
+    """Return the (start, end) of a chunk from its Content-Range header."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError('Missing or malformed Content-Range header.')
+    start, end, total = map(int, match.groups())
+    if total != size or start > end or end >= size:
+        raise UploadError('Content-Range does not fit the upload.', 416)
+    return start, end
+
+
+def check_offset(upload, start):
+    """Raise a 409 error unless a chunk starts where the previous one
+    ended, so the client can resume from upload.offset."""
+    if start != upload.offset:
+        raise UploadError(
+            'Expected a chunk starting at {}.'.format(upload.offset), 409
+        )
+
+
+def receive_chunk(upload, stream, content_range):
+    """Read a chunk from stream into a temporary file.
+
+    This is done without locking the upload, so a slow client holds no
+    lock or transaction while the chunk arrives; append_chunk adds it to
+    the partial file afterwards. Returns where the chunk starts and the
+    temporary file, which is deleted once closed."""
+    start, end = parse_content_range(content_range, upload.size)
+    check_offset(upload, start)
+    if not os.path.isdir(upload_dir()):
+        os.makedirs(upload_dir())
+    chunk = tempfile.TemporaryFile(dir=upload_dir())
+    remaining = end - start + 1
+    try:
+        while remaining > 0:
+            data = stream.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            chunk.write(data)
+            remaining -= len(data)
+        chunk.seek(0)
+    except Exception:
+        chunk.close()
+        raise
+    return start, chunk
+
+
+def append_chunk(upload, start, chunk):
+    """Append a received chunk to an upload's partial file.
+
+    The upload should be locked, and its offset is checked again as
+    another chunk may have been appended since this one was received."""
+    check_offset(upload, start)
+    with open(part_path(upload), 'ab') as part:
+        part.truncate(start)
+        shutil.copyfileobj(chunk, part, CHUNK_SIZE)
+        upload.offset = part.tell()
+    upload.save()
+    if not upload.image_format:
+        check_header(upload)
+
+
+def check_header(upload):
+    """Read the image format from the partial file's header.
+
+    Image.open only parses the header and decodes no pixels. A header
+    which can't be read yet is only an error once the upload is past
+    the header limit or complete."""
+    try:
+        with open(part_path(upload), 'rb') as part:
+            image = Image.open(part)
+            upload.image_format = image.format
+    except HEADER_ERRORS:
+        if upload.offset >= min(header_limit(), upload.size):
+            discard(upload)
+            raise UploadError('Upload is not a valid image.')
+    else:
+        upload.save()
+
+
+def finish(upload):
+    """Turn a completely written upload into a photo.
+
+    The partial file is moved into storage, unless the same image is
+    already stored, in which case it is deleted."""
+    if not upload.image_format:
+        check_header(upload)
+    photo = Photo(
+        user=upload.user,
+        title=upload.title,
+        description=upload.description,
+        published=upload.published,
+    )
+    with transaction.atomic():
+        with open(part_path(upload), 'rb') as part:
+            photo.photo.save(upload.filename, PartFile(part), save=False)
+        photo.save()
+        photo.tags.set(*parse_tags(upload.tags))
+        discard(upload)
+    return photo
+
+
+def discard(upload):
+    """Delete an upload and its partial file."""
+    try:
+        os.remove(part_path(upload))
+    except OSError:
+        pass
+    upload.delete()
+
+
+def expire_uploads(expiry=None):
+    """Delete uploads which have had no chunk for expiry seconds, and
+    partial files as old which no upload refers to.
+
+    Returns the number of uploads deleted."""
+    if expiry is None:
+        expiry = upload_expiry()
+    expired = PhotoUpload.objects.filter(
+        date_modified__lt=timezone.now() - timedelta(seconds=expiry)
+    )
+    count = 0
+    for upload in expired:
+        discard(upload)
+        count += 1
+    if os.path.isdir(upload_dir()):
+        live = set('{}.part'.format(pk) for pk in
+                   PhotoUpload.objects.values_list('pk', flat=True))
+        cutoff = time.time() - expiry
+        for name in os.listdir(upload_dir()):
+            path = os.path.join(upload_dir(), name)
+            if name not in live and os.path.getmtime(path) < cutoff:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return count
@@ -2,6 +2,8 @@ from .views import (
     library_view,
 
     image_view,
+    start_upload_view,
+    upload_view,
     AddPhotoView,
     EditPhotoView,
     DeletePhotoView,
@@ -12,13 +14,22 @@ from .views import (
     DeleteAlbumView,
 
     tag_view,
+    search_view,
+    duplicates_view,
 )
 from django.conf.urls import url
 
 urlpatterns = [
     url('library/$', library_view, name='library'),
+    url(r'library/duplicates/$', duplicates_view, name='duplicates'),
 
     url(r'photos/add', AddPhotoView.as_view(), name='add_photo'),
+    url(r'photos/upload/$', start_upload_view, name='start_photo_upload'),
+    url(
+        r'photos/upload/(?P<upload_id>[0-9a-f-]+)/$',
+        upload_view,
+        name='photo_upload'
+    ),
     url(r'photos/(?P<photo_id>[0-9]+)/$', image_view, name='images'),
     url(
         r'photos/(?P<pk>[0-9]+)/edit/$',
@@ -47,5 +58,6 @@ urlpatterns = [
         r'tag/(?P<tag>.+)/$',
         tag_view,
         name='tag'
-    )
+    ),
+    url(r'search/$', search_view, name='search'),
 ]
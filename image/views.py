@@ -1,18 +1,54 @@
+import os
+import posixpath
+
 from django import forms
+from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.views.generic import CreateView, UpdateView, DeleteView
+from django.core.exceptions import SuspiciousFileOperation
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import Http404
-
-from .models import Album, Photo
-
-
+from django.db import transaction
+from django.db.models import Count
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_http_methods, require_POST
+from django.utils._os import safe_join
+from django.utils.functional import SimpleLazyObject
+from imagersite.db import read_replica
+from taggit.models import Tag
+
+from . import keyset, media, queries, uploads
+from .conditional import conditional, album_state, library_state, photo_state
+from .duplicates import duplicate_groups
+from .models import Album, Photo, PhotoUpload
+from .generations import fragment_timeout, get_generations
+from .metadata import MetadataFilterForm
+from .search import SearchResults
+from .tagcloud import get_cloud
+from .tagindex import photos_with_tags
+from .thumbnails import LIBRARY_THUMBNAIL, attach_thumbnails
+
+
+@read_replica
+@conditional(library_state)
 def library_view(request):
-    """Render a library."""
-    photos = request.user.photos.all()
-    albums = request.user.albums.all()
+    """Render a library.
+
+    The number of queries is fixed no matter how large the library is:
+    one count and one page for photos and albums each, one lookup of
+    thumbnails for each, plus the user's tag cloud, which is usually
+    cached. The tags, albums and photos are rendered in fragments cached
+    by the user's generation counters, and the pages, thumbnails and tag
+    cloud are only loaded when a fragment has to be rendered.
+
+    Photos can be filtered by the metadata of their images with the
+    fields of MetadataFilterForm."""
+    filters = MetadataFilterForm(request.GET)
+    photos = filters.filter(queries.library_photos(request.user), request.user)
+    albums = queries.library_albums(request.user)
     pag_photos = Paginator(photos, 4)
     pag_albums = Paginator(albums, 4)
     page = request.GET.get('page')
@@ -25,16 +61,19 @@ def library_view(request):
     except EmptyPage:
         albums = pag_albums.page(pag_albums.num_pages)
         photos = pag_photos.page(pag_photos.num_pages)
-    for album in albums:
-        if not album.cover:
-            album.nocover = True
-    tags = []
-    for photo in request.user.photos.all():
-        tags.extend(photo.tags.all())
-    context = dict(photos=photos, albums=albums, tags=tags)
+    context = dict(
+        photos=photos,
+        albums=albums,
+        tags=SimpleLazyObject(lambda: get_cloud(request.user)),
+        filters=filters,
+        filter_query=filters.query_string(),
+        generations=get_generations(request.user.pk),
+        fragment_timeout=fragment_timeout(),
+    )
     return render(request, 'library.html', context)
 
 
+@conditional(photo_state)
 def image_view(request, photo_id):
     """Render an image."""
     photo = request.user.photos.filter(id=photo_id).first()
@@ -44,36 +83,234 @@ def image_view(request, photo_id):
         return render(request, 'photo_not_found.html')
 
 
+@read_replica
+@conditional(album_state)
 def album_view(request, album_id):
-    """Render detail view of album."""
+    """Render detail view of album.
+
+    Photos are paged through by keyset, and the tags of every photo in
+    the album are collected with one grouped query, so the page takes
+    the same few queries however many photos the album holds."""
     album = request.user.albums.filter(id=album_id).first()
     if album:
-        photos = album.photos.all()
-        tags = set()
-        for photo in photos:
-            for tag in photo.tags.all():
-                tags.add(tag)
-        pag_photos = Paginator(photos, 4)
-        page = request.GET.get('page')
+        photos = album.photos.only('id', 'photo', 'title', 'date_uploaded')
         try:
-            photos = pag_photos.page(page)
-        except PageNotAnInteger:
-            photos = pag_photos.page(1)
-        except EmptyPage:
-            photos = pag_photos.page(pag_photos.num_pages)
-        context = dict(album=album, photos=photos, tags=tags)
+            number = int(request.GET.get('page', 1))
+        except ValueError:
+            number = 1
+        photos = keyset.paginate(
+            photos, 4,
+            after_cursor=request.GET.get('after'),
+            before_cursor=request.GET.get('before'),
+            number=number,
+        )
+        tags = Tag.objects.filter(photo_tags__photo__albums=album).annotate(
+            count=Count('photo_tags')
+        ).order_by('name')
+        context = dict(
+            album=album,
+            photos=photos,
+            tags=tags,
+            generations=get_generations(request.user.pk),
+            fragment_timeout=fragment_timeout(),
+        )
         return render(request, 'album.html', context)
     else:
         return render(request, 'album_not_found.html')
 
 
+@read_replica
 def tag_view(request, tag):
-    """All photos with tag."""
-    # tag, photos
-    context = dict(tag=tag, photos=request.user.photos.filter(tags__name=tag))
+    """Photos with all of the comma separated tags, or any with ?match=any.
+
+    Photos are found through the tag index rather than taggit's generic
+    relation, and shown a page at a time."""
+    names = [name.strip() for name in tag.split(',') if name.strip()]
+    match = 'any' if request.GET.get('match') == 'any' else 'all'
+    photos = photos_with_tags(request.user, names, match).order_by(
+        'date_uploaded', 'id'
+    )
+    paginator = Paginator(photos, 4)
+    try:
+        photos = paginator.page(request.GET.get('page'))
+    except PageNotAnInteger:
+        photos = paginator.page(1)
+    except EmptyPage:
+        photos = paginator.page(paginator.num_pages)
+    attach_thumbnails(photos, *LIBRARY_THUMBNAIL)
+    context = dict(tag=', '.join(names), match=match, photos=photos)
     return render(request, 'tag.html', context)
 
 
+@read_replica
+@login_required
+def duplicates_view(request):
+    """Groups of the user's photos which are near-duplicates of each other.
+
+    The groups are found from the photos' perceptual hashes and shown a
+    few at a time, with their photos and thumbnails loaded in bulk."""
+    paginator = Paginator(duplicate_groups(request.user), 10)
+    try:
+        groups = paginator.page(request.GET.get('page'))
+    except PageNotAnInteger:
+        groups = paginator.page(1)
+    except EmptyPage:
+        groups = paginator.page(paginator.num_pages)
+    photos = request.user.photos.in_bulk(
+        [photo_id for group in groups for photo_id in group]
+    )
+    attach_thumbnails(list(photos.values()), *LIBRARY_THUMBNAIL)
+    context = dict(groups=groups, photo_groups=[
+        [photos[photo_id] for photo_id in group if photo_id in photos]
+        for group in groups
+    ])
+    return render(request, 'duplicates.html', context)
+
+
+@read_replica
+@login_required
+def search_view(request):
+    """Photos and albums matching the ?q= query, best match first.
+
+    Photos are shown a page at a time, with the best matching albums
+    above the first page."""
+    query = request.GET.get('q', '').strip()
+    photos = SearchResults(request.user, query, Photo.objects.all())
+    paginator = Paginator(photos, 4)
+    try:
+        photos = paginator.page(request.GET.get('page'))
+    except PageNotAnInteger:
+        photos = paginator.page(1)
+    except EmptyPage:
+        photos = paginator.page(paginator.num_pages)
+    albums = []
+    if photos.number == 1:
+        albums = SearchResults(
+            request.user, query, Album.objects.select_related('cover')
+        )[:4]
+    attach_thumbnails(
+        list(photos) + [album.cover for album in albums], *LIBRARY_THUMBNAIL
+    )
+    context = dict(query=query, photos=photos, albums=albums)
+    return render(request, 'search.html', context)
+
+
+def media_view(request, path):
+    """Serve an uploaded file to users allowed to see it."""
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    if not media.can_view_path(request.user, path):
+        raise Http404
+    return media.offload(path) or media.serve_file(request, path, full_path)
+
+
+class PhotoUploadForm(forms.ModelForm):
+    """Form for starting a chunked photo upload."""
+
+    class Meta(object):
+        model = PhotoUpload
+
+        fields = [
+            'filename',
+            'size',
+            'title',
+            'description',
+            'published',
+            'tags',
+        ]
+
+    def clean_filename(self):
+        """Only keep the base name of the uploaded file."""
+        return os.path.basename(self.cleaned_data['filename'])
+
+    def clean_size(self):
+        """Ensure the upload is not empty or too large."""
+        size = self.cleaned_data['size']
+        if not 0 < size <= uploads.max_upload_size():
+            raise forms.ValidationError('Upload size is out of range.')
+        return size
+
+
+def upload_state(upload):
+    """Return the json-able state of an upload."""
+    return dict(
+        id=str(upload.pk),
+        offset=upload.offset,
+        size=upload.size,
+        url=reverse('photo_upload', args=[upload.pk]),
+    )
+
+
+def upload_error(upload, error):
+    """Return the response to an UploadError, with the upload's state
+    unless the error discarded it."""
+    state = dict(error=str(error))
+    if upload.pk is not None:
+        state.update(upload_state(upload))
+    return JsonResponse(state, status=error.status)
+
+
+@login_required
+@require_POST
+def start_upload_view(request):
+    """Start a chunked upload from the photo's details and image size."""
+    form = PhotoUploadForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse(dict(errors=form.errors), status=400)
+    form.instance.user = request.user
+    upload = form.save()
+    return JsonResponse(upload_state(upload), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+def upload_view(request, upload_id):
+    """Report, continue or cancel a chunked upload.
+
+    GET returns the offset to resume from. PUT writes the request body
+    at the offset in its Content-Range header and, once the last chunk
+    is written, creates the photo. DELETE abandons the upload. The body
+    is received before the upload is locked, which is only for as long
+    as the chunk takes to append, so two requests can't write its
+    partial file at once."""
+    upload = get_object_or_404(PhotoUpload, pk=upload_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(upload_state(upload))
+    if request.method == 'DELETE':
+        with transaction.atomic():
+            upload = get_object_or_404(
+                PhotoUpload.objects.select_for_update(), pk=upload.pk
+            )
+            uploads.discard(upload)
+        return HttpResponse(status=204)
+    try:
+        start, chunk = uploads.receive_chunk(
+            upload, request, request.META.get('HTTP_CONTENT_RANGE')
+        )
+    except uploads.UploadError as error:
+        return upload_error(upload, error)
+    with chunk, transaction.atomic():
+        upload = get_object_or_404(
+            PhotoUpload.objects.select_for_update(), pk=upload.pk
+        )
+        try:
+            uploads.append_chunk(upload, start, chunk)
+            if upload.offset < upload.size:
+                return JsonResponse(upload_state(upload))
+            photo = uploads.finish(upload)
+        except uploads.UploadError as error:
+            return upload_error(upload, error)
+    return JsonResponse(dict(
+        photo=photo.pk,
+        url=reverse('images', args=[photo.pk]),
+    ), status=201)
+
+
 class UserCreateView(LoginRequiredMixin, CreateView):
     """View which attaches the request's user to the form being submitted."""
 
@@ -88,7 +325,10 @@ class UserCreateView(LoginRequiredMixin, CreateView):
 class EditAlbumForm(forms.ModelForm):
     """Form for editing albums.
 
-    Ensures one can only add photos from their own album."""
+    Ensures one can only add photos from their own album. The photos and
+    cover are left out unless they are posted, so the form never lists
+    the user's whole library: the album pages change them through the
+    album photos API instead, a page of photos at a time."""
 
     class Meta(object):
         model = Album
@@ -108,22 +348,39 @@ class EditAlbumForm(forms.ModelForm):
         queryset = Photo.objects.filter(user=user)
         self.fields['photos'].queryset = queryset
         self.fields['cover'].queryset = queryset
+        for name in ('photos', 'cover'):
+            if name not in self.data:
+                del self.fields[name]
 
     def clean(self):
         """Ensure an album's cover is in its photos."""
         cleaned_data = super(EditAlbumForm, self).clean()
         cover = cleaned_data.get('cover')
-        if cover and cover not in cleaned_data.get('photos'):
+        if not cover:
+            return cleaned_data
+        if 'photos' in self.fields:
+            in_album = cover in (cleaned_data.get('photos') or [])
+        else:
+            in_album = self.instance.pk is not None and (
+                self.instance.photos.filter(id=cover.id).exists()
+            )
+        if not in_album:
             error = forms.ValidationError("Cover not in album's photos.")
             self.add_error('cover', error)
+        return cleaned_data
 
 
 class AddAlbumView(UserCreateView):
-    """Add Album View for adding albums."""
+    """Add Album View for adding albums.
+
+    The new album's photos are picked on its edit page."""
     template_name = "add_album.html"
     model = Album
     form_class = EditAlbumForm
 
+    def get_success_url(self):
+        return reverse('edit_album', args=[self.object.pk])
+
     def get_form_kwargs(self):
         kwargs = super(AddAlbumView, self).get_form_kwargs()
         kwargs.update({'user': self.request.user})
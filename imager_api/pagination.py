@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+from image.keyset import (
+    ORDERING, after, decode_cursor, encode_cursor, position
+)
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PhotoCursorPagination(BasePagination):
+    """Keyset pagination over photos ordered by (date_uploaded, id).
+
+    The cursor encodes the date_uploaded and id of the last photo of the
+    previous page, so each page is a single indexed range query no
+    matter how deep into the library it is."""
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 50
+    max_page_size = 200
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return the page of queryset following the request's cursor."""
+        self.request = request
+        page_size = self.get_page_size(request)
+        start = self.decode_cursor(request)
+        if start is not None:
+            queryset = after(queryset, start)
+        page = list(queryset.order_by(*ORDERING)[:page_size + 1])
+        self.next_position = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_position = position(page[-1])
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        """Return the requested page size, bounded by max_page_size."""
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        """Return the url of the next page, or None on the last page."""
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        cursor = self.encode_cursor(self.next_position)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def encode_cursor(self, position):
+        """Encode a (date_uploaded, id) position as an opaque string."""
+        return encode_cursor(position)
+
+    def decode_cursor(self, request):
+        """Decode the request's cursor, or return None if it has none."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            return decode_cursor(cursor)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+
+class SearchPagination(PageNumberPagination):
+    """Numbered pages of search results, which are ranked rather than
+    ordered by a column a cursor could follow."""
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class DuplicatesPagination(PageNumberPagination):
+    """Numbered pages of groups of near-duplicate photos."""
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -1,8 +1,85 @@
-from rest_framework import serializers
-from image.models import Photo
-
-class PhotoSerializer(serializers.ModelSerializer):
-    """Photo serializer."""
-
-    class Meta:
-        model=Photo
+from rest_framework import serializers
+from image.models import PUB_CHOICES, Photo
+
+class PhotoSerializer(serializers.ModelSerializer):
+    """Photo serializer.
+
+    Pass fields to only serialize some of the photo's fields."""
+
+    tags = serializers.SerializerMethodField()
+
+    class Meta:
+        model=Photo
+        fields = (
+            'id',
+            'user',
+            'photo',
+            'title',
+            'description',
+            'date_uploaded',
+            'date_modified',
+            'date_published',
+            'published',
+            'tags',
+        )
+
+    def __init__(self, *args, **kwargs):
+        """Drop any fields which were not asked for."""
+        fields = kwargs.pop('fields', None)
+        super(PhotoSerializer, self).__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_tags(self, photo):
+        """Return the names of the photo's tags."""
+        return [tag.name for tag in photo.tags.all()]
+
+
+class AlbumPhotosSerializer(serializers.Serializer):
+    """Changes to the photos of an album: ids of photos to add and to
+    remove, and optionally the id of the new cover, or null to clear it."""
+
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False
+    )
+    cover = serializers.IntegerField(
+        min_value=1, required=False, allow_null=True
+    )
+
+
+class BulkPhotosSerializer(serializers.Serializer):
+    """An operation on many photos: the ids of the photos, and the
+    published state to set or the names of tags to add and remove.
+
+    The operation, publish, tag or delete, is passed in the context."""
+
+    photos = serializers.ListField(child=serializers.IntegerField(min_value=1))
+    published = serializers.ChoiceField(choices=PUB_CHOICES, required=False)
+    add = serializers.ListField(
+        child=serializers.CharField(max_length=100), required=False
+    )
+    remove = serializers.ListField(
+        child=serializers.CharField(max_length=100), required=False
+    )
+
+    def validate(self, data):
+        """Check the operation has what it needs, and return its options."""
+        operation = self.context['operation']
+        if operation == 'publish':
+            if 'published' not in data:
+                raise serializers.ValidationError(
+                    {'published': ['This field is required.']}
+                )
+            options = dict(published=data['published'])
+        elif operation == 'tag':
+            options = dict(add=data.get('add', []),
+                           remove=data.get('remove', []))
+            if not options['add'] and not options['remove']:
+                raise serializers.ValidationError('No tags to add or remove.')
+        else:
+            options = {}
+        return dict(photos=data['photos'], options=options)
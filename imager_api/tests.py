@@ -1,8 +1,13 @@
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from factory.django import DjangoModelFactory, ImageField
-from image.models import Photo
+from image.duplicates import hash_fields
+from image.jobs import run_pending
+from image.models import Album, Photo, PhotoMetadata
 import json
 
 
@@ -17,6 +22,7 @@ class PhotoApiTestCase(TestCase):
 
     def setUp(self):
         """Setup for photo api testcase."""
+        cache.clear()
         self.user = User(username='Bob')
         self.user.save()
 
@@ -36,7 +42,7 @@ class PhotoApiTestCase(TestCase):
         """Test response had a photo and title."""
         response = self.client.get(reverse('photo_api') + '.json')
         data = json.loads(response.content.decode('utf-8'))
-        self.assertEqual(data[0]['title'], self.photo.title)
+        self.assertEqual(data['results'][0]['title'], self.photo.title)
 
     def test_unauthenticated_user_redirects(self):
         """Test status code of an unauth user."""
@@ -44,6 +50,171 @@ class PhotoApiTestCase(TestCase):
         response = self.client.get(reverse('photo_api') + '.json')
         self.assertEqual(response.status_code, 302)
 
+    def test_metadata_filter(self):
+        """Test photos are filtered by their metadata."""
+        other = PhotoFactory(user=self.user, title='Other')
+        PhotoMetadata.objects.create(
+            photo=other, user=self.user, width=4000, height=3000
+        )
+        response = self.client.get(
+            reverse('photo_api') + '.json', dict(min_width=1000)
+        )
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([photo['title'] for photo in data['results']],
+                         ['Other'])
+
+    def test_invalid_metadata_filter(self):
+        """Test an invalid filter is a bad request."""
+        response = self.client.get(
+            reverse('photo_api') + '.json', dict(taken_after='yesterday')
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_search(self):
+        """Test photos are searched by their text."""
+        PhotoFactory(user=self.user, title='Another')
+        response = self.client.get(
+            reverse('search_api') + '.json', dict(q='title')
+        )
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['results'][0]['title'], self.photo.title)
+
+    def test_search_needs_query(self):
+        """Test searching without a query is a bad request."""
+        response = self.client.get(reverse('search_api') + '.json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_duplicates(self):
+        """Test near-duplicate photos are listed in groups."""
+        copy = PhotoFactory(user=self.user, title='A copy')
+        PhotoFactory(user=self.user, title='Another')
+        Photo.objects.filter(id__in=[self.photo.id, copy.id]).update(
+            **hash_fields(99)
+        )
+        response = self.client.get(reverse('duplicates_api') + '.json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(
+            [photo['title'] for photo in data['results'][0]],
+            ['A title', 'A copy']
+        )
+
+    def test_photo_duplicates(self):
+        """Test a photo's near-duplicates come with their distance."""
+        copy = PhotoFactory(user=self.user, title='A copy')
+        Photo.objects.filter(id=self.photo.id).update(**hash_fields(6))
+        Photo.objects.filter(id=copy.id).update(**hash_fields(7))
+        response = self.client.get(reverse(
+            'photo_duplicates_api', args=[self.photo.id]
+        ) + '.json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([(photo['id'], photo['distance']) for photo in data],
+                         [(copy.id, 1)])
+
+    def test_album_photos(self):
+        """Test the user's photos are paged with whether they are in an
+        album."""
+        album = Album.objects.create(user=self.user, title='Album')
+        album.photos.add(self.photo)
+        PhotoFactory(user=self.user, title='Outside')
+        url = reverse('album_photos_api', args=[album.id]) + '.json'
+        response = self.client.get(url, dict(page_size=1))
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(
+            [(photo['title'], photo['in_album']) for photo in data['results']],
+            [('A title', True)]
+        )
+        response = self.client.get(data['next'])
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(
+            [(photo['title'], photo['in_album']) for photo in data['results']],
+            [('Outside', False)]
+        )
+
+    def test_change_album_photos(self):
+        """Test photos are added and removed and the cover set at once."""
+        album = Album.objects.create(user=self.user, title='Album')
+        album.photos.add(self.photo)
+        other = PhotoFactory(user=self.user, title='Another')
+        response = self.client.post(
+            reverse('album_photos_api', args=[album.id]) + '.json',
+            json.dumps(dict(add=[other.id], remove=[self.photo.id],
+                            cover=other.id)),
+            content_type='application/json',
+        )
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data, dict(added=1, removed=1, cover=other.id))
+        self.assertEqual(list(album.photos.all()), [other])
+
+    def test_change_album_photos_invalid(self):
+        """Test invalid changes to an album's photos are bad requests."""
+        album = Album.objects.create(user=self.user, title='Album')
+        url = reverse('album_photos_api', args=[album.id]) + '.json'
+        for body in (dict(add=['x']), dict(cover=self.photo.id)):
+            response = self.client.post(
+                url, json.dumps(body), content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_other_users_album_photos(self):
+        """Test another user's album isn't found."""
+        album = Album.objects.create(
+            user=User.objects.create(username='Jeff'), title='Album'
+        )
+        response = self.client.get(
+            reverse('album_photos_api', args=[album.id]) + '.json'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def bulk(self, operation, **body):
+        """Post a bulk operation, returning the response and its data."""
+        response = self.client.post(
+            reverse('bulk_photos_api', args=[operation]) + '.json',
+            json.dumps(body), content_type='application/json',
+        )
+        return response, json.loads(response.content.decode('utf-8'))
+
+    def test_bulk_operations(self):
+        """Test photos are published, tagged and deleted at once."""
+        other = PhotoFactory(user=self.user, title='Another')
+        ids = [self.photo.id, other.id]
+        response, data = self.bulk('publish', photos=ids, published='Private')
+        self.assertEqual(data, dict(changed=2))
+        response, data = self.bulk('tag', photos=ids, add=['Sea'])
+        self.assertEqual(data, dict(changed=2))
+        self.assertEqual(list(other.tags.names()), ['Sea'])
+        response, data = self.bulk('delete', photos=[other.id])
+        self.assertEqual(data, dict(changed=1))
+        self.assertEqual(list(self.user.photos.all()), [self.photo])
+
+    def test_bulk_invalid(self):
+        """Test operations missing their options are bad requests."""
+        for operation, body in (('publish', dict(photos=[self.photo.id])),
+                                ('tag', dict(photos=[self.photo.id])),
+                                ('delete', dict(photos=['x']))):
+            response, _ = self.bulk(operation, **body)
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(BULK_INLINE_LIMIT=0)
+    def test_bulk_job_progress(self):
+        """Test a large selection is queued and its progress reported."""
+        response, data = self.bulk('delete', photos=[self.photo.id])
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(self.photo in self.user.photos.all())
+        run_pending('bulk')
+        response = self.client.get(data['url'] + '.json')
+        job = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(job, dict(id=data['job'], kind='bulk',
+                                   status='done', done=1, total=1))
+        self.assertFalse(self.user.photos.exists())
+
+    def test_other_users_job(self):
+        """Test another user's job isn't found."""
+        self.client.force_login(User.objects.create(username='Jeff'))
+        response = self.client.get(reverse('job_api', args=[1]) + '.json')
+        self.assertEqual(response.status_code, 404)
+
     def test_user_photos_only(self):
         """Test response had a photo and title."""
         user = User(username='Jeff')
@@ -51,4 +222,119 @@ class PhotoApiTestCase(TestCase):
         self.client.force_login(user)
         response = self.client.get(reverse('photo_api') + '.json')
         data = json.loads(response.content.decode('utf-8'))
-        self.assertEqual(len(data), 0)
\ No newline at end of file
+        self.assertEqual(len(data['results']), 0)
+
+
+class PhotoApiPaginationTestCase(TestCase):
+    """Test case for paging through the Photo Api."""
+
+    def setUp(self):
+        """Set up a user with several tagged photos."""
+        self.user = User(username='Bob')
+        self.user.save()
+        self.client.force_login(self.user)
+        for i in range(7):
+            photo = PhotoFactory(user=self.user, title='photo{}'.format(i))
+            photo.tags.add('tag{}'.format(i), 'shared')
+
+    def get(self, url):
+        """Return the decoded json response for url."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_pages_cover_library_in_order(self):
+        """Test following next links returns every photo once, in order."""
+        url = reverse('photo_api') + '.json?page_size=3'
+        titles = []
+        pages = 0
+        while url:
+            data = self.get(url)
+            titles.extend(photo['title'] for photo in data['results'])
+            url = data['next']
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(titles, ['photo{}'.format(i) for i in range(7)])
+
+    def test_last_page_has_no_next(self):
+        """Test the last page's next link is null."""
+        data = self.get(reverse('photo_api') + '.json')
+        self.assertEqual(len(data['results']), 7)
+        self.assertIsNone(data['next'])
+
+    def test_tags_serialized(self):
+        """Test photos include their tag names."""
+        data = self.get(reverse('photo_api') + '.json')
+        self.assertEqual(
+            sorted(data['results'][0]['tags']), ['shared', 'tag0']
+        )
+
+    def test_sparse_fields(self):
+        """Test the fields parameter limits the serialized fields."""
+        data = self.get(reverse('photo_api') + '.json?fields=id,title')
+        self.assertEqual(set(data['results'][0]), {'id', 'title'})
+
+    def test_unknown_field(self):
+        """Test asking for an unknown field is a bad request."""
+        response = self.client.get(reverse('photo_api') + '.json?fields=nope')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is not found."""
+        response = self.client.get(reverse('photo_api') + '.json?cursor=abc')
+        self.assertEqual(response.status_code, 404)
+
+    def test_query_count_fixed_per_page(self):
+        """Test the number of queries does not grow with the page size."""
+        counts = []
+        for size in (2, 7):
+            url = reverse('photo_api') + '.json?page_size={}'.format(size)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_not_modified(self):
+        """Test revalidating an unchanged page returns 304."""
+        url = reverse('photo_api') + '.json?page_size=3'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified_after_new_photo(self):
+        """Test adding a photo makes the pages stale."""
+        url = reverse('photo_api') + '.json'
+        etag = self.client.get(url)['ETag']
+        PhotoFactory(user=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class TagApiTestCase(TestCase):
+    """Test case for the tag cloud Api."""
+
+    def setUp(self):
+        """Set up a user with tagged photos."""
+        cache.clear()
+        self.user = User.objects.create(username='Bob')
+        self.client.force_login(self.user)
+        for i in range(3):
+            photo = PhotoFactory(user=self.user)
+            photo.tags.add('tag{}'.format(i), 'shared')
+
+    def test_tags_have_counts(self):
+        """Test each tag is listed once with its photo count."""
+        response = self.client.get(reverse('tag_api') + '.json')
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data, [
+            dict(name='shared', count=3),
+            dict(name='tag0', count=1),
+            dict(name='tag1', count=1),
+            dict(name='tag2', count=1),
+        ])
+
+    def test_login_required(self):
+        """Test anonymous users are redirected."""
+        self.client.logout()
+        response = self.client.get(reverse('tag_api') + '.json')
+        self.assertEqual(response.status_code, 302)
@@ -1,9 +1,37 @@
-from django.conf.urls import url
-from rest_framework.urlpatterns import format_suffix_patterns
-from imager_api.views import photo_api_view
-
-urlpatterns = [
-    url('photos$', photo_api_view, name='photo_api')
-]
-
+from django.conf.urls import url
+from rest_framework.urlpatterns import format_suffix_patterns
+from imager_api.views import (
+    album_photos_api_view,
+    bulk_photos_api_view,
+    duplicates_api_view,
+    job_api_view,
+    photo_api_view,
+    photo_duplicates_api_view,
+    search_api_view,
+    tag_api_view,
+)
+
+urlpatterns = [
+    url(r'^photos$', photo_api_view, name='photo_api'),
+    url(r'^tags$', tag_api_view, name='tag_api'),
+    url(r'^search$', search_api_view, name='search_api'),
+    url(r'^duplicates$', duplicates_api_view, name='duplicates_api'),
+    url(
+        r'^photos/(?P<photo_id>[0-9]+)/duplicates$',
+        photo_duplicates_api_view,
+        name='photo_duplicates_api'
+    ),
+    url(
+        r'^albums/(?P<album_id>[0-9]+)/photos$',
+        album_photos_api_view,
+        name='album_photos_api'
+    ),
+    url(
+        r'^photos/(?P<operation>publish|tag|delete)$',
+        bulk_photos_api_view,
+        name='bulk_photos_api'
+    ),
+    url(r'^jobs/(?P<job_id>[0-9]+)$', job_api_view, name='job_api'),
+]
+
 urlpatterns = format_suffix_patterns(urlpatterns, allowed=['json'])
\ No newline at end of file
@@ -1,15 +1,221 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from imager_api.serializer import PhotoSerializer
+from imager_api.pagination import (
+    DuplicatesPagination, PhotoCursorPagination, SearchPagination
+)
+from imager_api.serializer import (
+    AlbumPhotosSerializer, BulkPhotosSerializer, PhotoSerializer
+)
+from image.bulk import run_operation
+from image.conditional import conditional, metadata_state, photos_state
+from image.duplicates import duplicate_groups, near_duplicates
+from image.membership import MembershipError, album_photo_ids, change_album
+from image.metadata import MetadataFilterForm
 from image.models import Photo
+from image.search import SearchResults
+from image.queries import library_photos
+from image.tagcloud import get_cloud
+from image.thumbnails import LIBRARY_THUMBNAIL, attach_thumbnails
+from collections import OrderedDict
 from django.contrib.auth.decorators import login_required
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from imagersite.db import read_replica
 
 
+def requested_fields(request, serializer_class):
+    """Return the fields named in the fields parameter, or None for all.
+
+    Unknown field names are a validation error."""
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    fields = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = set(fields) - set(serializer_class.Meta.fields)
+    if unknown:
+        raise ValidationError({
+            'fields': 'Unknown fields: {}'.format(', '.join(sorted(unknown)))
+        })
+    return fields
+
+
+def photo_api_state(request, format=None):
+    """Return the state of the user's photos for conditional requests."""
+    state = photos_state(request.user.photos.all())
+    state.update(metadata_state(request))
+    return state
+
+
+@read_replica
 @login_required
+@conditional(photo_api_state)
 @api_view(['GET'])
 def photo_api_view(request, format=None):
-    """Get photo api"""
-    photos = Photo.objects.filter(user=request.user)
-    serializer = PhotoSerializer(photos, many=True)
-    return Response(serializer.data)
+    """Get a page of the user's photos, oldest first.
+
+    Takes a cursor from the previous page's next link, an optional
+    page_size, an optional comma-separated list of fields and the
+    metadata filters of MetadataFilterForm."""
+    fields = requested_fields(request, PhotoSerializer)
+    filters = MetadataFilterForm(request.GET)
+    if not filters.is_valid():
+        raise ValidationError(filters.errors)
+    photos = filters.filter(library_photos(request.user), request.user)
+    if fields is not None:
+        columns = [name for name in fields if name != 'tags']
+        photos = photos.only('id', 'date_uploaded', *columns)
+    if fields is None or 'tags' in fields:
+        photos = photos.prefetch_related('tags')
+    paginator = PhotoCursorPagination()
+    page = paginator.paginate_queryset(photos, request)
+    serializer = PhotoSerializer(page, many=True, fields=fields)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@read_replica
+@login_required
+@api_view(['GET'])
+def tag_api_view(request, format=None):
+    """Get the user's tags with the number of photos carrying each."""
+    return Response(get_cloud(request.user))
+
+
+@read_replica
+@login_required
+@api_view(['GET'])
+def search_api_view(request, format=None):
+    """Get a page of the user's photos matching the q query, best first."""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        raise ValidationError({'q': 'This parameter is required.'})
+    photos = SearchResults(
+        request.user, query, Photo.objects.prefetch_related('tags')
+    )
+    paginator = SearchPagination()
+    page = paginator.paginate_queryset(photos, request)
+    serializer = PhotoSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@read_replica
+@login_required
+@api_view(['GET'])
+def duplicates_api_view(request, format=None):
+    """Get a page of groups of the user's near-duplicate photos."""
+    paginator = DuplicatesPagination()
+    groups = paginator.paginate_queryset(
+        duplicate_groups(request.user), request
+    )
+    photos = request.user.photos.prefetch_related('tags').in_bulk(
+        [photo_id for group in groups for photo_id in group]
+    )
+    return paginator.get_paginated_response([
+        PhotoSerializer(
+            [photos[photo_id] for photo_id in group if photo_id in photos],
+            many=True,
+        ).data
+        for group in groups
+    ])
+
+
+@read_replica
+@login_required
+@api_view(['GET'])
+def photo_duplicates_api_view(request, photo_id, format=None):
+    """Get the user's near-duplicates of one of their photos, closest
+    first, with the number of bits their hashes differ in."""
+    photo = get_object_or_404(request.user.photos, id=photo_id)
+    duplicates = near_duplicates(photo)
+    serializer = PhotoSerializer(duplicates, many=True)
+    return Response([
+        dict(data, distance=duplicate.distance)
+        for duplicate, data in zip(duplicates, serializer.data)
+    ])
+
+
+@read_replica
+@login_required
+@api_view(['GET', 'POST'])
+def album_photos_api_view(request, album_id, format=None):
+    """Page through the user's photos, marking those in an album, or
+    change the album's photos.
+
+    GET takes the cursor and page_size of the photo API, and gives each
+    photo's id, title, thumbnail and whether it is in the album. POST
+    takes the add, remove and cover of AlbumPhotosSerializer and applies
+    them in one transaction."""
+    album = get_object_or_404(request.user.albums, id=album_id)
+    if request.method == 'POST':
+        changes = AlbumPhotosSerializer(data=request.data)
+        changes.is_valid(raise_exception=True)
+        try:
+            added, removed = change_album(album, **changes.validated_data)
+        except MembershipError as error:
+            raise ValidationError({'detail': str(error)})
+        album.refresh_from_db()
+        return Response(OrderedDict([
+            ('added', added),
+            ('removed', removed),
+            ('cover', album.cover_id),
+        ]))
+    paginator = PhotoCursorPagination()
+    photos = paginator.paginate_queryset(
+        library_photos(request.user).only(
+            'id', 'photo', 'title', 'date_uploaded'
+        ),
+        request,
+    )
+    attach_thumbnails(photos, *LIBRARY_THUMBNAIL)
+    in_album = album_photo_ids(album, [photo.id for photo in photos])
+    return Response(OrderedDict([
+        ('next', paginator.get_next_link()),
+        ('cover', album.cover_id),
+        ('results', [OrderedDict([
+            ('id', photo.id),
+            ('title', photo.title),
+            ('thumbnail', photo.thumbnail.url if photo.thumbnail else None),
+            ('in_album', photo.id in in_album),
+        ]) for photo in photos]),
+    ]))
+
+
+@login_required
+@api_view(['POST'])
+def bulk_photos_api_view(request, operation, format=None):
+    """Publish, tag or delete many of the user's photos.
+
+    Takes the photo ids and options of BulkPhotosSerializer. Ids of
+    other users' photos are ignored. Small selections are changed at
+    once, giving the number of photos changed; larger ones are queued as
+    a job, giving 202 Accepted and the job's id and progress URL."""
+    serializer = BulkPhotosSerializer(
+        data=request.data, context={'operation': operation}
+    )
+    serializer.is_valid(raise_exception=True)
+    changed, job = run_operation(
+        request.user, operation, serializer.validated_data['photos'],
+        **serializer.validated_data['options']
+    )
+    if job is None:
+        return Response({'changed': changed})
+    return Response(OrderedDict([
+        ('job', job.id),
+        ('url', reverse('job_api', kwargs={'job_id': job.id})),
+    ]), status=status.HTTP_202_ACCEPTED)
+
+
+@login_required
+@api_view(['GET'])
+def job_api_view(request, job_id, format=None):
+    """Give the status and progress of one of the user's jobs, read from
+    the primary database so progress doesn't lag."""
+    job = get_object_or_404(request.user.jobs, id=job_id)
+    return Response(OrderedDict([
+        ('id', job.id),
+        ('kind', job.kind),
+        ('status', job.status),
+        ('done', job.done),
+        ('total', job.total),
+    ]))
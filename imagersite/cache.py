@@ -0,0 +1,99 @@
+"""A local memory cache backend which evicts least recently used entries.
+
+Django's LocMemCache culls an arbitrary fraction of its entries once it
+holds MAX_ENTRIES, which throws away hot entries as readily as cold
+ones. This backend keeps entries in access order instead and evicts the
+oldest, once there are MAX_ENTRIES of them or, if the MAX_BYTES option
+is set, once their pickled values take up more than MAX_BYTES.
+
+The size of the values is kept as entries are added and deleted, so
+every removal, including of expired entries, goes through _delete.
+"""
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache, dummy, pickle
+from django.utils.synch import RWLock
+
+
+_caches = {}
+_expire_info = {}
+_locks = {}
+_sizes = {}
+
+
+class LRULocMemCache(LocMemCache):
+    """A thread-safe, size-bounded, least recently used memory cache."""
+
+    def __init__(self, name, params):
+        BaseCache.__init__(self, params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 0)) or None
+        self._cache = _caches.setdefault(name, OrderedDict())
+        self._expire_info = _expire_info.setdefault(name, {})
+        self._lock = _locks.setdefault(name, RWLock())
+        self._size = _sizes.setdefault(name, [0])
+
+    def get(self, key, default=None, version=None, acquire_lock=True):
+        """Get a value, marking it as the most recently used."""
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with (self._lock.writer() if acquire_lock else dummy()):
+            if self._has_expired(key):
+                self._delete(key)
+                return default
+            pickled = self._cache[key] = self._cache.pop(key)
+        try:
+            return pickle.loads(pickled)
+        except pickle.PickleError:
+            return default
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock.writer():
+            if self._has_expired(key):
+                self._delete(key)
+                return False
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        with self._lock.writer():
+            value = self.get(key, version=version, acquire_lock=False)
+            if value is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = value + delta
+            made_key = self.make_key(key, version=version)
+            timeout = self._expire_info[made_key]
+            pickled = pickle.dumps(new_value, pickle.HIGHEST_PROTOCOL)
+            self._set(made_key, pickled, None)
+            self._expire_info[made_key] = timeout
+        return new_value
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        self._size[0] += len(value)
+        super(LRULocMemCache, self)._set(key, value, timeout)
+        while self._max_bytes and self._size[0] > self._max_bytes and (
+            len(self._cache) > 1
+        ):
+            self._delete(next(iter(self._cache)))
+
+    def _cull(self):
+        """Evict the least recently used entries."""
+        if self._cull_frequency == 0:
+            self.clear()
+            return
+        count = max(1, len(self._cache) // self._cull_frequency)
+        for key in list(self._cache)[:count]:
+            self._delete(key)
+
+    def _delete(self, key):
+        value = self._cache.get(key)
+        if value is not None:
+            self._size[0] -= len(value)
+        super(LRULocMemCache, self)._delete(key)
+
+    def clear(self):
+        super(LRULocMemCache, self).clear()
+        self._size[0] = 0
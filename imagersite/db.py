@@ -0,0 +1,125 @@
+"""Database connection management: health checks and read replicas.
+
+Connections persist between requests for CONN_MAX_AGE seconds. A
+connection which has sat idle for longer than DB_HEALTH_CHECK_INTERVAL
+seconds may have been dropped by the server or a proxy in between, so
+ConnectionHealthMiddleware pings it before the request runs and closes
+it if it's dead, letting the request open a fresh one instead of
+failing.
+
+Views decorated with read_replica run their queries for GET and HEAD
+requests against one of DATABASE_REPLICAS, picked at random for each
+request, through ReplicaRouter. After a user makes a change,
+ReplicaPinMiddleware keeps their reads on the primary for
+REPLICA_PIN_SECONDS so they see it despite replica lag.
+"""
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+
+PIN_COOKIE = 'use_primary'
+
+_state = threading.local()
+
+
+def replicas():
+    """Return the aliases of the read replica databases."""
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def health_check_interval():
+    """Return the seconds a connection may idle before it's checked."""
+    return getattr(settings, 'DB_HEALTH_CHECK_INTERVAL', 30)
+
+
+def check_connections():
+    """Close open connections which have idled too long and stopped working."""
+    now = time.time()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        last_used = getattr(connection, 'last_used', now)
+        if now - last_used > health_check_interval():
+            if not connection.is_usable():
+                connection.close()
+
+
+def mark_used():
+    """Record when each open connection was last used."""
+    now = time.time()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.last_used = now
+
+
+class ConnectionHealthMiddleware(object):
+    """Check idle persistent connections before each request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        check_connections()
+        try:
+            return self.get_response(request)
+        finally:
+            mark_used()
+
+
+class ReplicaPinMiddleware(object):
+    """Pin a user's reads to the primary for a while after they write."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (replicas() and request.method not in ('GET', 'HEAD', 'OPTIONS')
+                and response.status_code < 400):
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True,
+            )
+        return response
+
+
+def read_replica(view):
+    """Decorate a read-only view to query a replica for GET requests."""
+    @wraps(view)
+    def inner(request, *args, **kwargs):
+        replica = None
+        if (replicas() and request.method in ('GET', 'HEAD') and
+                PIN_COOKIE not in request.COOKIES):
+            replica = random.choice(replicas())
+        previous = getattr(_state, 'replica', None)
+        _state.replica = replica
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _state.replica = previous
+    return inner
+
+
+class ReplicaRouter(object):
+    """Route reads in read_replica views to the replica picked for them.
+
+    Every write goes to the default database, including writes of objects
+    which were read from a replica."""
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
@@ -0,0 +1,271 @@
+"""Request instrumentation, exported in the Prometheus text format.
+
+With METRICS_ENABLED set, InstrumentationMiddleware records the time
+each view takes to respond and the number and time of the SQL queries
+it makes, while the template backend and sorl thumbnail backend in this
+module record the time spent rendering templates and creating thumbnail
+files. With METRICS_PROFILE_RATE set to N, one request in N on average
+is also run under cProfile and its stats written to METRICS_PROFILE_DIR.
+
+The metrics are kept in memory by each process and served by
+metrics_view. When METRICS_ENABLED isn't set the middleware removes
+itself and settings keep the stock backends, so nothing is recorded.
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+from sorl.thumbnail.base import ThumbnailBackend
+
+
+# Upper bounds of the histogram buckets, in seconds or queries.
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_metrics = []
+
+
+def enabled():
+    """Return whether metrics are being recorded."""
+    return getattr(settings, 'METRICS_ENABLED', False)
+
+
+def format_labels(names, values, extra=()):
+    """Return the label set of a sample, like {view="home"}."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', r'\\').replace('"', r'\"')
+    ) for name, value in pairs) + '}'
+
+
+class Counter(object):
+    """A count of events, by label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def samples(self):
+        """Return the lines of the samples of this metric."""
+        with self._lock:
+            values = sorted(self._values.items())
+        return ['{}{} {}'.format(
+            self.name, format_labels(self.labels, label_values), value
+        ) for label_values, value in values]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(Counter):
+    """A distribution of observed values in buckets, by label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=SECONDS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = dict(
+                    buckets=[0] * (len(self.buckets) + 1), sum=0, count=0
+                )
+            counts['buckets'][index] += 1
+            counts['sum'] += value
+            counts['count'] += 1
+
+    def samples(self):
+        """Return the lines of the cumulative buckets, sum and count."""
+        with self._lock:
+            values = sorted(
+                (label_values, dict(counts, buckets=list(counts['buckets'])))
+                for label_values, counts in self._values.items()
+            )
+        lines = []
+        for label_values, counts in values:
+            total = 0
+            bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts['buckets']):
+                total += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(self.labels, label_values, [('le', bound)]),
+                    total,
+                ))
+            labels = format_labels(self.labels, label_values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, counts['sum']))
+            lines.append('{}_count{} {}'.format(
+                self.name, labels, counts['count']
+            ))
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'imager_request_duration_seconds',
+    'Time taken to respond to requests, by view.', ('view', 'method'),
+)
+REQUESTS = Counter(
+    'imager_requests_total',
+    'Requests answered, by view and status code.', ('view', 'status'),
+)
+REQUEST_QUERIES = Histogram(
+    'imager_request_queries',
+    'SQL queries made per request, by view.', ('view',), QUERIES,
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'imager_request_sql_duration_seconds',
+    'Time spent in SQL queries per request, by view.', ('view',),
+)
+TEMPLATE_SECONDS = Histogram(
+    'imager_template_render_duration_seconds',
+    'Time taken to render templates, by template.', ('template',),
+)
+THUMBNAIL_SECONDS = Histogram(
+    'imager_thumbnail_render_duration_seconds',
+    'Time taken by sorl to create thumbnail files.',
+)
+PROFILED = Counter(
+    'imager_profiled_requests_total',
+    'Requests run under cProfile, by view.', ('view',),
+)
+
+
+def render_metrics():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.append('# HELP {} {}'.format(metric.name, metric.description))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def clear_metrics():
+    """Forget everything recorded so far."""
+    for metric in _metrics:
+        metric.clear()
+
+
+def view_name(request):
+    """Return the name of the view a request was routed to."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.func.__name__
+
+
+class InstrumentationMiddleware(object):
+    """Record the latency and SQL queries of each request by view."""
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.profile_rate = getattr(settings, 'METRICS_PROFILE_RATE', 0)
+
+    def __call__(self, request):
+        tracked = [
+            (connection, connection.force_debug_cursor,
+             len(connection.queries_log))
+            for connection in connections.all()
+        ]
+        for connection, _, _ in tracked:
+            connection.force_debug_cursor = True
+        profiler = None
+        if self.profile_rate and random.randrange(self.profile_rate) == 0:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.time() - start
+            if profiler is not None:
+                profiler.disable()
+            queries = []
+            for connection, debug_cursor, seen in tracked:
+                connection.force_debug_cursor = debug_cursor
+                queries.extend(list(connection.queries_log)[seen:])
+        view = view_name(request)
+        REQUEST_SECONDS.observe(elapsed, view, request.method)
+        REQUESTS.inc(view, response.status_code)
+        REQUEST_QUERIES.observe(len(queries), view)
+        REQUEST_SQL_SECONDS.observe(
+            sum(float(query['time']) for query in queries), view
+        )
+        if profiler is not None:
+            self.save_profile(profiler, view)
+        return response
+
+    def save_profile(self, profiler, view):
+        """Write the stats of a profiled request to METRICS_PROFILE_DIR."""
+        directory = settings.METRICS_PROFILE_DIR
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        profiler.dump_stats(os.path.join(directory, '{}-{}-{}.prof'.format(
+            view.replace(':', '-'), int(time.time() * 1000), os.getpid()
+        )))
+        PROFILED.inc(view)
+
+
+class InstrumentedTemplate(Template):
+    """A Django template which records how long it takes to render."""
+
+    def render(self, context=None, request=None):
+        start = time.time()
+        try:
+            return super(InstrumentedTemplate, self).render(context, request)
+        finally:
+            TEMPLATE_SECONDS.observe(
+                time.time() - start, self.origin.template_name or 'string'
+            )
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, recording template render times."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super(InstrumentedDjangoTemplates, self).get_template(
+            template_name
+        )
+        return InstrumentedTemplate(template.template, self)
+
+
+class InstrumentedThumbnailBackend(ThumbnailBackend):
+    """sorl's thumbnail backend, recording thumbnail creation times."""
+
+    def _create_thumbnail(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return super(InstrumentedThumbnailBackend, self)._create_thumbnail(
+                *args, **kwargs
+            )
+        finally:
+            THUMBNAIL_SECONDS.observe(time.time() - start)
@@ -0,0 +1,66 @@
+"""A PostgreSQL backend drawing connections from an in-process pool.
+
+With threaded servers, persistent connections are kept per thread, so
+idle threads hold connections the busy ones can't use. This backend
+shares up to POOL_SIZE connections (a key of the DATABASES entry)
+between all threads of the process: closing a connection at the end of
+a request returns it to the pool, and the next request on any thread
+takes it from there, skipping the connection and authentication round
+trips. Use it with CONN_MAX_AGE = 0.
+
+When all POOL_SIZE connections are in use, a request waits up to
+POOL_TIMEOUT seconds (another key, 30 by default) for one to be
+returned. Connections are checked before they are handed out.
+"""
+import threading
+
+from django.db.backends.postgresql import base
+from psycopg2 import pool
+
+from .pool import BlockingPool
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(alias, size, timeout, conn_params):
+    """Return the connection pool of a database alias, creating it once."""
+    with _lock:
+        if alias not in _pools:
+            _pools[alias] = BlockingPool(
+                pool.ThreadedConnectionPool(1, size, **conn_params),
+                size, timeout,
+            )
+        return _pools[alias]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_pool(self, conn_params=None):
+        """Return the pool this database's connections come from."""
+        if conn_params is None:
+            conn_params = self.get_connection_params()
+        size = int(self.settings_dict.get('POOL_SIZE') or 10)
+        timeout = float(self.settings_dict.get('POOL_TIMEOUT') or 30)
+        return get_pool(self.alias, size, timeout, conn_params)
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool(conn_params).getconn()
+        # Django turns autocommit back on once connected; starting from a
+        # fresh connection's state lets the isolation level be read below.
+        connection.autocommit = False
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool().putconn(self.connection)
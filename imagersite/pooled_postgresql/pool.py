@@ -0,0 +1,79 @@
+"""Checkout from a fixed-size connection pool, shared between threads.
+
+psycopg2's ThreadedConnectionPool raises PoolError as soon as every
+connection is in use. BlockingPool waits up to a timeout for one to be
+returned instead, so a burst of requests queues rather than failing,
+and checks each connection with a cheap query before handing it out,
+replacing connections the server has dropped.
+"""
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """No pooled connection was returned in time."""
+
+
+class BlockingPool(object):
+    """Hands out at most size connections of a pool at once."""
+
+    def __init__(self, connections, size, timeout):
+        self.connections = connections
+        self.size = size
+        self.timeout = timeout
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def getconn(self):
+        """Return a working connection, waiting for one if all are in use.
+
+        Raises PoolTimeout if none is returned within the timeout."""
+        deadline = time.time() + self.timeout
+        with self.condition:
+            while self.in_use >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        'No database connection free after {} seconds.'.format(
+                            self.timeout
+                        )
+                    )
+                self.condition.wait(remaining)
+            self.in_use += 1
+        try:
+            connection = self.connections.getconn()
+            while not self.usable(connection):
+                self.connections.putconn(connection, close=True)
+                connection = self.connections.getconn()
+        except Exception:
+            self.release()
+            raise
+        return connection
+
+    def putconn(self, connection, close=False):
+        """Return a connection to the pool and wake a waiting thread."""
+        try:
+            self.connections.putconn(connection, close=close)
+        finally:
+            self.release()
+
+    def release(self):
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify()
+
+    def usable(self, connection):
+        """Return whether a connection answers a query."""
+        if connection.closed:
+            return False
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+            if not connection.autocommit:
+                connection.rollback()
+        except Exception:
+            return False
+        return True
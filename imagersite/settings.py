@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'imagersite.metrics.InstrumentationMiddleware',
+    'imagersite.db.ConnectionHealthMiddleware',
+    'imagersite.db.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,6 +82,28 @@ TEMPLATES = [
 WSGI_APPLICATION = 'imagersite.wsgi.application'
 
 
+# Metrics
+# METRICS_ENABLED records request latency, SQL queries, template render
+# times and thumbnail creation times, served at /metrics in the
+# Prometheus format to METRICS_ALLOWED_IPS (to anyone if empty).
+# METRICS_PROFILE_RATE=N runs one request in N under cProfile, writing
+# the stats to METRICS_PROFILE_DIR.
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', False) == 'True'
+METRICS_ALLOWED_IPS = [
+    ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',')
+    if ip.strip()
+]
+METRICS_PROFILE_RATE = int(os.environ.get('METRICS_PROFILE_RATE', 0))
+METRICS_PROFILE_DIR = os.environ.get(
+    'METRICS_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles')
+)
+
+if METRICS_ENABLED:
+    TEMPLATES[0]['BACKEND'] = 'imagersite.metrics.InstrumentedDjangoTemplates'
+    THUMBNAIL_BACKEND = 'imagersite.metrics.InstrumentedThumbnailBackend'
+
+
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
 
@@ -90,9 +115,79 @@ DATABASES = {
         'PASSWORD': os.environ['DBPASS'],
         'HOST': os.environ['DBURL'],
         'PORT': os.environ['DBPORT'],
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# Seconds a persistent connection may sit idle before it is checked
+# with a ping at the start of the next request.
+DB_HEALTH_CHECK_INTERVAL = int(os.environ.get('DB_HEALTH_CHECK_INTERVAL', 30))
+
+# DB_POOL_SIZE shares that many connections between the threads of a
+# threaded server, rather than keeping one per thread.
+if int(os.environ.get('DB_POOL_SIZE', 0)):
+    DATABASES['default'].update(
+        ENGINE='imagersite.pooled_postgresql',
+        POOL_SIZE=int(os.environ['DB_POOL_SIZE']),
+        CONN_MAX_AGE=0,
+    )
+
+# DB_REPLICA_HOSTS is a comma separated list of read replicas of the
+# default database, which views decorated with read_replica read from.
+DATABASE_REPLICAS = []
+for i, host in enumerate(os.environ.get('DB_REPLICA_HOSTS', '').split(',')):
+    if host.strip():
+        alias = 'replica{}'.format(i)
+        DATABASES[alias] = dict(
+            DATABASES['default'],
+            HOST=host.strip(),
+            TEST={'MIRROR': 'default'},
+        )
+        DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['imagersite.db.ReplicaRouter']
+
+# Seconds a user's reads stay on the default database after they write,
+# so they see their changes before the replicas catch up.
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+# CACHE_BACKEND picks a least recently used memory cache for a single
+# process ("locmem", the default), a file cache in CACHE_LOCATION shared
+# by the processes of one host ("file"), or any other backend by its
+# dotted path with CACHE_LOCATION, such as a memcached or Redis server.
+# The memory cache holds at most CACHE_MAX_ENTRIES entries and, if set,
+# CACHE_MAX_BYTES bytes.
+
+CACHE_BACKENDS = {
+    'locmem': 'imagersite.cache.LRULocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+}
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS.get(CACHE_BACKEND, CACHE_BACKEND),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+if CACHE_BACKEND in CACHE_BACKENDS:
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 5000)),
+        'MAX_BYTES': int(os.environ.get('CACHE_MAX_BYTES', 0)),
+    }
+
+if CACHE_BACKEND == 'file' and not CACHES['default']['LOCATION']:
+    CACHES['default']['LOCATION'] = os.path.join(BASE_DIR, 'cache')
+
+# Seconds a rendered page fragment is kept. Fragments are keyed by the
+# generation counters in image.generations, so they never go stale.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -136,6 +231,18 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Stream every upload to a temporary file instead of holding small ones
+# in memory, so workers' memory doesn't grow with the size of uploads.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Hand media files to the front-end server instead of streaming them
+# from Python: an nginx internal location aliased to MEDIA_ROOT for
+# X-Accel-Redirect, or a header name such as X-Sendfile.
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX')
+MEDIA_SENDFILE_HEADER = os.environ.get('MEDIA_SENDFILE_HEADER')
+
 
 # Email credentials
 EMAIL_USE_TLS = True
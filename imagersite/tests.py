@@ -1,9 +1,24 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+from django.db import connection
+from django.conf import settings
+from django.test import RequestFactory, TestCase, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.core import mail
 from factory.django import DjangoModelFactory, ImageField
 from image.models import Photo
+from imagersite.cache import LRULocMemCache
+from imagersite.db import (
+    PIN_COOKIE, ReplicaRouter, check_connections, read_replica
+)
+from imagersite.pooled_postgresql.pool import BlockingPool, PoolTimeout
+from imagersite.metrics import (
+    PROFILED, THUMBNAIL_SECONDS, InstrumentedThumbnailBackend, clear_metrics
+)
 
 
 class PhotoFactory(DjangoModelFactory):
@@ -187,3 +202,286 @@ class RegisterTestCase(AuthenticatedTestCase):
             self.log_in(username=self.username + 'a').status_code,
             200
         )
+
+
+class LRULocMemCacheTestCase(TestCase):
+    """Test the least recently used memory cache backend."""
+
+    def make_cache(self, **options):
+        """Return an empty cache with options."""
+        cache = LRULocMemCache(self.id(), dict(OPTIONS=options))
+        cache.clear()
+        return cache
+
+    def test_evicts_least_recently_used(self):
+        """Test the entry read longest ago is evicted first."""
+        cache = self.make_cache(MAX_ENTRIES=3, CULL_FREQUENCY=3)
+        for key in 'abc':
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('d', 'd')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in 'acd'], ['a', 'c', 'd'])
+
+    def test_max_bytes(self):
+        """Test entries are evicted to stay within MAX_BYTES."""
+        cache = self.make_cache(MAX_ENTRIES=100, MAX_BYTES=2500)
+        for key in 'abc':
+            cache.set(key, b'x' * 1000)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), b'x' * 1000)
+
+    def test_expired_entries_leave_size(self):
+        """Test expired entries stop counting towards MAX_BYTES once
+        they are read or checked for."""
+        cache = self.make_cache(MAX_BYTES=2500)
+        cache.set('a', b'x' * 1000)
+        cache.set('b', b'x' * 1000)
+        for key in 'ab':
+            cache._expire_info[cache.make_key(key)] = 0
+        self.assertIsNone(cache.get('a'))
+        self.assertFalse(cache.has_key('b'))
+        self.assertEqual(cache._size, [0])
+        cache.set('c', b'x' * 1000)
+        cache.set('d', b'x' * 1000)
+        self.assertEqual(cache.get('c'), b'x' * 1000)
+
+    def test_incr_keeps_timeout(self):
+        """Test incrementing a value keeps its expiry."""
+        cache = self.make_cache()
+        cache.set('n', 1, 60)
+        self.assertEqual(cache.incr('n'), 2)
+        self.assertEqual(cache.get('n'), 2)
+        self.assertIsNotNone(cache._expire_info[cache.make_key('n')])
+
+
+@override_settings(DATABASE_REPLICAS=['replica0'])
+class ReplicaRouterTestCase(TestCase):
+    """Test reads in read_replica views are routed to a replica."""
+
+    def route(self, request):
+        """Return the database a read is routed to during request."""
+        return read_replica(
+            lambda request: ReplicaRouter().db_for_read(Photo)
+        )(request)
+
+    def test_get_reads_replica(self):
+        """Test GET requests read from the replica."""
+        self.assertEqual(self.route(RequestFactory().get('/')), 'replica0')
+
+    def test_post_reads_primary(self):
+        """Test other requests read from the default database."""
+        self.assertIsNone(self.route(RequestFactory().post('/')))
+
+    def test_pinned_reads_primary(self):
+        """Test a user who just wrote reads from the default database."""
+        request = RequestFactory().get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertIsNone(self.route(request))
+
+    def test_outside_views_primary(self):
+        """Test reads outside read_replica views aren't routed."""
+        self.route(RequestFactory().get('/'))
+        self.assertIsNone(ReplicaRouter().db_for_read(Photo))
+        self.assertEqual(ReplicaRouter().db_for_write(Photo), 'default')
+
+    def test_write_pins(self):
+        """Test a successful write sets the pin cookie."""
+        user = User.objects.create(username='writer')
+        self.client.force_login(user)
+        response = self.client.post(reverse('add_album'), dict(
+            title='pinned', description='', published='Public'
+        ))
+        self.assertIn(PIN_COOKIE, response.cookies)
+        response = self.client.get(reverse('library'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ConnectionHealthTestCase(TestCase):
+    """Test idle persistent connections are checked."""
+
+    def test_usable_connection_kept(self):
+        """Test a working connection survives the check."""
+        connection.ensure_connection()
+        raw = connection.connection
+        connection.last_used = 0
+        check_connections()
+        self.assertIs(connection.connection, raw)
+
+    def test_requests_mark_use(self):
+        """Test requests record when connections were last used."""
+        self.client.get(reverse('home'))
+        self.assertGreater(connection.last_used, 0)
+
+
+class FakeConnection(object):
+    """A stand-in for a psycopg2 connection, which may have been dropped."""
+
+    def __init__(self, dropped=False):
+        self.closed = False
+        self.autocommit = True
+        self.dropped = dropped
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        if self.dropped:
+            raise IOError('server closed the connection unexpectedly')
+
+    def close(self):
+        pass
+
+
+class FakePool(object):
+    """A stand-in for ThreadedConnectionPool, which fails when all of its
+    connections are in use."""
+
+    def __init__(self, size, dropped=0):
+        self.size = size
+        self.dropped = dropped
+        self.out = set()
+        self.most = 0
+        self.lock = threading.Lock()
+
+    def getconn(self):
+        with self.lock:
+            if len(self.out) >= self.size:
+                raise RuntimeError('connection pool exhausted')
+            connection = FakeConnection(dropped=self.dropped > 0)
+            self.dropped -= 1
+            self.out.add(connection)
+            self.most = max(self.most, len(self.out))
+            return connection
+
+    def putconn(self, connection, close=False):
+        with self.lock:
+            self.out.remove(connection)
+
+
+class BlockingPoolTestCase(TestCase):
+    """Test pooled connections are waited for and checked."""
+
+    def test_more_threads_than_connections(self):
+        """Test threads beyond the pool size wait for a connection."""
+        connections = FakePool(2)
+        pool = BlockingPool(connections, 2, timeout=5)
+        errors = []
+
+        def request():
+            try:
+                connection = pool.getconn()
+                time.sleep(0.01)
+                pool.putconn(connection)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(connections.most, 2)
+        self.assertEqual(pool.in_use, 0)
+
+    def test_timeout(self):
+        """Test waiting gives up after the timeout."""
+        pool = BlockingPool(FakePool(1), 1, timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+
+    def test_dropped_connection_replaced(self):
+        """Test a connection failing its check is replaced."""
+        connections = FakePool(2, dropped=1)
+        connection = BlockingPool(connections, 2, timeout=1).getconn()
+        self.assertFalse(connection.dropped)
+        self.assertEqual(connections.out, set([connection]))
+
+
+INSTRUMENTED_TEMPLATES = [dict(
+    settings.TEMPLATES[0],
+    BACKEND='imagersite.metrics.InstrumentedDjangoTemplates',
+)]
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_ALLOWED_IPS=[],
+                   TEMPLATES=INSTRUMENTED_TEMPLATES)
+class MetricsTestCase(TestCase):
+    """Test requests are instrumented and the metrics exported."""
+
+    def setUp(self):
+        clear_metrics()
+
+    def metrics(self):
+        """Return the exported metrics."""
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode('utf-8')
+
+    def test_request_recorded(self):
+        """Test a request's latency, queries and templates are recorded."""
+        self.client.get(reverse('home'))
+        metrics = self.metrics()
+        self.assertIn(
+            'imager_requests_total{view="home",status="200"} 1', metrics
+        )
+        self.assertIn(
+            'imager_request_duration_seconds_count{view="home",method="GET"} 1',
+            metrics
+        )
+        self.assertIn('imager_request_queries_count{view="home"} 1', metrics)
+        self.assertIn(
+            'imager_request_sql_duration_seconds_sum{view="home"}', metrics
+        )
+        self.assertIn(
+            'imager_template_render_duration_seconds_count'
+            '{template="home.html"} 1', metrics
+        )
+
+    def test_histogram_buckets(self):
+        """Test histogram buckets are cumulative."""
+        self.client.get(reverse('home'))
+        self.assertIn(
+            'imager_request_queries_bucket{view="home",le="+Inf"} 1',
+            self.metrics()
+        )
+
+    def test_thumbnail_time_recorded(self):
+        """Test creating a thumbnail file is timed."""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        user = User.objects.create(username='thumbs')
+        with self.settings(MEDIA_ROOT=media_root):
+            photo = PhotoFactory(user=user)
+            InstrumentedThumbnailBackend().get_thumbnail(
+                photo.photo.path, '10x10'
+            )
+        self.assertIn('imager_thumbnail_render_duration_seconds_count 1',
+                      '\n'.join(THUMBNAIL_SECONDS.samples()))
+
+    def test_profile_sampled(self):
+        """Test sampled requests are profiled to a file."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.settings(METRICS_PROFILE_RATE=1,
+                           METRICS_PROFILE_DIR=directory):
+            self.client.get(reverse('home'))
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertIn('imager_profiled_requests_total{view="home"} 1',
+                      '\n'.join(PROFILED.samples()))
+
+    def test_allowed_ips(self):
+        """Test metrics are only served to the allowed addresses."""
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_disabled(self):
+        """Test nothing is recorded or served when disabled."""
+        with self.settings(METRICS_ENABLED=False):
+            self.client.get(reverse('home'))
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('view="home"', self.metrics())
@@ -18,17 +18,22 @@ from django.contrib import admin
 from django.conf import settings
 from django.conf.urls.static import static
 
-from .views import home_view
+from image.views import media_view
+from .views import home_view, metrics_view
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^$', home_view, name='home'),
+    url(r'^metrics$', metrics_view, name='metrics'),
     url(r'^accounts/', include('registration.backends.hmac.urls')),
     url(r'^profile/', include('user_profile.urls')),
     url(r'^images/', include('image.urls')),
     url(r'^api/v1/', include('imager_api.urls')),
+    url(
+        r'^{}(?P<path>.+)$'.format(settings.MEDIA_URL.lstrip('/')),
+        media_view,
+        name='media'
+    ),
 ] + static(
     settings.STATIC_URL, document_root=settings.STATIC_ROOT
-) + static(
-    settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
 )
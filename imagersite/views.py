@@ -1,12 +1,28 @@
+from django.http import Http404, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
-from image.models import Photo
+from image.sampler import random_public_photo
 from django.conf import settings
+from imagersite.db import read_replica
+from imagersite.metrics import enabled, render_metrics
 
+@read_replica
 def home_view(request):
     """Return rendered home page."""
-    random_photo = Photo.objects.filter(published='Public').order_by("?").first()
+    random_photo = random_public_photo()
     if random_photo:
         random_photo = random_photo.photo.url
     else:
         random_photo = settings.STATIC_URL + 'bird.jpg'
     return render(request, 'home.html', context={"random_image_url": random_photo})
+
+
+def metrics_view(request):
+    """Return the recorded metrics in the Prometheus text format."""
+    if not enabled():
+        raise Http404
+    allowed = settings.METRICS_ALLOWED_IPS
+    if allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(), content_type='text/plain; version=0.0.4'
+    )
@@ -0,0 +1,138 @@
+/*
+ * Picks the photos and cover of an album on its edit page.
+ *
+ * The user's photos are loaded from the album photos API a page at a
+ * time, as they ask for more, rather than all being listed in the form.
+ * Ticked and unticked photos and the chosen cover are collected and sent
+ * back to the same API as one change.
+ */
+(function () {
+  'use strict';
+
+  var widget = document.getElementById('album-photos');
+  if (!widget) {
+    return;
+  }
+  var url = widget.getAttribute('data-url');
+  var list = widget.querySelector('.album-photos-list');
+  var status = widget.querySelector('.album-photos-status');
+  var more = widget.querySelector('.album-photos-more');
+  var save = widget.querySelector('.album-photos-save');
+  var token = document.querySelector('input[name=csrfmiddlewaretoken]');
+
+  var next = url + '?page_size=50';
+  var changes = {add: {}, remove: {}};
+  var cover;
+
+  function changed() {
+    save.disabled = false;
+    status.textContent = '';
+  }
+
+  function toggle(photo, box) {
+    var from = box.checked ? changes.remove : changes.add;
+    var to = box.checked ? changes.add : changes.remove;
+    if (from[photo.id]) {
+      delete from[photo.id];
+    } else if (box.checked !== photo.in_album) {
+      to[photo.id] = true;
+    }
+    changed();
+  }
+
+  function row(photo, coverId) {
+    var item = document.createElement('label');
+    item.className = 'libraryobject';
+    var box = document.createElement('input');
+    box.type = 'checkbox';
+    box.checked = photo.in_album;
+    box.addEventListener('change', function () {
+      toggle(photo, box);
+    });
+    var radio = document.createElement('input');
+    radio.type = 'radio';
+    radio.name = 'album-cover';
+    radio.title = 'Cover';
+    radio.checked = photo.id === coverId;
+    radio.addEventListener('change', function () {
+      cover = photo.id;
+      if (!box.checked) {
+        box.checked = true;
+        toggle(photo, box);
+      }
+      changed();
+    });
+    item.appendChild(box);
+    item.appendChild(radio);
+    if (photo.thumbnail) {
+      var image = document.createElement('img');
+      image.src = photo.thumbnail;
+      item.appendChild(image);
+    }
+    item.appendChild(document.createTextNode(photo.title || 'untitled'));
+    return item;
+  }
+
+  function request(method, target, body) {
+    return fetch(target, {
+      method: method,
+      credentials: 'same-origin',
+      headers: {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'X-CSRFToken': token ? token.value : ''
+      },
+      body: body ? JSON.stringify(body) : undefined
+    }).then(function (response) {
+      return response.json().then(function (data) {
+        if (!response.ok) {
+          throw new Error(data.detail || JSON.stringify(data));
+        }
+        return data;
+      });
+    });
+  }
+
+  function load(message) {
+    more.hidden = true;
+    status.textContent = 'Loading photos...';
+    request('GET', next).then(function (page) {
+      page.results.forEach(function (photo) {
+        list.appendChild(row(photo, page.cover));
+      });
+      next = page.next;
+      more.hidden = !next;
+      status.textContent = message || '';
+    }).catch(function (error) {
+      status.textContent = error.message;
+      more.hidden = false;
+    });
+  }
+
+  function ids(set) {
+    return Object.keys(set).map(Number);
+  }
+
+  more.addEventListener('click', function () {
+    load();
+  });
+  save.addEventListener('click', function () {
+    var body = {add: ids(changes.add), remove: ids(changes.remove)};
+    if (cover !== undefined) {
+      body.cover = cover;
+    }
+    save.disabled = true;
+    request('POST', url, body).then(function (result) {
+      changes = {add: {}, remove: {}};
+      cover = undefined;
+      list.innerHTML = '';
+      next = url + '?page_size=50';
+      load('Added ' + result.added + ', removed ' + result.removed + '.');
+    }).catch(function (error) {
+      status.textContent = error.message;
+      save.disabled = false;
+    });
+  });
+
+  load();
+}());
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from user_profile.models import UserProfile, count_objects
+
+
+class Command(BaseCommand):
+    """Repair the photo, album and tag counters of user profiles."""
+
+    help = (
+        'Recount every user\'s photos, public photos, albums and tags and '
+        'fix any profile counters which drifted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*', help='Only reconcile these users.'
+        )
+
+    def handle(self, *args, **options):
+        profiles = UserProfile.objects.select_related('user')
+        if options['usernames']:
+            profiles = profiles.filter(user__username__in=options['usernames'])
+        fixed = 0
+        for profile in profiles.iterator():
+            counts = count_objects(profile.user)
+            if any(getattr(profile, name) != n for name, n in counts.items()):
+                UserProfile.objects.filter(pk=profile.pk).update(**counts)
+                fixed += 1
+        self.stdout.write('Fixed the counters of {} profiles'.format(fixed))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-18 09:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_objects(apps, schema_editor):
+    """Fill in the counters of existing profiles."""
+    UserProfile = apps.get_model('user_profile', 'UserProfile')
+    Photo = apps.get_model('image', 'Photo')
+    Album = apps.get_model('image', 'Album')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    content_type = ContentType.objects.filter(
+        app_label='image', model='photo'
+    ).first()
+    for profile in UserProfile.objects.all():
+        photos = Photo.objects.filter(user_id=profile.user_id)
+        tags = TaggedItem.objects.filter(
+            content_type=content_type,
+            object_id__in=photos.values('id'),
+        ).values('tag_id').distinct()
+        profile.photo_count = photos.count()
+        profile.public_photo_count = photos.filter(published='Public').count()
+        profile.album_count = Album.objects.filter(
+            user_id=profile.user_id
+        ).count()
+        profile.tag_count = tags.count() if content_type else 0
+        profile.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('image', '0016_content_addressed_storage'),
+        ('taggit', '0002_auto_20150616_2121'),
+        ('user_profile', '0007_auto_20161002_0049'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='album_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='public_photo_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='tag_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_objects, migrations.RunPython.noop),
+    ]
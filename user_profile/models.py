@@ -1,8 +1,12 @@
 from __future__ import unicode_literals
 from django.db import models
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils.encoding import python_2_unicode_compatible
+from taggit.models import Tag, TaggedItem
+from image.models import Album, Photo
 
 
 class ProfileManager(models.Manager):
@@ -36,6 +40,13 @@ class UserProfile(models.Model):
     hireable = models.BooleanField(default=False)
     website = models.CharField(max_length=128, blank=True)
 
+    # Denormalized counts of the user's objects, kept up to date by the
+    # signal handlers below and repaired by reconcile_profile_counters.
+    photo_count = models.PositiveIntegerField(default=0)
+    public_photo_count = models.PositiveIntegerField(default=0)
+    album_count = models.PositiveIntegerField(default=0)
+    tag_count = models.PositiveIntegerField(default=0)
+
     def __repr__(self):
         return 'UserProfile(first_name={})'.format(self.user.first_name)
 
@@ -46,6 +57,129 @@ class UserProfile(models.Model):
 @receiver(models.signals.post_save, sender=User)
 def create_profile(sender, **kwargs):
     """Create a new profile for a newly-created User."""
-    UserProfile(
-        user=kwargs['instance']
-    ).save()
+    if kwargs['created']:
+        UserProfile(
+            user=kwargs['instance']
+        ).save()
+
+
+def count_objects(user):
+    """Count a user's photos, public photos, albums and distinct tags."""
+    return dict(
+        photo_count=user.photos.count(),
+        public_photo_count=user.photos.filter(published='Public').count(),
+        album_count=user.albums.count(),
+        tag_count=Tag.objects.filter(photo__user=user).distinct().count(),
+    )
+
+
+def reconcile_counters(user):
+    """Recount a user's objects and store the counts on their profile."""
+    UserProfile.objects.filter(user=user).update(**count_objects(user))
+
+
+def add_to_counters(user_id, **changes):
+    """Add changes to the named counters of a user's profile.
+
+    Counters which have drifted low stop at zero rather than going
+    negative."""
+    if user_id is None:
+        return
+    UserProfile.objects.filter(user_id=user_id).update(**dict(
+        (name, Greatest(F(name) + change, 0))
+        for name, change in changes.items()
+    ))
+
+
+def gained_tags(user_id, tag_ids):
+    """Return how many of tag_ids just added to a photo are on no other
+    photo of the user."""
+    return Tag.objects.filter(
+        id__in=tag_ids, photo__user_id=user_id
+    ).annotate(photos=Count('photo')).filter(photos=1).count()
+
+
+def lost_tags(user_id, tag_ids):
+    """Return how many of tag_ids just taken off a photo are on no other
+    photo of the user."""
+    return len(tag_ids) - Tag.objects.filter(
+        id__in=tag_ids, photo__user_id=user_id
+    ).distinct().count()
+
+
+def update_tag_count(user_id):
+    """Recount the distinct tags a user's photos are tagged with."""
+    if user_id is None:
+        return
+    UserProfile.objects.filter(user_id=user_id).update(
+        tag_count=Tag.objects.filter(photo__user_id=user_id).distinct().count()
+    )
+
+
+@receiver(models.signals.post_save, sender=Photo)
+def count_saved_photo(sender, instance, created, **kwargs):
+    """Count a new photo, or a change to whether a photo is public."""
+    public = int(instance.published == 'Public')
+    if created:
+        add_to_counters(
+            instance.user_id, photo_count=1, public_photo_count=public
+        )
+    elif instance.field_changed('published'):
+        was_public = int(instance._loaded['published'] == 'Public')
+        if public != was_public:
+            add_to_counters(
+                instance.user_id, public_photo_count=public - was_public
+            )
+
+
+@receiver(models.signals.pre_delete, sender=Photo)
+def remember_deleted_tags(sender, instance, **kwargs):
+    """Note a photo's tags before they are deleted with it."""
+    instance._counted_tags = set(instance.tags.values_list('id', flat=True))
+
+
+@receiver(models.signals.post_delete, sender=Photo)
+def count_deleted_photo(sender, instance, **kwargs):
+    """Stop counting a deleted photo and the tags only it had."""
+    was_public = int(instance._loaded['published'] == 'Public')
+    add_to_counters(
+        instance.user_id, photo_count=-1, public_photo_count=-was_public,
+        tag_count=-lost_tags(instance.user_id, instance._counted_tags),
+    )
+
+
+@receiver(models.signals.post_save, sender=Album)
+def count_saved_album(sender, instance, created, **kwargs):
+    """Count a new album."""
+    if created:
+        add_to_counters(instance.user_id, album_count=1)
+
+
+@receiver(models.signals.post_delete, sender=Album)
+def count_deleted_album(sender, instance, **kwargs):
+    """Stop counting a deleted album."""
+    add_to_counters(instance.user_id, album_count=-1)
+
+
+@receiver(models.signals.m2m_changed, sender=TaggedItem)
+def count_tags(sender, instance, action, pk_set, **kwargs):
+    """Count the tags a photo gains or loses which the user's other
+    photos don't have."""
+    if not isinstance(instance, Photo) or instance.user_id is None:
+        return
+    if action == 'pre_clear':
+        instance._counted_tags = set(
+            instance.tags.values_list('id', flat=True)
+        )
+    elif action == 'post_add' and pk_set:
+        add_to_counters(
+            instance.user_id,
+            tag_count=gained_tags(instance.user_id, pk_set)
+        )
+    elif action == 'post_remove' and pk_set or action == 'post_clear':
+        removed = pk_set if action == 'post_remove' else (
+            instance._counted_tags
+        )
+        add_to_counters(
+            instance.user_id, tag_count=-lost_tags(instance.user_id, removed)
+        )
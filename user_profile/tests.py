@@ -1,6 +1,11 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.core.management import call_command
+from django.utils.six import StringIO
+from image.models import Album, Photo
 from .models import UserProfile
 from imagersite.tests import AuthenticatedTestCase
 
@@ -87,3 +92,120 @@ class EditProfileTestCase(TestCase):
         self.assertEqual(response.status_code, 302)
         profile = UserProfile.objects.filter(user=self.user).first()
         self.assertEqual(profile.camera_type, new_camera_type)
+
+
+class ProfileCounterTestCase(TestCase):
+    """Test case for the denormalized counters on profiles."""
+
+    def setUp(self):
+        """Set up a user with two photos and an album."""
+        self.user = User(username='Cris')
+        self.user.save()
+        self.photos = []
+        for published in ('Public', 'Private'):
+            photo = Photo(user=self.user, title='photo', published=published)
+            photo.save()
+            self.photos.append(photo)
+        self.photos[0].tags.add('one', 'two')
+        self.photos[1].tags.add('two')
+        self.album = Album(user=self.user, title='album')
+        self.album.save()
+
+    def counters(self):
+        """Return the user's current profile counters."""
+        profile = UserProfile.objects.get(user=self.user)
+        return dict(
+            photos=profile.photo_count,
+            public=profile.public_photo_count,
+            albums=profile.album_count,
+            tags=profile.tag_count,
+        )
+
+    def test_counters(self):
+        """Test the counters count the user's objects."""
+        self.assertEqual(
+            self.counters(), dict(photos=2, public=1, albums=1, tags=2)
+        )
+
+    def test_publish(self):
+        """Test publishing a photo counts it as public."""
+        self.photos[1].published = 'Public'
+        self.photos[1].save()
+        self.assertEqual(self.counters()['public'], 2)
+
+    def test_unpublish(self):
+        """Test making a photo private stops counting it as public."""
+        self.photos[0].published = 'Shared'
+        self.photos[0].save()
+        self.assertEqual(self.counters()['public'], 0)
+
+    def test_delete_photo(self):
+        """Test deleting a photo stops counting it and its tags."""
+        self.photos[0].delete()
+        self.assertEqual(
+            self.counters(), dict(photos=1, public=0, albums=1, tags=1)
+        )
+
+    def test_delete_album(self):
+        """Test deleting an album stops counting it."""
+        self.album.delete()
+        self.assertEqual(self.counters()['albums'], 0)
+
+    def test_remove_tag(self):
+        """Test removing a photo's last use of a tag stops counting it."""
+        self.photos[0].tags.remove('one')
+        self.assertEqual(self.counters()['tags'], 1)
+
+    def test_remove_shared_tag(self):
+        """Test removing a tag another photo still has keeps counting it."""
+        self.photos[0].tags.remove('two')
+        self.assertEqual(self.counters()['tags'], 2)
+        self.photos[0].tags.clear()
+        self.assertEqual(self.counters()['tags'], 1)
+
+    def test_tag_queries(self):
+        """Test tagging doesn't recount the user's other tags."""
+        with CaptureQueriesContext(connection) as few:
+            self.photos[0].tags.add('three')
+        for i in range(20):
+            self.photos[1].tags.add('extra{}'.format(i))
+        with CaptureQueriesContext(connection) as many:
+            self.photos[0].tags.add('four')
+        self.assertEqual(len(few), len(many))
+        counts = [query['sql'] for query in many
+                  if 'COUNT' in query['sql'] and 'taggit_tag' in query['sql']]
+        self.assertTrue(counts)
+        for sql in counts:
+            self.assertIn('"taggit_tag"."id" IN', sql)
+        self.assertEqual(self.counters()['tags'], 24)
+
+    def test_drifted_counter_stops_at_zero(self):
+        """Test counters which drifted to zero aren't taken below it."""
+        UserProfile.objects.filter(user=self.user).update(
+            photo_count=0, public_photo_count=0, tag_count=0
+        )
+        self.photos[0].delete()
+        self.assertEqual(
+            self.counters(), dict(photos=0, public=0, albums=1, tags=0)
+        )
+
+    def test_reconcile(self):
+        """Test the reconcile command repairs drifted counters."""
+        UserProfile.objects.filter(user=self.user).update(
+            photo_count=10, tag_count=0
+        )
+        out = StringIO()
+        call_command('reconcile_profile_counters', stdout=out)
+        self.assertIn('Fixed the counters of 1 profiles', out.getvalue())
+        self.assertEqual(
+            self.counters(), dict(photos=2, public=1, albums=1, tags=2)
+        )
+
+    def test_profile_page_counts(self):
+        """Test the profile page shows the counters without counting."""
+        self.client.force_login(self.user)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('profile'))
+        self.assertContains(response, 'Photos uploaded: 2')
+        self.assertContains(response, 'Public photos: 1')
+        self.assertContains(response, 'Tags used: 2')
@@ -16,8 +16,10 @@ def profile_view(request):
         'is_professional': request.user.profile.is_professional,
         'hireable': request.user.profile.hireable,
         'request': request,
-        'photos_uploaded': len(request.user.photos.all()),
-        'albums_created': len(request.user.albums.all()),
+        'photos_uploaded': request.user.profile.photo_count,
+        'public_photos': request.user.profile.public_photo_count,
+        'albums_created': request.user.profile.album_count,
+        'tags_used': request.user.profile.tag_count,
     })
 
 